@@ -0,0 +1,75 @@
+"""
+Synthetic restaurant CSVs in the format of restaurants/data/restaurants.csv.
+
+Hours strings cover every format the parser accepts: single days, day ranges, a range and a single
+day in either order, one to four hours sets per row, on-the-hour and half-hour times, and windows that close after
+midnight (including sunday night into monday). From the `liine` directory:
+
+  python -m benchmarks.data --rows 100000 --output /tmp/restaurants_100k.csv
+"""
+import argparse
+import csv
+import random
+from typing import Iterator, List, Tuple
+
+DAY_NAMES = ["Mon", "Tues", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# each layout is a list of day groups, a group being (start, end) day ranges sharing the same hours
+LAYOUTS: List[List[List[Tuple[int, int]]]] = [
+  [[(0, 6)]],
+  [[(0, 4)], [(5, 6)]],
+  [[(0, 3), (6, 6)], [(4, 5)]],
+  [[(0, 4), (5, 5)], [(6, 6)]],
+  [[(1, 4), (6, 6)], [(5, 5)]],
+  [[(0, 2)], [(3, 4)], [(5, 5)], [(6, 6)]],
+  [[(0, 4)], [(5, 5)]],
+  [[(0, 0), (2, 4)], [(5, 6)]],
+  [[(1, 1)], [(0, 0), (2, 6)]],
+]
+
+
+def _clock(minute: int, rng: random.Random) -> str:
+  hour, minute = divmod(minute % (24 * 60), 60)
+  meridiem = 'am' if hour < 12 else 'pm'
+  hour = hour % 12 or 12
+  if minute == 0 and rng.random() < 0.8:
+    return f'{hour} {meridiem}'
+  return f'{hour}:{minute:02d} {meridiem}'
+
+def _days(group: List[Tuple[int, int]]) -> str:
+  return ', '.join(
+    DAY_NAMES[start] if start == end else f'{DAY_NAMES[start]}-{DAY_NAMES[end]}'
+    for start, end in group
+  )
+
+def random_hours(rng: random.Random) -> str:
+  hours_sets = []
+  for group in rng.choice(LAYOUTS):
+    opening = rng.randrange(6 * 2, 18 * 2) * 30
+    # between 4 and 15 hours later, so some windows close after midnight
+    closing = opening + rng.randrange(4 * 2, 15 * 2 + 1) * 30
+    hours_sets.append(f'{_days(group)} {_clock(opening, rng)} - {_clock(closing, rng)}')
+  return '  / '.join(hours_sets)
+
+def generate_rows(rows: int, seed: int = 0) -> Iterator[Tuple[str, str]]:
+  rng = random.Random(seed)
+  for i in range(rows):
+    yield f'Restaurant {i}', random_hours(rng)
+
+def write_csv(path: str, rows: int, seed: int = 0) -> None:
+  with open(path, 'w', newline='') as file:
+    writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+    writer.writerow(["Restaurant Name", "Hours"])
+    writer.writerows(generate_rows(rows, seed))
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--rows', type=int, default=1000)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--output', required=True)
+  options = parser.parse_args()
+  write_csv(options.output, options.rows, options.seed)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+"""
+Microbenchmark of the hours-string parser against the regex + strptime functions it replaced.
+
+Run from the `liine` directory:
+
+  python -m benchmarks.hours_parser [--repeat N]
+
+"cold" clears the parser caches before every pass, so it measures the compiled patterns and the hand
+written time conversion alone; "warm" measures a feed where every hours set has been seen before.
+"""
+import argparse
+import csv
+import datetime
+import re
+import timeit
+from pathlib import Path
+from typing import List
+
+from restaurants import hours
+
+DATA_FILE = Path(__file__).resolve().parent.parent / 'restaurants' / 'data' / 'restaurants.csv'
+LEGACY_DAYS_BUG = re.compile('[A-Za-z]+, [A-Za-z]+-')
+
+
+def legacy_parse_days(hours_set: str) -> List[int]:
+  days = []
+  day_pattern = "[A-Za-z]+-[A-Za-z]+, [A-Za-z]+| [A-Za-z]+, [A-Za-z]+-[A-Za-z]+|[A-Za-z]+-[A-Za-z]+|[A-Za-z]{3,}"
+  day_pattern_match = re.search(day_pattern, hours_set)
+  day_pattern_found = hours_set[day_pattern_match.start():day_pattern_match.end()]
+  if ',' in day_pattern_found:
+    for clause in day_pattern_found.split(','):
+      if '-' in clause:
+        start_day, end_day = clause.split('-')
+        days.extend(hours.DAYS_RANGE[hours.DAY_TO_NUMBER_MAPPING[start_day]:hours.DAY_TO_NUMBER_MAPPING[end_day] + 1])
+      else:
+        days.append(hours.DAY_TO_NUMBER_MAPPING[clause.strip()])
+  else:
+    if '-' in day_pattern_found:
+      start_day, end_day = day_pattern_found.split('-')
+      days.extend(hours.DAYS_RANGE[hours.DAY_TO_NUMBER_MAPPING[start_day]:hours.DAY_TO_NUMBER_MAPPING[end_day] + 1])
+    else:
+      days.append(hours.DAY_TO_NUMBER_MAPPING[day_pattern_found])
+  return days
+
+def legacy_parse_time(hours_set: str) -> List[datetime.time]:
+  hours_pattern = "[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}|[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}"
+  hours_pattern_match = re.search(hours_pattern, hours_set)
+  hours_pattern_found = hours_set[hours_pattern_match.start():hours_pattern_match.end()]
+  hours_massaged = []
+  for raw_hours in [hour.strip() for hour in hours_pattern_found.split('-')]:
+    if ':' in raw_hours:
+      hours_massaged.append(raw_hours)
+    else:
+      if len(raw_hours) == 4:
+        hours_massaged.append(raw_hours[:1] + ':00 ' + raw_hours[2:])
+      if len(raw_hours) == 5:
+        hours_massaged.append(raw_hours[:2] + ':00 ' + raw_hours[3:])
+  return [datetime.datetime.strptime(raw_hours, '%I:%M %p').time() for raw_hours in hours_massaged]
+
+
+def load_hours_sets() -> List[str]:
+  with open(DATA_FILE, 'r', newline='') as file:
+    return [hours_set for row in csv.DictReader(file) for hours_set in row['Hours'].split('/')]
+
+def legacy_pass(hours_sets: List[str]) -> None:
+  for hours_set in hours_sets:
+    legacy_parse_time(hours_set)
+    legacy_parse_days(hours_set)
+
+def cold_pass(hours_sets: List[str]) -> None:
+  hours.parse_time.cache_clear()
+  hours.parse_days.cache_clear()
+  warm_pass(hours_sets)
+
+def warm_pass(hours_sets: List[str]) -> None:
+  for hours_set in hours_sets:
+    hours.parse_time(hours_set)
+    hours.parse_days(hours_set)
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--repeat', type=int, default=2000, help='passes over the bundled data set (default 2000)')
+  options = parser.parse_args()
+
+  hours_sets = load_hours_sets()
+  for hours_set in hours_sets:
+    # the legacy parser drops the range of a single day then a range, ex. "Mon, Wed-Sun"
+    if not LEGACY_DAYS_BUG.search(hours_set):
+      assert list(hours.parse_days(hours_set)) == legacy_parse_days(hours_set), hours_set
+    assert list(hours.parse_time(hours_set)) == legacy_parse_time(hours_set), hours_set
+
+  parsed = len(hours_sets) * options.repeat
+  baseline = None
+  print(f'{parsed} hours sets per run')
+  for label, run in (('legacy', legacy_pass), ('cold', cold_pass), ('warm', warm_pass)):
+    seconds = min(timeit.repeat(lambda: run(hours_sets), number=options.repeat, repeat=3))
+    baseline = baseline or seconds
+    print(f'{label:>8}: {seconds:.3f}s  {parsed / seconds:,.0f} sets/sec  {baseline / seconds:.1f}x')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,98 @@
+"""
+HTTP load test for the search endpoint, used to compare server setups on the same machine.
+
+Opens `--connections` keep-alive connections and sends searches for random minutes of the week as
+fast as the server answers, for `--duration` seconds. Start the server under test first, ex.
+
+  gunicorn liine.wsgi --workers 1 --threads 8 --bind 127.0.0.1:8000
+  uvicorn liine.asgi:application --workers 1 --port 8000
+
+then, from the `liine` directory:
+
+  python -m benchmarks.load_test --url http://127.0.0.1:8000/search/ --connections 200
+
+Only the standard library is used, so the client itself needs no extra packages.
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import statistics
+import time
+from typing import List, Tuple
+from urllib.parse import quote, urlsplit
+
+MONDAY = datetime.datetime(2024, 7, 8)
+
+
+def random_timestamp() -> str:
+  return str(MONDAY + datetime.timedelta(minutes=random.randrange(7 * 24 * 60))) + '.0'
+
+async def read_response(reader: asyncio.StreamReader) -> int:
+  status_line = await reader.readline()
+  if not status_line:
+    raise ConnectionError('server closed the connection')
+  length = 0
+  while True:
+    line = await reader.readline()
+    if line in (b'\r\n', b''):
+      break
+    name, _, value = line.decode('latin-1').partition(':')
+    if name.lower() == 'content-length':
+      length = int(value)
+  await reader.readexactly(length)
+  return int(status_line.split()[1])
+
+async def client(host: str, port: int, path: str, deadline: float, latencies: List[float], errors: List[int]) -> None:
+  reader, writer = await asyncio.open_connection(host, port)
+  try:
+    while time.perf_counter() < deadline:
+      request = (
+        f'GET {path}?timestamp={quote(random_timestamp())} HTTP/1.1\r\n'
+        f'Host: {host}\r\nConnection: keep-alive\r\n\r\n'
+      )
+      started = time.perf_counter()
+      writer.write(request.encode('ascii'))
+      await writer.drain()
+      status = await read_response(reader)
+      latencies.append(time.perf_counter() - started)
+      if status != 200:
+        errors.append(status)
+  except (ConnectionError, asyncio.IncompleteReadError):
+    errors.append(0)
+  finally:
+    writer.close()
+
+async def run(url: str, connections: int, duration: float) -> Tuple[List[float], List[int], float]:
+  parts = urlsplit(url)
+  latencies: List[float] = []
+  errors: List[int] = []
+  started = time.perf_counter()
+  deadline = started + duration
+  await asyncio.gather(*(
+    client(parts.hostname, parts.port or 80, parts.path or '/', deadline, latencies, errors)
+    for _ in range(connections)
+  ))
+  return latencies, errors, time.perf_counter() - started
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--url', default='http://127.0.0.1:8000/search/')
+  parser.add_argument('--connections', type=int, default=100)
+  parser.add_argument('--duration', type=float, default=10.0, help='seconds (default 10)')
+  options = parser.parse_args()
+
+  latencies, errors, elapsed = asyncio.run(run(options.url, options.connections, options.duration))
+  if not latencies:
+    raise SystemExit(f'no responses, {len(errors)} errors')
+  latencies.sort()
+  print(f'{len(latencies)} requests over {options.connections} connections in {elapsed:.1f}s, {len(errors)} errors')
+  print(f'{len(latencies) / elapsed:,.0f} requests/sec')
+  print(
+    f'latency p50 {statistics.median(latencies) * 1000:.1f}ms '
+    f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms'
+  )
+
+
+if __name__ == '__main__':
+  main()
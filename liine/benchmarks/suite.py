@@ -0,0 +1,154 @@
+"""
+Benchmark suite for parsing, ingestion and search at several data sizes.
+
+For every scale a synthetic CSV is generated (see benchmarks.data), then the suite measures:
+
+  parse    hours strings parsed per second by utils.parse_hours, caches cleared first
+  load     wall time of `loaddata --bulk` into an empty scratch SQLite database
+  index    time to build the in-memory week index
+  search   p50/p99 latency of execute_search (ids fetched) through the index and through the ORM,
+           and of execute_search_values straight from the index
+
+Results are written as JSON with the git commit, so runs can be compared between commits. Nothing
+touches the development database, data version or snapshot. From the `liine` directory:
+
+  python -m benchmarks.suite --scales 1000 100000 1000000 --output bench_results.json
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import django
+
+MONDAY = datetime.datetime(2024, 7, 8)
+
+
+def setup_django(directory: str) -> None:
+  os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'liine.settings')
+  from django.conf import settings
+  settings.DATABASES['default']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+  settings.RESTAURANTS_DATA_VERSION_FILE = os.path.join(directory, 'data_version')
+  settings.RESTAURANTS_SNAPSHOT_FILE = os.path.join(directory, 'restaurants.snapshot')
+  settings.DEBUG = False
+  django.setup()
+
+def git_commit() -> str:
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return ''
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+  samples = sorted(samples)
+  return {
+    'p50_ms': statistics.median(samples) * 1000,
+    'p99_ms': samples[max(int(len(samples) * 0.99) - 1, 0)] * 1000,
+  }
+
+def time_calls(call: Callable[[str], object], timestamps: List[str]) -> Dict[str, float]:
+  samples = []
+  for timestamp in timestamps:
+    started = time.perf_counter()
+    call(timestamp)
+    samples.append(time.perf_counter() - started)
+  return percentiles(samples)
+
+def run_scale(rows: int, directory: str, searches: int) -> Dict[str, object]:
+  from django.core.management import call_command
+
+  from benchmarks.data import write_csv
+  from restaurants import hours
+  from restaurants.index import get_index
+  from restaurants.utils import _parse_hours, execute_search, execute_search_values
+
+  path = os.path.join(directory, f'restaurants_{rows}.csv')
+  write_csv(path, rows)
+  with open(path, 'r', newline='') as file:
+    hours_strings = [row['Hours'] for row in csv.DictReader(file)]
+
+  hours.parse_days.cache_clear()
+  hours.parse_time.cache_clear()
+  _parse_hours.cache_clear()
+  started = time.perf_counter()
+  for hours_string in hours_strings:
+    _parse_hours(hours_string)
+  parse_seconds = time.perf_counter() - started
+
+  call_command('flush', interactive=False, verbosity=0)
+  started = time.perf_counter()
+  call_command('loaddata', file=path, bulk=True, stdout=StringIO())
+  load_seconds = time.perf_counter() - started
+
+  started = time.perf_counter()
+  get_index()
+  index_seconds = time.perf_counter() - started
+
+  rng = random.Random(rows)
+  timestamps = [
+    str(MONDAY + datetime.timedelta(minutes=rng.randrange(7 * 24 * 60))) + '.0' for _ in range(searches)
+  ]
+  return {
+    'rows': rows,
+    'parse': {'seconds': parse_seconds, 'rows_per_sec': rows / parse_seconds},
+    'load': {'seconds': load_seconds, 'rows_per_sec': rows / load_seconds},
+    'index_build_seconds': index_seconds,
+    'search': {
+      'index': time_calls(lambda t: list(execute_search(t, use_index=True).values_list('pk', flat=True)), timestamps),
+      'orm': time_calls(lambda t: list(execute_search(t, use_index=False).values_list('pk', flat=True)), timestamps),
+      'index_values': time_calls(lambda t: list(execute_search_values(t, use_index=True)), timestamps),
+    },
+  }
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--scales', type=int, nargs='+', default=[1000, 100000, 1000000])
+  parser.add_argument('--searches', type=int, default=200, help='searches timed per path (default 200)')
+  parser.add_argument('--output', default='bench_results.json')
+  options = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as directory:
+    setup_django(directory)
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+    results = []
+    for rows in options.scales:
+      result = run_scale(rows, directory, options.searches)
+      results.append(result)
+      search = result['search']
+      print(
+        f"{rows:>9} rows  parse {result['parse']['rows_per_sec']:>10,.0f}/s  "
+        f"load {result['load']['seconds']:>8.2f}s  index {result['index_build_seconds']:>6.2f}s  "
+        f"search p50/p99 index {search['index']['p50_ms']:.2f}/{search['index']['p99_ms']:.2f}ms  "
+        f"orm {search['orm']['p50_ms']:.2f}/{search['orm']['p99_ms']:.2f}ms  "
+        f"values {search['index_values']['p50_ms']:.2f}/{search['index_values']['p99_ms']:.2f}ms",
+        flush=True
+      )
+
+  with open(options.output, 'w') as file:
+    json.dump({
+      'commit': git_commit(),
+      'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+      'python': sys.version.split()[0],
+      'platform': platform.platform(),
+      'results': results,
+    }, file, indent=2)
+  print(f'Results written to {options.output}')
+
+
+if __name__ == '__main__':
+  main()
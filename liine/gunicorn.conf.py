@@ -0,0 +1,21 @@
+"""
+Gunicorn settings for production, used by the container:
+
+  gunicorn -c gunicorn.conf.py liine.wsgi
+
+Worker processes default to 2 per CPU plus one, each with a few threads; override them with
+WEB_CONCURRENCY and GUNICORN_THREADS. Every thread keeps its own persistent database connection
+(see DB_CONN_MAX_AGE in settings), and the search index is shared between workers through the
+snapshot file written by loaddata.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+keepalive = 5
+# recycle workers now and then, staggered so they do not all restart at once
+max_requests = 10000
+max_requests_jitter = 1000
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class RestaurantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restaurants'
+
+    def ready(self):
+        from restaurants.db import configure_sqlite
+        from restaurants.metrics import install_sql_recorder
+        from restaurants.version import mark_data_changed
+
+        connection_created.connect(configure_sqlite, dispatch_uid='configure_sqlite')
+        connection_created.connect(install_sql_recorder, dispatch_uid='install_sql_recorder')
+
+        # any change to the hours data makes the in-memory search index and caches stale
+        for model_name in ('Restaurant', 'OperatingDay', 'OperatingHours', 'OpeningWindow', 'SpecialHours'):
+            model = self.get_model(model_name)
+            post_save.connect(mark_data_changed, sender=model, dispatch_uid=f'mark_data_changed_{model_name}_save')
+            post_delete.connect(mark_data_changed, sender=model, dispatch_uid=f'mark_data_changed_{model_name}_delete')
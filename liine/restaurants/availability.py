@@ -0,0 +1,168 @@
+"""
+Vectorized availability over the whole dataset, for analytics: restaurants by time slot open/closed
+matrices, counts of open restaurants per slot and batch point queries.
+
+NumPy is optional and only needed here, install it with `pip install -r requirements-analytics.txt`.
+Everything is answered at minute resolution like `execute_search`; a slot is sampled at its first
+minute.
+"""
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+
+from restaurants.index import MINUTES_PER_DAY, MINUTES_PER_WEEK
+from restaurants.models import Restaurant, OpeningWindow
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+DAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+# restaurants x minutes cells computed at once when a result is reduced block by block
+BLOCK_CELLS = 1 << 22
+
+def numpy_available() -> bool:
+  return np is not None
+
+def _require_numpy() -> None:
+  if np is None:
+    raise ImproperlyConfigured('NumPy is required for availability matrices: pip install -r requirements-analytics.txt')
+
+def slot_minutes(step: int) -> "np.ndarray":
+  """
+  The first minute of every `step` minute slot of the week.
+  """
+  _require_numpy()
+  return np.arange(0, MINUTES_PER_WEEK, step)
+
+def slot_label(minute: int) -> str:
+  day, minute = divmod(int(minute) % MINUTES_PER_WEEK, MINUTES_PER_DAY)
+  return f'{DAY_NAMES[day]} {minute // 60:02d}:{minute % 60:02d}'
+
+
+class AvailabilityEngine:
+  """
+  Every opening window as NumPy arrays: the restaurant's row, and the first and last minute of the
+  window.
+
+  A query sorts the minutes asked for, maps each window onto the range of those minutes it covers
+  with `searchsorted`, marks the range in a difference array and takes a cumulative sum. The work is
+  a handful of array passes, however many minutes are asked for.
+  """
+
+  def __init__(self, ids: Sequence[int], names: Sequence[str], rows: Sequence[int], starts: Sequence[int], ends: Sequence[int]):
+    """
+    :param ids: restaurant ids, ascending; row `i` of every result is restaurant `ids[i]`.
+    :param names: restaurant names, in the order of `ids`.
+    :param rows: the row of the restaurant of every window, ascending.
+    :param starts: the first minute of the week of every window.
+    :param ends: the last minute of the week of every window, inclusive.
+    """
+    _require_numpy()
+    self.ids = np.asarray(ids, dtype=np.int64)
+    self.names = list(names)
+    self._rows, self._starts, self._ends = self._merge(
+      np.asarray(rows, dtype=np.int64), np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+    )
+
+  @staticmethod
+  def _merge(rows: "np.ndarray", starts: "np.ndarray", ends: "np.ndarray"):
+    """
+    Merge each restaurant's overlapping windows, so a restaurant is open at a minute exactly when one
+    window covers it and counts can be summed over windows.
+    """
+    if not len(rows):
+      return rows, starts, ends
+    order = np.lexsort((starts, rows))
+    rows, starts, ends = rows[order], starts[order], ends[order]
+    # shifting every restaurant past the previous one makes a running maximum stay within a restaurant
+    shift = rows * MINUTES_PER_WEEK
+    reach = np.maximum.accumulate(ends + shift)
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = starts[1:] + shift[1:] > reach[:-1]
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(rows)) - 1
+    return rows[first], starts[first], reach[last] - shift[first]
+
+  @classmethod
+  def from_db(cls) -> "AvailabilityEngine":
+    _require_numpy()
+    restaurants = list(Restaurant.objects.order_by('id').values_list('id', 'name'))
+    ids = np.array([restaurant_id for restaurant_id, _ in restaurants], dtype=np.int64)
+    windows = OpeningWindow.objects.order_by('restaurant_id').values_list(
+      'restaurant_id', 'start_minute_of_week', 'end_minute_of_week'
+    )
+    windows = np.array(list(windows.iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 3)
+    rows = np.searchsorted(ids, windows[:, 0])
+    return cls(ids, [name for _, name in restaurants], rows, windows[:, 1], windows[:, 2])
+
+  def matrix(self, minutes: Sequence[int], first_row: int = 0, last_row: Optional[int] = None) -> "np.ndarray":
+    """
+    Whether each restaurant is open at each of the given minutes of the week.
+
+    :param minutes: minutes of the week, in any order, repeats allowed.
+    :param first_row: first restaurant row to include.
+    :param last_row: restaurant row to stop before, defaults to all of them.
+    :return: a boolean array of restaurants (rows `first_row` to `last_row`) by `minutes`.
+    """
+    if last_row is None:
+      last_row = len(self.ids)
+    minutes = np.asarray(minutes, dtype=np.int64) % MINUTES_PER_WEEK
+    order = np.argsort(minutes, kind='stable')
+    ordered = minutes[order]
+
+    low, high = np.searchsorted(self._rows, [first_row, last_row])
+    rows = self._rows[low:high] - first_row
+    # the window covers ordered minutes [first, last)
+    first = np.searchsorted(ordered, self._starts[low:high], side='left')
+    last = np.searchsorted(ordered, self._ends[low:high], side='right')
+
+    width = len(ordered) + 1
+    size = (last_row - first_row) * width
+    changes = np.bincount(rows * width + first, minlength=size) - np.bincount(rows * width + last, minlength=size)
+    covered = np.cumsum(changes.reshape(-1, width)[:, :-1], axis=1) > 0
+
+    result = np.empty_like(covered)
+    result[:, order] = covered
+    return result
+
+  def blocks(self, minutes: Sequence[int]) -> Iterator[Tuple[int, "np.ndarray"]]:
+    """
+    `matrix` over every restaurant, a block of rows at a time of about `BLOCK_CELLS` cells, so memory
+    stays bounded however many restaurants and minutes there are.
+
+    :return: the first row of each block and the block.
+    """
+    block_rows = max(BLOCK_CELLS // (len(minutes) + 1), 1)
+    for first_row in range(0, len(self.ids), block_rows):
+      last_row = min(first_row + block_rows, len(self.ids))
+      yield first_row, self.matrix(minutes, first_row, last_row)
+
+  def counts(self, minutes: Sequence[int]) -> "np.ndarray":
+    """
+    The number of restaurants open at each of the given minutes of the week, summed straight over the
+    merged windows without building the matrix.
+    """
+    minutes = np.asarray(minutes, dtype=np.int64) % MINUTES_PER_WEEK
+    order = np.argsort(minutes, kind='stable')
+    ordered = minutes[order]
+    first = np.searchsorted(ordered, self._starts, side='left')
+    last = np.searchsorted(ordered, self._ends, side='right')
+    width = len(ordered) + 1
+    changes = np.bincount(first, minlength=width) - np.bincount(last, minlength=width)
+    counts = np.empty(len(ordered), dtype=np.int64)
+    counts[order] = np.cumsum(changes[:-1])
+    return counts
+
+  def lookup(self, minutes: Sequence[int]) -> List["np.ndarray"]:
+    """
+    Batch point queries: for each of the given minutes of the week, the ids of the restaurants open
+    then, ascending.
+    """
+    found: List[List["np.ndarray"]] = [[] for _ in minutes]
+    for first_row, block in self.blocks(minutes):
+      ids = self.ids[first_row:first_row + len(block)]
+      for column in range(block.shape[1]):
+        found[column].append(ids[block[:, column]])
+    return [np.concatenate(parts) if parts else np.empty(0, dtype=np.int64) for parts in found]
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+from django.conf import settings
+
+from restaurants.version import data_version
+
+class VersionedLRUCache:
+  """
+  A thread-safe LRU cache that empties itself whenever the hours data version changes, so entries
+  computed from old data are never served. Keeps hit and miss counters for sizing.
+  """
+
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self._entries: OrderedDict = OrderedDict()
+    self._version = None
+    self._lock = threading.Lock()
+
+  def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    Return the cached value for `key`, calling `compute` and caching its result on a miss. A result
+    computed while the data version changed is returned but not cached.
+    """
+    version = data_version()
+    with self._lock:
+      if version != self._version:
+        self._entries.clear()
+        self._version = version
+      if key in self._entries:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]
+      self.misses += 1
+
+    value = compute()
+
+    if self.maxsize > 0 and data_version() == version:
+      with self._lock:
+        if self._version == version:
+          self._entries[key] = value
+          while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    return value
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+      self.hits = self.misses = 0
+
+  def info(self) -> Dict[str, int]:
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "size": len(self._entries),
+      "maxsize": self.maxsize
+    }
+
+
+# rendered /search/ pages keyed by the minute of the week in each time zone
+search_cache = VersionedLRUCache(getattr(settings, 'RESTAURANTS_SEARCH_CACHE_SIZE', 2048))
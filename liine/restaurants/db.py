@@ -0,0 +1,16 @@
+"""
+Per-connection database setup.
+"""
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs) -> None:
+  """
+  Apply `RESTAURANTS_SQLITE_PRAGMAS` to a new SQLite connection. Connected to `connection_created`.
+  """
+  if connection.vendor != 'sqlite':
+    return
+  pragmas = getattr(settings, 'RESTAURANTS_SQLITE_PRAGMAS', {})
+  with connection.cursor() as cursor:
+    for name, value in pragmas.items():
+      cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,149 @@
+"""
+Blue/green generations of the restaurant hours data, so searches never read a half-loaded dataset.
+
+Every restaurant belongs to a `Dataset` generation and the models' default managers only return the
+rows of one: the active generation, or the one `restaurants.models.writing_generation` is loading. A
+full load writes a new generation next to the active one, which searches go on reading without
+waiting on the load's transactions. Once the load is complete, `activate` validates it and flips the
+active generation in one transaction, and `loaddata` publishes a data version so every process drops
+the indexes built from the previous one. The previous generation is kept for `rollback`, older ones
+are deleted by `collect`.
+
+Restaurants get new ids in every generation: a full load leaves no index to update in place, and
+cursors over ids from before it do not carry over.
+"""
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from restaurants.ingest import DEFAULT_BATCH_SIZE
+from restaurants.models import (
+  Dataset, OpeningWindow, OperatingHours, Restaurant, SpecialHours, forget_active_generation
+)
+
+# generations kept by `collect`, the active one and the one `rollback` returns to
+DEFAULT_KEEP = 2
+
+def start(source: str = '') -> Dataset:
+  """
+  Create a generation to load restaurants into, invisible to searches until `activate`.
+  """
+  return Dataset.objects.create(state=Dataset.State.LOADING, source=source[:255])
+
+def validate(dataset: Dataset) -> Dict[str, int]:
+  """
+  Check a loaded generation can replace the active one: it has restaurants, each with opening windows,
+  and at least one window for each of its operating hours.
+
+  :raises ValueError: naming what is wrong.
+  :return: the number of restaurants and windows.
+  """
+  restaurants = Restaurant.all_generations.filter(generation=dataset)
+  counts = {'restaurants': restaurants.count()}
+  if not counts['restaurants']:
+    raise ValueError(f'Generation {dataset.pk} has no restaurants.')
+  without_hours = restaurants.filter(openingwindow_set=None).count()
+  if without_hours:
+    raise ValueError(f'Generation {dataset.pk} has {without_hours} restaurants without opening windows.')
+  counts['windows'] = OpeningWindow.all_generations.filter(restaurant__generation=dataset).count()
+  hours = OperatingHours.all_generations.filter(operating_day__restaurant__generation=dataset).count()
+  # hours past midnight are stored as two windows, so there can be more windows than hours
+  if counts['windows'] < hours:
+    raise ValueError(f'Generation {dataset.pk} has {hours} operating hours but {counts["windows"]} opening windows.')
+  return counts
+
+def _carry_special_hours(previous: Dataset, dataset: Dataset, batch_size: int) -> int:
+  # special hours are loaded on their own, so a new generation keeps those of the restaurants it still has
+  restaurant_ids = dict(Restaurant.all_generations.filter(generation=dataset).values_list('name', 'id'))
+  special_hours = [
+    SpecialHours(restaurant_id=restaurant_ids[name], date=date, opening_time=opening_time, closing_time=closing_time)
+    for name, date, opening_time, closing_time in SpecialHours.all_generations.filter(
+      restaurant__generation=previous
+    ).values_list('restaurant__name', 'date', 'opening_time', 'closing_time').iterator()
+    if name in restaurant_ids
+  ]
+  SpecialHours.all_generations.bulk_create(special_hours, batch_size=batch_size)
+  return len(special_hours)
+
+def _flip(dataset: Dataset, previous: Optional[Dataset]) -> None:
+  if previous is not None:
+    previous.state = Dataset.State.RETIRED
+    previous.save(update_fields=['state'])
+  dataset.state = Dataset.State.ACTIVE
+  dataset.activated_at = timezone.now()
+  dataset.save(update_fields=['state', 'activated_at'])
+  forget_active_generation()
+
+def activate(dataset: Dataset, batch_size: int = DEFAULT_BATCH_SIZE) -> Optional[Dataset]:
+  """
+  Validate a loaded generation, copy the active generation's special hours into it and make it the
+  active generation, in one transaction. Publish a data version afterwards for other processes.
+
+  :raises ValueError: if the generation is not valid, see `validate`.
+  :return: the generation that was active before, now retired.
+  """
+  validate(dataset)
+  with transaction.atomic():
+    previous = Dataset.objects.select_for_update().filter(state=Dataset.State.ACTIVE).first()
+    if previous is not None:
+      _carry_special_hours(previous, dataset, batch_size)
+    _flip(dataset, previous)
+  return previous
+
+def rollback() -> Dataset:
+  """
+  Make the most recently retired generation active again, retiring the active one, so rolling back
+  twice returns to where it started. Publish a data version afterwards for other processes.
+
+  :raises ValueError: if there is no retired generation left.
+  :return: the generation now active.
+  """
+  with transaction.atomic():
+    dataset = Dataset.objects.select_for_update().filter(
+      state=Dataset.State.RETIRED
+    ).order_by('-activated_at', '-pk').first()
+    if dataset is None:
+      raise ValueError('There is no previous generation to roll back to.')
+    _flip(dataset, Dataset.objects.select_for_update().filter(state=Dataset.State.ACTIVE).first())
+  return dataset
+
+def _delete(dataset: Dataset, batch_size: int) -> None:
+  # restaurants a batch at a time, each deleting its days, hours, windows and special hours with it
+  restaurant_ids = list(Restaurant.all_generations.filter(generation=dataset).values_list('pk', flat=True))
+  for start in range(0, len(restaurant_ids), batch_size):
+    Restaurant.all_generations.filter(pk__in=restaurant_ids[start:start + batch_size]).delete()
+  dataset.delete()
+
+def discard(dataset: Dataset, batch_size: int = DEFAULT_BATCH_SIZE) -> None:
+  """
+  Delete a generation that failed to load, marking it failed first so a crash midway leaves it for
+  `collect`.
+  """
+  Dataset.objects.filter(pk=dataset.pk).update(state=Dataset.State.FAILED)
+  _delete(dataset, batch_size)
+
+def collect(keep: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> List[int]:
+  """
+  Delete failed generations, and the retired ones beyond the `keep` most recent generations
+  (`RESTAURANTS_GENERATIONS_KEPT`, 2 by default: the active one and the one before it). Generations
+  still loading are left alone.
+
+  :return: the ids of the deleted generations.
+  """
+  if keep is None:
+    keep = getattr(settings, 'RESTAURANTS_GENERATIONS_KEPT', DEFAULT_KEEP)
+  retired = Dataset.objects.filter(state=Dataset.State.RETIRED).order_by('-activated_at', '-pk')
+  deleted = list(retired[max(keep - 1, 0):]) + list(Dataset.objects.filter(state=Dataset.State.FAILED))
+  deleted_ids = [dataset.pk for dataset in deleted]
+  for dataset in deleted:
+    _delete(dataset, batch_size)
+  return deleted_ids
+
+def generations() -> List[Dataset]:
+  """
+  Every generation, newest first, with its number of restaurants as `restaurant_count`.
+  """
+  return list(Dataset.objects.annotate(restaurant_count=Count('restaurants')).order_by('-pk'))
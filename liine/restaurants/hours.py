@@ -0,0 +1,139 @@
+"""
+Parser for the human-readable hours strings in the restaurant data, ex. "Mon-Fri, Sat 11 am - 12 pm",
+and `format_hours` to write them back.
+
+Patterns are compiled once at import and time tokens are converted by hand instead of through
+`datetime.strptime`. Results are memoized per hours set, since chains repeat the same hours string
+across many locations. Memoized results are tuples; callers that need to mutate them must copy.
+"""
+import datetime
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set, Tuple
+
+DAY_TO_NUMBER_MAPPING = {
+  "Mon": 0,
+  "Tues": 1,
+  "Wed": 2,
+  "Thu": 3,
+  "Fri": 4,
+  "Sat": 5,
+  "Sun": 6
+}
+
+DAYS_RANGE = tuple(range(7))
+NUMBER_TO_DAY_MAPPING = {number: day for day, number in DAY_TO_NUMBER_MAPPING.items()}
+
+CACHE_SIZE = 4096
+
+DAY_PATTERN = re.compile(
+  "[A-Za-z]+-[A-Za-z]+, [A-Za-z]+|[A-Za-z]+, [A-Za-z]+-[A-Za-z]+|[A-Za-z]+-[A-Za-z]+|[A-Za-z]{3,}"
+)
+HOURS_PATTERN = re.compile(
+  "[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}"
+  "|[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}"
+)
+
+
+class HoursFormatError(AttributeError):
+  """
+  Raised when an hours set has no recognizable days or hours. Subclasses AttributeError, which the
+  original regex-based parser raised on the unmatched search result.
+  """
+
+
+def _day_range(start_day: str, end_day: str) -> Tuple[int, ...]:
+  return DAYS_RANGE[DAY_TO_NUMBER_MAPPING[start_day]:DAY_TO_NUMBER_MAPPING[end_day] + 1]
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_days(hours_set: str) -> Tuple[int, ...]:
+  """
+  Return the day numbers (0 = Monday) an hours set applies to, ex. (0, 1, 2, 3, 4, 5) for
+  "Mon-Fri, Sat 11 am - 12 pm" or (0, 2, 3, 4) for "Mon, Wed-Fri 11 am - 10 pm".
+  """
+  match = DAY_PATTERN.search(hours_set)
+  if match is None:
+    raise HoursFormatError(f'No days found in hours set {hours_set!r}')
+  day_pattern_found = match.group()
+
+  if ',' not in day_pattern_found:
+    if '-' in day_pattern_found:
+      return _day_range(*day_pattern_found.split('-'))
+    return (DAY_TO_NUMBER_MAPPING[day_pattern_found],)
+
+  # non-consecutive days that share hours
+  days = []
+  for clause in day_pattern_found.split(','):
+    if '-' in clause:
+      days.extend(_day_range(*clause.strip().split('-')))
+    else:
+      days.append(DAY_TO_NUMBER_MAPPING[clause.strip()])
+  return tuple(days)
+
+def _parse_clock(token: str) -> datetime.time:
+  """
+  Convert a 12-hour clock token such as "5 pm" or "12:30 am" into a time, accepting exactly what
+  `strptime(..., '%I:%M %p')` accepted for the same token.
+  """
+  clock, _, meridiem = token.partition(' ')
+  hour, _, minute = clock.partition(':')
+  hour = int(hour)
+  minute = int(minute) if minute else 0
+  if not 1 <= hour <= 12 or not 0 <= minute <= 59 or meridiem not in ('am', 'pm'):
+    raise ValueError(f"time data {token!r} does not match format '%I:%M %p'")
+  hour %= 12
+  if meridiem == 'pm':
+    hour += 12
+  return datetime.time(hour, minute)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_time(hours_set: str) -> Tuple[datetime.time, datetime.time]:
+  """
+  Return the opening and closing time of an hours set, ex. (11:00, 12:00) for
+  "Mon-Fri, Sat 11 am - 12 pm".
+  """
+  match = HOURS_PATTERN.search(hours_set)
+  if match is None:
+    raise HoursFormatError(f'No hours found in hours set {hours_set!r}')
+  opening, closing = match.group().split(' - ')
+  return _parse_clock(opening), _parse_clock(closing)
+
+def _format_clock(time: datetime.time) -> str:
+  hour = time.hour % 12 or 12
+  clock = f'{hour}:{time.minute:02d}' if time.minute else str(hour)
+  return f"{clock} {'pm' if time.hour >= 12 else 'am'}"
+
+def _format_days(days: Set[int]) -> List[Tuple[int, str]]:
+  runs: List[List[int]] = []
+  for day in sorted(days):
+    if runs and runs[-1][-1] == day - 1:
+      runs[-1].append(day)
+    else:
+      runs.append([day])
+  labels = [
+    (run[0], NUMBER_TO_DAY_MAPPING[run[0]] + (f'-{NUMBER_TO_DAY_MAPPING[run[-1]]}' if len(run) > 1 else ''))
+    for run in runs
+  ]
+  # the only lists of days `parse_days` reads are a range and a single day
+  if len(runs) == 2 and (len(runs[0]) == 1) != (len(runs[1]) == 1):
+    return [(runs[0][0], ', '.join(label for _, label in labels))]
+  return labels
+
+def format_hours(windows: Iterable[Tuple[int, datetime.time, datetime.time]]) -> str:
+  """
+  Write opening windows as a compact hours string that `parse_days` and `parse_time` read back, days
+  sharing the same hours grouped together, ex. "Mon-Fri, Sun 11 am - 10 pm / Sat 10 am - 1 am".
+
+  :param windows: `(day, opening_time, closing_time)` per window, a window closing at or before its
+  opening time running past midnight.
+  :return: the hours sets separated by ' / ', ordered by their first day and opening time.
+  """
+  days_by_hours: Dict[Tuple[datetime.time, datetime.time], Set[int]] = {}
+  for day, opening_time, closing_time in windows:
+    days_by_hours.setdefault((opening_time, closing_time), set()).add(day)
+  hours_sets = sorted(
+    (first_day, opening_time, label, f'{_format_clock(opening_time)} - {_format_clock(closing_time)}')
+    for (opening_time, closing_time), days in days_by_hours.items()
+    for first_day, label in _format_days(days)
+  )
+  return ' / '.join(f'{label} {hours}' for _, _, label, hours in hours_sets)
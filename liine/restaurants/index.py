@@ -0,0 +1,863 @@
+import datetime
+import heapq
+import math
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Type, TypeVar
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import transaction
+
+from restaurants.models import (
+  Restaurant, OpeningWindow, SpecialHours, current_generation_id, known_generation_id, remember_active_generation
+)
+from restaurants.snapshot import Snapshot, load_snapshot, snapshot_file, write_snapshot
+from restaurants.version import data_version
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# mean earth radius, distances are great-circle distances on a sphere
+EARTH_RADIUS_KM = 6371.0088
+# `WeekIndex` segments between two full bitsets, the others are stored as the bits flipped since the
+# segment before
+CHECKPOINT_INTERVAL = 32
+
+def week_minute(day: int, time: datetime.time) -> int:
+  """
+  Convert a weekday (0 = Monday) and a time of day into a minute of the week (0 - 10079).
+  Seconds and microseconds are dropped, searches are answered at minute resolution.
+  """
+  return day * MINUTES_PER_DAY + time.hour * 60 + time.minute
+
+def default_zone() -> str:
+  """
+  The zone of restaurants with no time zone of their own, the `TIME_ZONE` setting.
+  """
+  return settings.TIME_ZONE
+
+def zone_week_minute(minute: int, instant: Optional[datetime.datetime], zone: str) -> int:
+  """
+  The minute of the week a search falls on in a time zone.
+
+  :param minute: the minute of the week of the search in the zone of `instant`, or in every zone.
+  :param instant: the aware instant searched, or None for a wall time in every zone.
+  :param zone: IANA name of the zone.
+  """
+  if instant is None or str(instant.tzinfo) == zone:
+    return minute
+  local = instant.astimezone(ZoneInfo(zone))
+  return week_minute(local.weekday(), local.time())
+
+
+class WeekIndex:
+  """
+  Maps every minute of the week to the set of restaurants open during it.
+
+  The week is cut into segments at every opening/closing boundary found in the data. The open
+  restaurants of a segment form a bitset (one bit per restaurant position), and a 10,080 entry array
+  maps a minute straight to its segment, so a lookup never touches the database. Only every
+  `CHECKPOINT_INTERVAL`th segment keeps its full bitset, the others the positions whose bit flipped
+  at their boundary. Memory grows with segments / 32 * restaurants / 8 bytes plus 4 bytes per opening
+  and closing, rather than segments * restaurants / 8: for a million restaurants over all 10,080
+  minutes, 40 MB of checkpoints instead of 1.26 GB of bitsets. A bitset
+  is rebuilt from its checkpoint and decoded into restaurant ids the first time a segment is asked
+  for, and the ids are kept afterwards.
+
+  Minutes are wall time in each restaurant's own time zone. A search at an instant is converted once
+  per zone (`local_minutes`) and every zone's restaurants are read from its minute's bitset through
+  a mask of the zone's positions, so the cost grows with the number of zones, not restaurants.
+  """
+
+  def __init__(
+    self, windows: Iterable[Tuple[int, int, int]], names: Mapping[int, str], zones: Optional[Mapping[int, str]] = None
+  ):
+    """
+    :param windows: `(restaurant_id, start_minute, end_minute)` tuples, both ends inclusive and
+    within a single week.
+    :type windows: Iterable[Tuple[int, int, int]]
+    :param names: restaurant names keyed by restaurant id.
+    :type names: Mapping[int, str]
+    :param zones: IANA time zone names keyed by restaurant id, missing or blank for `default_zone`.
+    :type zones: Optional[Mapping[int, str]]
+    """
+    ids = array('q', sorted(names))
+    position = {restaurant_id: i for i, restaurant_id in enumerate(ids)}
+
+    # +1/-1 events per restaurant position, keyed by the minute they take effect
+    events: Dict[int, List[Tuple[int, int]]] = {0: []}
+    for restaurant_id, start, end in windows:
+      events.setdefault(start, []).append((position[restaurant_id], 1))
+      if end + 1 < MINUTES_PER_WEEK:
+        events.setdefault(end + 1, []).append((position[restaurant_id], -1))
+
+    # a restaurant can have overlapping windows, so count them before flipping its bit, and one
+    # closing as the next opens flips it twice at the same boundary, which leaves it as it was
+    counts: Dict[int, int] = {}
+    bits = bytearray((len(ids) + 7) // 8)
+    boundaries = sorted(events)
+    checkpoints, flip_offsets, flips = [], array('q', [0]), array('I')
+    for segment, boundary in enumerate(boundaries):
+      flipped = set()
+      for pos, delta in events[boundary]:
+        count = counts.get(pos, 0) + delta
+        counts[pos] = count
+        if count == delta or count == 0:
+          if pos in flipped:
+            flipped.remove(pos)
+          else:
+            flipped.add(pos)
+      for pos in flipped:
+        bits[pos >> 3] ^= 1 << (pos & 7)
+      flips.extend(sorted(flipped))
+      flip_offsets.append(len(flips))
+      if segment % CHECKPOINT_INTERVAL == 0:
+        checkpoints.append(bytes(bits))
+
+    zones = zones or {}
+    restaurant_zones = [zones.get(restaurant_id) or default_zone() for restaurant_id in ids]
+    zone_names = sorted(set(restaurant_zones)) or [default_zone()]
+    zone_number = {zone: i for i, zone in enumerate(zone_names)}
+    zone_of = array('H', [zone_number[zone] for zone in restaurant_zones])
+    self._set_timeline(
+      ids, names, array('I', boundaries), CHECKPOINT_INTERVAL, checkpoints, flip_offsets, flips, zone_names, zone_of
+    )
+
+  @classmethod
+  def from_timeline(
+    cls,
+    ids: Sequence[int],
+    names: Mapping[int, str],
+    boundaries: Sequence[int],
+    interval: int,
+    checkpoints: Sequence[bytes],
+    flip_offsets: Sequence[int],
+    flips: Sequence[int],
+    zone_names: Optional[Sequence[str]] = None,
+    zone_of: Optional[Sequence[int]] = None
+  ) -> "WeekIndex":
+    """
+    Rebuild an index from the `timeline` and `zones` of another, without recomputing it. The
+    sequences are used as they are, so they can be views of a memory-mapped file. Without zones every
+    restaurant is in `default_zone`.
+    """
+    index = cls.__new__(cls)
+    if zone_names is None:
+      zone_names, zone_of = [default_zone()], array('H', bytes(2 * len(ids)))
+    index._set_timeline(ids, names, boundaries, interval, checkpoints, flip_offsets, flips, zone_names, zone_of)
+    return index
+
+  def _set_timeline(
+    self,
+    ids: Sequence[int],
+    names: Mapping[int, str],
+    boundaries: Sequence[int],
+    interval: int,
+    checkpoints: Sequence[bytes],
+    flip_offsets: Sequence[int],
+    flips: Sequence[int],
+    zone_names: Sequence[str],
+    zone_of: Sequence[int]
+  ) -> None:
+    self.names = names
+    self._ids = ids
+    self._boundaries = boundaries
+    self._interval = interval
+    self._checkpoints = checkpoints
+    self._flip_offsets = flip_offsets
+    self._flips = flips
+    self._zone_names = tuple(zone_names)
+    self._zone_of = zone_of
+    # per zone, an int with the bits of its restaurant positions, made on first use
+    self._zone_masks: List[Optional[int]] = [None] * len(self._zone_names)
+    self._zone_members: Dict[Tuple[int, int], Tuple[int, ...]] = {}
+
+    self._segment_of = array('I', bytes(4 * MINUTES_PER_WEEK))
+    for segment, start in enumerate(boundaries):
+      end = boundaries[segment + 1] if segment + 1 < len(boundaries) else MINUTES_PER_WEEK
+      self._segment_of[start:end] = array('I', [segment]) * (end - start)
+
+    self._members: List[Optional[Tuple[int, ...]]] = [None] * len(boundaries)
+
+  @property
+  def timeline(self) -> Tuple[Sequence[int], Sequence[int], int, Sequence[bytes], Sequence[int], Sequence[int]]:
+    """
+    The restaurant ids by bit position, the first minute of every segment, the checkpoint interval,
+    the bitset of every interval'th segment, each `(len(ids) + 7) // 8` bytes long, and the positions
+    flipped at each segment's boundary, segment `s` having `flips[flip_offsets[s]:flip_offsets[s + 1]]`
+    in ascending order.
+    """
+    return self._ids, self._boundaries, self._interval, self._checkpoints, self._flip_offsets, self._flips
+
+  @property
+  def zones(self) -> Tuple[Sequence[str], Sequence[int]]:
+    """
+    The names of the time zones, sorted, and the number of every restaurant's zone by bit position.
+    """
+    return self._zone_names, self._zone_of
+
+  @classmethod
+  def from_db(cls) -> "WeekIndex":
+    restaurants = list(Restaurant.objects.values_list('id', 'name', 'timezone'))
+    windows = OpeningWindow.objects.values_list('restaurant_id', 'start_minute_of_week', 'end_minute_of_week')
+    return cls(
+      windows.iterator(),
+      {restaurant_id: name for restaurant_id, name, _ in restaurants},
+      {restaurant_id: zone for restaurant_id, _, zone in restaurants}
+    )
+
+  @classmethod
+  def from_snapshot(cls, snapshot: Snapshot) -> "WeekIndex":
+    return cls.from_timeline(
+      snapshot.ids, snapshot.names, snapshot.boundaries, snapshot.checkpoint_interval, snapshot.checkpoints,
+      snapshot.flip_offsets, snapshot.flips, snapshot.zone_names, snapshot.zone_of
+    )
+
+  def lookup(self, minute: int) -> Tuple[int, ...]:
+    """
+    Return the sorted ids of the restaurants open at the given minute of the week.
+    """
+    segment = self._segment_of[minute % MINUTES_PER_WEEK]
+    members = self._members[segment]
+    if members is None:
+      members = self._members[segment] = self._decode(self._bitset(segment))
+    return members
+
+  def local_minutes(self, minute: int, instant: Optional[datetime.datetime]) -> Tuple[int, ...]:
+    """
+    The minute of the week a search falls on in each zone of the index, in the order of `zones`. The
+    key `lookup_local` and `is_open_local` take, and the same for every search giving the same result.
+
+    :param minute: the minute of the week of the search in the zone of `instant`, or in every zone.
+    :param instant: the aware instant searched, or None for a wall time in every zone.
+    """
+    return tuple(zone_week_minute(minute, instant, zone) for zone in self._zone_names)
+
+  def lookup_local(self, minutes: Sequence[int]) -> Tuple[int, ...]:
+    """
+    Return the sorted ids of the restaurants open at the given `local_minutes`.
+    """
+    if all(minute == minutes[0] for minute in minutes):
+      return self.lookup(minutes[0])
+    return tuple(heapq.merge(*(self._lookup_zone(zone, minute) for zone, minute in enumerate(minutes))))
+
+  def _lookup_zone(self, zone: int, minute: int) -> Tuple[int, ...]:
+    segment = self._segment_of[minute % MINUTES_PER_WEEK]
+    members = self._zone_members.get((segment, zone))
+    if members is None:
+      mask = self._zone_masks[zone]
+      if mask is None:
+        bits = bytearray((len(self._ids) + 7) // 8)
+        for position, number in enumerate(self._zone_of):
+          if number == zone:
+            bits[position >> 3] |= 1 << (position & 7)
+        mask = self._zone_masks[zone] = int.from_bytes(bits, 'little')
+      data = self._bitset(segment)
+      members = self._zone_members[(segment, zone)] = self._decode(
+        (int.from_bytes(data, 'little') & mask).to_bytes(len(data), 'little')
+      )
+    return members
+
+  def is_open(self, restaurant_id: int, minute: int) -> bool:
+    """
+    Whether the restaurant is open at the given minute of the week, read straight from the segment's
+    bitset without decoding it.
+    """
+    position = self._position(restaurant_id)
+    return position is not None and self._is_set(position, minute)
+
+  def is_open_local(self, restaurant_id: int, minutes: Sequence[int]) -> bool:
+    """
+    Whether the restaurant is open at the given `local_minutes`.
+    """
+    position = self._position(restaurant_id)
+    return position is not None and self._is_set(position, minutes[self._zone_of[position]])
+
+  def local_minute(self, restaurant_id: int, minutes: Sequence[int]) -> int:
+    """
+    The restaurant's own minute of the given `local_minutes`.
+
+    :raises KeyError: for an unknown restaurant.
+    """
+    position = self._position(restaurant_id)
+    if position is None:
+      raise KeyError(restaurant_id)
+    return minutes[self._zone_of[position]]
+
+  def zone(self, restaurant_id: int) -> str:
+    """
+    The IANA name of the restaurant's time zone.
+
+    :raises KeyError: for an unknown restaurant.
+    """
+    position = self._position(restaurant_id)
+    if position is None:
+      raise KeyError(restaurant_id)
+    return self._zone_names[self._zone_of[position]]
+
+  def _position(self, restaurant_id: int) -> Optional[int]:
+    position = bisect_left(self._ids, restaurant_id)
+    return position if position < len(self._ids) and self._ids[position] == restaurant_id else None
+
+  def _is_set(self, position: int, minute: int) -> bool:
+    segment = self._segment_of[minute % MINUTES_PER_WEEK]
+    checkpoint = segment - segment % self._interval
+    bit = self._checkpoints[checkpoint // self._interval][position >> 3] >> (position & 7) & 1
+    offsets, flips = self._flip_offsets, self._flips
+    for later in range(checkpoint + 1, segment + 1):
+      start, end = offsets[later], offsets[later + 1]
+      found = bisect_left(flips, position, start, end)
+      if found < end and flips[found] == position:
+        bit ^= 1
+    return bool(bit)
+
+  def _bitset(self, segment: int) -> bytes:
+    checkpoint = segment - segment % self._interval
+    bits = bytearray(self._checkpoints[checkpoint // self._interval])
+    for pos in self._flips[self._flip_offsets[checkpoint + 1]:self._flip_offsets[segment + 1]]:
+      bits[pos >> 3] ^= 1 << (pos & 7)
+    return bytes(bits)
+
+  def _decode(self, data: bytes) -> Tuple[int, ...]:
+    ids = self._ids
+    members = []
+    for byte_index, byte in enumerate(data):
+      while byte:
+        lowest = byte & -byte
+        members.append(ids[byte_index * 8 + lowest.bit_length() - 1])
+        byte ^= lowest
+    return tuple(members)
+
+
+class ScheduleIndex:
+  """
+  Per-restaurant opening hours as sorted, merged week-minute intervals, for questions about spans of
+  time rather than instants: open for a whole interval, next opening, next closing.
+
+  Each restaurant's windows are merged where they overlap or touch and laid out over two consecutive
+  weeks, so intervals and transitions that cross sunday midnight need no special casing. All
+  restaurants share flat `starts`/`ends` arrays; a restaurant's slice is found through `_offsets`,
+  and every query is a binary search within that slice.
+  """
+
+  def __init__(self, windows: Iterable[Tuple[int, int, int]], names: Mapping[int, str]):
+    """
+    :param windows: `(restaurant_id, start_minute, end_minute)` tuples, as for `WeekIndex`.
+    :type windows: Iterable[Tuple[int, int, int]]
+    :param names: restaurant names keyed by restaurant id.
+    :type names: Mapping[int, str]
+    """
+    ids = array('q', sorted(names))
+    grouped: Dict[int, List[Tuple[int, int]]] = {}
+    for restaurant_id, start, end in windows:
+      grouped.setdefault(restaurant_id, []).append((start, end))
+
+    offsets = array('q', [0])
+    starts = array('I')
+    ends = array('I')
+    for restaurant_id in ids:
+      for start, end in self._merge(grouped.get(restaurant_id, ())):
+        starts.append(start)
+        ends.append(end)
+      offsets.append(len(starts))
+    self._set_schedule(ids, names, offsets, starts, ends)
+
+  @classmethod
+  def from_schedule(
+    cls, ids: Sequence[int], names: Mapping[int, str], offsets: Sequence[int], starts: Sequence[int], ends: Sequence[int]
+  ) -> "ScheduleIndex":
+    """
+    Rebuild an index from the `schedule` of another. The sequences are used as they are, so they can
+    be views of a memory-mapped file.
+    """
+    index = cls.__new__(cls)
+    index._set_schedule(ids, names, offsets, starts, ends)
+    return index
+
+  def _set_schedule(
+    self, ids: Sequence[int], names: Mapping[int, str], offsets: Sequence[int], starts: Sequence[int], ends: Sequence[int]
+  ) -> None:
+    self.names = names
+    self._ids = ids
+    self._offsets = offsets
+    self._starts = starts
+    self._ends = ends
+
+  @property
+  def schedule(self) -> Tuple[Sequence[int], Sequence[int], Sequence[int], Sequence[int]]:
+    """
+    The restaurant ids, the offset of each restaurant's intervals (one more than there are
+    restaurants), and the interval starts and ends.
+    """
+    return self._ids, self._offsets, self._starts, self._ends
+
+  @staticmethod
+  def _merge(windows: Iterable[Tuple[int, int]]) -> List[List[int]]:
+    windows = sorted(windows)
+    merged: List[List[int]] = []
+    for start, end in windows + [(start + MINUTES_PER_WEEK, end + MINUTES_PER_WEEK) for start, end in windows]:
+      if merged and start <= merged[-1][1] + 1:
+        merged[-1][1] = max(merged[-1][1], end)
+      else:
+        merged.append([start, end])
+    return merged
+
+  @classmethod
+  def from_db(cls) -> "ScheduleIndex":
+    names = dict(Restaurant.objects.values_list('id', 'name'))
+    windows = OpeningWindow.objects.values_list('restaurant_id', 'start_minute_of_week', 'end_minute_of_week')
+    return cls(windows.iterator(), names)
+
+  @classmethod
+  def from_snapshot(cls, snapshot: Snapshot) -> "ScheduleIndex":
+    return cls.from_schedule(snapshot.ids, snapshot.names, snapshot.offsets, snapshot.starts, snapshot.ends)
+
+  def _slice(self, restaurant_id: int) -> Tuple[int, int]:
+    position = bisect_left(self._ids, restaurant_id)
+    if position == len(self._ids) or self._ids[position] != restaurant_id:
+      raise KeyError(restaurant_id)
+    return self._offsets[position], self._offsets[position + 1]
+
+  def is_open_throughout(self, restaurant_id: int, start: int, minutes: int) -> bool:
+    """
+    Whether the restaurant is open for every minute from `start` (a minute of the week) through
+    `minutes` minutes later, inclusive. Spans longer than a week are treated as a whole week.
+    """
+    low, high = self._slice(restaurant_id)
+    start %= MINUTES_PER_WEEK
+    i = bisect_right(self._starts, start, low, high) - 1
+    return i >= low and self._ends[i] >= start + min(minutes, MINUTES_PER_WEEK - 1)
+
+  def next_opening(self, restaurant_id: int, minute: int) -> Optional[int]:
+    """
+    Minutes from `minute` until the restaurant next opens, between 1 and a week. None if it never
+    opens, including restaurants open around the clock.
+    """
+    low, high = self._slice(restaurant_id)
+    minute %= MINUTES_PER_WEEK
+    i = bisect_right(self._starts, minute, low, high)
+    return self._starts[i] - minute if i < high and self._starts[i] <= minute + MINUTES_PER_WEEK else None
+
+  def next_closing(self, restaurant_id: int, minute: int) -> Optional[int]:
+    """
+    Minutes from `minute` until the restaurant next closes, counted to the first minute it is
+    closed. None if it is never open, or never closes.
+    """
+    low, high = self._slice(restaurant_id)
+    minute %= MINUTES_PER_WEEK
+    i = bisect_left(self._ends, minute, low, high)
+    if i == high or self._ends[i] >= 2 * MINUTES_PER_WEEK - 1:
+      return None
+    return self._ends[i] + 1 - minute
+
+
+class GridIndex:
+  """
+  Restaurant locations bucketed into a grid of `RESTAURANTS_GRID_CELL_DEGREES` square cells of
+  latitude and longitude, so a search around a point only measures the restaurants in the cells the
+  search circle overlaps, wherever the rest of them are. Restaurants without a location are never
+  found.
+  """
+
+  def __init__(self, locations: Iterable[Tuple[int, Optional[float], Optional[float]]], names: Mapping[int, str]):
+    """
+    :param locations: `(restaurant_id, latitude, longitude)` tuples in degrees, None for restaurants
+    without a location.
+    :type locations: Iterable[Tuple[int, Optional[float], Optional[float]]]
+    :param names: restaurant names keyed by restaurant id.
+    :type names: Mapping[int, str]
+    """
+    located = {
+      restaurant_id: (latitude, longitude) for restaurant_id, latitude, longitude in locations
+      if latitude is not None and longitude is not None
+    }
+    ids = array('q', sorted(names))
+    latitudes = array('d', [located.get(restaurant_id, (math.nan, math.nan))[0] for restaurant_id in ids])
+    longitudes = array('d', [located.get(restaurant_id, (math.nan, math.nan))[1] for restaurant_id in ids])
+    self._set_locations(ids, names, latitudes, longitudes)
+
+  @classmethod
+  def from_locations(
+    cls, ids: Sequence[int], names: Mapping[int, str], latitudes: Sequence[float], longitudes: Sequence[float]
+  ) -> "GridIndex":
+    """
+    Rebuild an index from the `locations` of another. Only the grid is recomputed, the sequences are
+    used as they are, so they can be views of a memory-mapped file.
+    """
+    index = cls.__new__(cls)
+    index._set_locations(ids, names, latitudes, longitudes)
+    return index
+
+  def _set_locations(
+    self, ids: Sequence[int], names: Mapping[int, str], latitudes: Sequence[float], longitudes: Sequence[float]
+  ) -> None:
+    self.names = names
+    self._ids = ids
+    self._latitudes = latitudes
+    self._longitudes = longitudes
+    self._cell_degrees = float(getattr(settings, 'RESTAURANTS_GRID_CELL_DEGREES', 0.05))
+    self._columns = math.ceil(360 / self._cell_degrees)
+
+    # restaurant positions by (row, column) cell
+    self._cells: Dict[Tuple[int, int], List[int]] = {}
+    for position, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+      if not math.isnan(latitude):
+        self._cells.setdefault(self._cell(latitude, longitude), []).append(position)
+
+  @property
+  def locations(self) -> Tuple[Sequence[int], Sequence[float], Sequence[float]]:
+    """
+    The restaurant ids and their latitudes and longitudes, NaN for restaurants without a location.
+    """
+    return self._ids, self._latitudes, self._longitudes
+
+  def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+    return (
+      math.floor((latitude + 90) / self._cell_degrees),
+      math.floor((longitude + 180) / self._cell_degrees) % self._columns
+    )
+
+  @classmethod
+  def from_db(cls) -> "GridIndex":
+    restaurants = list(Restaurant.objects.values_list('id', 'name', 'latitude', 'longitude'))
+    names = {restaurant_id: name for restaurant_id, name, _, _ in restaurants}
+    return cls(((restaurant_id, latitude, longitude) for restaurant_id, _, latitude, longitude in restaurants), names)
+
+  @classmethod
+  def from_snapshot(cls, snapshot: Snapshot) -> "GridIndex":
+    return cls.from_locations(snapshot.ids, snapshot.names, snapshot.latitudes, snapshot.longitudes)
+
+  def nearby(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[float, int]]:
+    """
+    Find the restaurants within `radius_km` of a point.
+
+    :return: `(distance_km, restaurant_id)` of each, nearest first.
+    :raises ValueError: for a point off the globe or a radius that is not positive.
+    """
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+      raise ValueError('Latitude must be between -90 and 90 and longitude between -180 and 180.')
+    if not radius_km > 0:
+      raise ValueError('The radius must be positive.')
+
+    # the search circle's bounding box, every longitude once it reaches over a pole
+    angle = radius_km / EARTH_RADIUS_KM
+    south = max(latitude - math.degrees(angle), -90.0)
+    north = min(latitude + math.degrees(angle), 90.0)
+    first_row, _ = self._cell(south, longitude)
+    last_row, _ = self._cell(north, longitude)
+    cos_latitude = math.cos(math.radians(latitude))
+    if angle >= math.pi / 2 or math.sin(angle) >= cos_latitude:
+      columns = range(self._columns)
+    else:
+      spread = math.degrees(math.asin(math.sin(angle) / cos_latitude))
+      first_column = math.floor((longitude - spread + 180) / self._cell_degrees)
+      last_column = math.floor((longitude + spread + 180) / self._cell_degrees)
+      if last_column - first_column + 1 >= self._columns:
+        columns = range(self._columns)
+      else:
+        columns = {column % self._columns for column in range(first_column, last_column + 1)}
+
+    latitude_radians = math.radians(latitude)
+    found = []
+    for row in range(first_row, last_row + 1):
+      for column in columns:
+        for position in self._cells.get((row, column), ()):
+          # haversine
+          other_radians = math.radians(self._latitudes[position])
+          half_chord = (
+            math.sin((other_radians - latitude_radians) / 2) ** 2
+            + math.cos(latitude_radians) * math.cos(other_radians)
+            * math.sin(math.radians(self._longitudes[position] - longitude) / 2) ** 2
+          )
+          distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(half_chord, 1.0)))
+          if distance <= radius_km:
+            found.append((distance, self._ids[position]))
+    found.sort()
+    return found
+
+
+class OverrideIndex:
+  """
+  Special hours (`models.SpecialHours`) keyed by calendar date and time zone, checked before the weekly
+  index. For a date and zone it tells which restaurants the special hours decide, and whether each
+  is open; every other restaurant keeps its weekly hours. Searches on dates with no special hours near
+  them skip it after a set lookup.
+  """
+
+  def __init__(self, overrides: Iterable[Tuple[int, str, datetime.date, Optional[int], Optional[int]]]):
+    """
+    :param overrides: `(restaurant_id, zone, date, opening_minute, closing_minute)` tuples, minutes of
+    the day with the closing one inclusive, both None for a restaurant closed all day. A blank zone
+    is `default_zone`.
+    :type overrides: Iterable[Tuple[int, str, datetime.date, Optional[int], Optional[int]]]
+    """
+    self._rows: List[Tuple[int, datetime.date, Optional[int], Optional[int]]] = []
+    # windows replacing the weekly hours of the date, and windows run over from the day before
+    self._replaced: Dict[Tuple[datetime.date, str], Dict[int, List[Tuple[int, int]]]] = {}
+    self._extra: Dict[Tuple[datetime.date, str], Dict[int, List[Tuple[int, int]]]] = {}
+    for restaurant_id, zone, date, opening, closing in overrides:
+      self._rows.append((restaurant_id, date, opening, closing))
+      zone = zone or default_zone()
+      windows = self._replaced.setdefault((date, zone), {}).setdefault(restaurant_id, [])
+      if opening is None or closing is None:
+        continue
+      if closing <= opening:
+        windows.append((opening, MINUTES_PER_DAY - 1))
+        next_day = (date + datetime.timedelta(days=1), zone)
+        self._extra.setdefault(next_day, {}).setdefault(restaurant_id, []).append((0, closing))
+      else:
+        windows.append((opening, closing))
+    self._dates = {date for date, _ in self._replaced} | {date for date, _ in self._extra}
+
+  @property
+  def rows(self) -> List[Tuple[int, datetime.date, Optional[int], Optional[int]]]:
+    """
+    The special hours as `(restaurant_id, date, opening_minute, closing_minute)`.
+    """
+    return self._rows
+
+  @staticmethod
+  def _minute(time: Optional[datetime.time]) -> Optional[int]:
+    return time.hour * 60 + time.minute if time is not None else None
+
+  @classmethod
+  def from_db(cls) -> "OverrideIndex":
+    overrides = SpecialHours.objects.values_list(
+      'restaurant_id', 'restaurant__timezone', 'date', 'opening_time', 'closing_time'
+    )
+    return cls(
+      (restaurant_id, zone, date, cls._minute(opening_time), cls._minute(closing_time))
+      for restaurant_id, zone, date, opening_time, closing_time in overrides.iterator()
+    )
+
+  @classmethod
+  def from_snapshot(cls, snapshot: Snapshot) -> "OverrideIndex":
+    def zone(restaurant_id: int) -> str:
+      return snapshot.zone_names[snapshot.zone_of[bisect_left(snapshot.ids, restaurant_id)]]
+
+    return cls(
+      (restaurant_id, zone(restaurant_id), datetime.date.fromordinal(ordinal), *(
+        None if minute < 0 else minute for minute in (opening, closing)
+      ))
+      for restaurant_id, ordinal, opening, closing in zip(
+        snapshot.override_ids, snapshot.override_dates, snapshot.override_openings, snapshot.override_closings
+      )
+    )
+
+  def near(self, date: datetime.date) -> bool:
+    """
+    Whether any special hours fall on the date or a day either side, the dates it is somewhere in the
+    world when it is `date` in one zone.
+    """
+    return bool(self._dates) and any(date + datetime.timedelta(days=days) in self._dates for days in (-1, 0, 1))
+
+  def decisions(self, zone: str, date: datetime.date, minute: int) -> Dict[int, bool]:
+    """
+    Whether each restaurant of a zone whose hours at a minute of the day are decided by special hours
+    is open then. Restaurants missing from the result keep their weekly hours.
+    """
+    decided = {
+      restaurant_id: any(start <= minute <= end for start, end in windows)
+      for restaurant_id, windows in self._replaced.get((date, zone), {}).items()
+    }
+    for restaurant_id, windows in self._extra.get((date, zone), {}).items():
+      if any(start <= minute <= end for start, end in windows):
+        decided[restaurant_id] = True
+    return decided
+
+
+def fold_name(name: str) -> str:
+  """
+  The form names are matched in: accents dropped, case folded and runs of whitespace made a single
+  space, ex. "Café  Luna" -> "cafe luna".
+  """
+  decomposed = unicodedata.normalize('NFKD', name)
+  return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().split())
+
+
+class NameIndex:
+  """
+  Restaurant names for typeahead: every name's `fold_name` form in one sorted sequence, so the names
+  starting with a prefix are a contiguous run found with a binary search.
+  """
+
+  def __init__(self, names: Mapping[int, str]):
+    """
+    :param names: restaurant names keyed by restaurant id.
+    :type names: Mapping[int, str]
+    """
+    entries = sorted((fold_name(name), restaurant_id) for restaurant_id, name in names.items())
+    self._set_entries(names, [key for key, _ in entries], array('q', [restaurant_id for _, restaurant_id in entries]))
+
+  @classmethod
+  def from_entries(cls, names: Mapping[int, str], keys: Sequence[str], ids: Sequence[int]) -> "NameIndex":
+    """
+    Rebuild an index from the `entries` of another. The sequences are used as they are, so they can
+    be views of a memory-mapped file.
+    """
+    index = cls.__new__(cls)
+    index._set_entries(names, keys, ids)
+    return index
+
+  def _set_entries(self, names: Mapping[int, str], keys: Sequence[str], ids: Sequence[int]) -> None:
+    self.names = names
+    self._keys = keys
+    self._ids = ids
+
+  @property
+  def entries(self) -> Tuple[Sequence[str], Sequence[int]]:
+    """
+    The folded names, sorted, and the restaurant id of each.
+    """
+    return self._keys, self._ids
+
+  @classmethod
+  def from_db(cls) -> "NameIndex":
+    return cls(dict(Restaurant.objects.values_list('id', 'name')))
+
+  @classmethod
+  def from_snapshot(cls, snapshot: Snapshot) -> "NameIndex":
+    return cls.from_entries(snapshot.names, snapshot.name_keys, snapshot.name_key_ids)
+
+  def updated(self) -> "NameIndex":
+    """
+    An index of the restaurants now in the database, reusing this one's folded names for the
+    restaurants whose name did not change. Only new and renamed restaurants are folded, and they are
+    merged into the sorted names in one pass, so adding restaurants costs little more than reading
+    the names.
+    """
+    names = dict(Restaurant.objects.values_list('id', 'name'))
+    stale = {restaurant_id for restaurant_id, name in self.names.items() if names.get(restaurant_id) != name}
+    added = {restaurant_id: name for restaurant_id, name in names.items() if self.names.get(restaurant_id) != name}
+    kept = [(key, restaurant_id) for key, restaurant_id in zip(self._keys, self._ids) if restaurant_id not in stale]
+    # two sorted runs, merged rather than sorted again
+    entries = sorted(kept + sorted((fold_name(name), restaurant_id) for restaurant_id, name in added.items()))
+    return self.from_entries(
+      names, [key for key, _ in entries], array('q', [restaurant_id for _, restaurant_id in entries])
+    )
+
+  def prefix(self, query: str) -> Iterator[int]:
+    """
+    The ids of the restaurants whose folded name starts with the folded query, in folded name order.
+    """
+    query = fold_name(query)
+    position = bisect_left(self._keys, query)
+    while position < len(self._keys) and self._keys[position].startswith(query):
+      yield self._ids[position]
+      position += 1
+
+
+Index = TypeVar('Index', WeekIndex, ScheduleIndex, GridIndex, OverrideIndex, NameIndex)
+
+# each index and the data version and generation it was built from, swapped as one reference
+_indexes: Dict[type, Tuple[object, Tuple[int, int], int]] = {}
+_index_lock = threading.Lock()
+
+def _current(cls: Type[Index]) -> Optional[Index]:
+  entry = _indexes.get(cls)
+  # a generation not read yet is never current, so the event loop does not wait on the database
+  return entry[0] if entry is not None and entry[1:] == (data_version(), known_generation_id()) else None
+
+def _get(cls: Type[Index]) -> Index:
+  index = _current(cls)
+  if index is None:
+    with _index_lock:
+      index = _current(cls)
+      if index is None:
+        version, generation = data_version(), known_generation_id()
+        # a fresh process with no changes of its own can start from the snapshot written by loaddata,
+        # which also names the generation active for its version, so neither needs the database
+        snapshot = load_snapshot(version[0], generation) if version[1] == 0 else None
+        if snapshot is not None and generation is None:
+          generation = remember_active_generation(version[0], snapshot.generation)
+          if generation != snapshot.generation:
+            snapshot = None
+        if generation is None:
+          generation = current_generation_id()
+        previous = _indexes.get(cls)
+        if snapshot is not None:
+          index = cls.from_snapshot(snapshot)
+        elif cls is NameIndex and previous is not None and previous[2] == generation:
+          # a load gives every restaurant a new id in a new generation, leaving nothing to reuse
+          index = previous[0].updated()
+        else:
+          index = cls.from_db()
+        _indexes[cls] = (index, version, generation)
+  return index
+
+def get_index() -> WeekIndex:
+  """
+  Return the process-wide index, building it on first use or after the hours data changed (see
+  `restaurants.version`), from the snapshot file when it is current or else from the database.
+  """
+  return _get(WeekIndex)
+
+def get_schedule_index() -> ScheduleIndex:
+  """
+  Return the process-wide `ScheduleIndex`, kept current like `get_index`.
+  """
+  return _get(ScheduleIndex)
+
+def get_grid_index() -> GridIndex:
+  """
+  Return the process-wide `GridIndex`, kept current like `get_index`.
+  """
+  return _get(GridIndex)
+
+def get_override_index() -> OverrideIndex:
+  """
+  Return the process-wide `OverrideIndex` of special hours, kept current like `get_index`.
+  """
+  return _get(OverrideIndex)
+
+def get_name_index() -> NameIndex:
+  """
+  Return the process-wide `NameIndex`, kept current like `get_index`. After a change it is updated
+  from the previous one rather than rebuilt.
+  """
+  return _get(NameIndex)
+
+def save_snapshot(version: int) -> Optional[str]:
+  """
+  Build the indexes from the database and write them to the snapshot file for the given published
+  data version, see `restaurants.snapshot`.
+
+  :return: the path written, or None if snapshots are disabled.
+  """
+  if not snapshot_file():
+    return None
+  # one read transaction, so names and windows come from the same state of the database
+  with transaction.atomic():
+    generation = current_generation_id()
+    restaurants = list(Restaurant.objects.values_list('id', 'name', 'latitude', 'longitude', 'timezone'))
+    windows = list(OpeningWindow.objects.values_list('restaurant_id', 'start_minute_of_week', 'end_minute_of_week'))
+    overrides = OverrideIndex.from_db()
+  names = {restaurant_id: name for restaurant_id, name, *_ in restaurants}
+  locations = [(restaurant_id, latitude, longitude) for restaurant_id, _, latitude, longitude, _ in restaurants]
+  zones = {restaurant_id: zone for restaurant_id, *_, zone in restaurants}
+  return write_snapshot(
+    version, generation, WeekIndex(windows, names, zones), ScheduleIndex(windows, names), GridIndex(locations, names), overrides,
+    NameIndex(names)
+  )
+
+async def aget_index() -> WeekIndex:
+  """
+  Async version of `get_index`. Only a rebuild runs in a thread, a current index is returned directly.
+  """
+  index = _current(WeekIndex)
+  if index is None:
+    index = await sync_to_async(get_index)()
+  return index
+
+async def aget_override_index() -> OverrideIndex:
+  """
+  Async version of `get_override_index`.
+  """
+  overrides = _current(OverrideIndex)
+  if overrides is None:
+    overrides = await sync_to_async(get_override_index)()
+  return overrides
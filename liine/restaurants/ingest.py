@@ -0,0 +1,407 @@
+import collections
+import contextlib
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+import django
+from django.db import connection, transaction
+
+from restaurants import hours as hours_parser
+from restaurants.index import week_minute
+from restaurants.models import Restaurant, OperatingDay, OperatingHours, OpeningWindow, SpecialHours
+from restaurants.utils import (
+  Location, fingerprint, in_values, parse_hours, parse_location, parse_special_hours, parse_timezone
+)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+ROW_FORMATS = ('csv', 'jsonl')
+GZIP_MAGIC = b'\x1f\x8b'
+
+Window = Tuple[List[int], datetime.time, datetime.time]
+Parsed = Tuple[str, List[Window], str, Optional[Location], str]
+
+class BulkLoader:
+  """
+  Collects parsed restaurant rows and writes them with batched inserts, one transaction per batch,
+  so only `batch_size` rows are ever held in memory. Produces the same rows as calling `parse_row`
+  on every row: restaurants are matched by name, their windows are added to any existing ones and a
+  row with a location or time zone sets it. Restaurants are also stamped with the row fingerprint used by `sync`.
+
+  Call `flush` once the last row has been added.
+  """
+
+  def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+    self.batch_size = batch_size
+    self.rows = 0
+    self._pending: List[Parsed] = []
+
+  def add_row(self, row: Dict[str, str]) -> None:
+    name, hours, location, timezone = row['Restaurant Name'], row['Hours'], parse_location(row), parse_timezone(row)
+    self.add(name, parse_hours(hours), fingerprint(name, hours, location, timezone), location, timezone)
+
+  def add(
+    self,
+    name: str,
+    windows: List[Window],
+    hours_fingerprint: str = '',
+    location: Optional[Location] = None,
+    timezone: str = ''
+  ) -> None:
+    self._pending.append((name, windows, hours_fingerprint, location, timezone))
+    self.rows += 1
+    if len(self._pending) >= self.batch_size:
+      self.flush()
+
+  def flush(self) -> None:
+    if not self._pending:
+      return
+    with transaction.atomic():
+      fingerprints = {}
+      details: Dict[str, Dict[str, object]] = {}
+      for name, _, hours_fingerprint, location, timezone in self._pending:
+        # a restaurant spread over several rows matches none of them
+        fingerprints[name] = '' if name in fingerprints else hours_fingerprint
+        if location is not None:
+          details.setdefault(name, {}).update(latitude=location[0], longitude=location[1])
+        if timezone:
+          details.setdefault(name, {})['timezone'] = timezone
+      restaurant_ids = self._restaurant_ids(fingerprints, details)
+
+      operating_days = []
+      times = []
+      for name, windows, *_ in self._pending:
+        for days, opening_time, closing_time in windows:
+          for day in days:
+            operating_days.append(OperatingDay(name=day, restaurant_id=restaurant_ids[name]))
+            times.append((opening_time, closing_time))
+
+      if connection.features.can_return_rows_from_bulk_insert:
+        OperatingDay.objects.bulk_create(operating_days)
+      else:
+        for operating_day in operating_days:
+          operating_day.save()
+
+      OperatingHours.objects.bulk_create([
+        OperatingHours(opening_time=opening_time, closing_time=closing_time, operating_day=operating_day)
+        for operating_day, (opening_time, closing_time) in zip(operating_days, times)
+      ])
+      OpeningWindow.objects.bulk_create([
+        OpeningWindow(
+          restaurant_id=operating_day.restaurant_id,
+          start_minute_of_week=week_minute(operating_day.name, opening_time),
+          end_minute_of_week=week_minute(operating_day.name, closing_time)
+        )
+        for operating_day, (opening_time, closing_time) in zip(operating_days, times)
+      ])
+    self._pending = []
+
+  def _restaurant_ids(self, fingerprints: Dict[str, str], details: Dict[str, Dict[str, object]]) -> Dict[str, int]:
+    restaurant_ids = dict(Restaurant.objects.filter(name__in=list(fingerprints)).values_list('name', 'id'))
+    # windows appended to an existing restaurant no longer match the single row it was fingerprinted from
+    Restaurant.objects.filter(pk__in=list(restaurant_ids.values())).exclude(hours_fingerprint='').update(hours_fingerprint='')
+    # rows only set the details they have, so existing restaurants are updated per set of fields
+    updates: Dict[Tuple[str, ...], List[Restaurant]] = {}
+    for name, fields in details.items():
+      if name in restaurant_ids:
+        updates.setdefault(tuple(sorted(fields)), []).append(Restaurant(pk=restaurant_ids[name], **fields))
+    for fields, restaurants in updates.items():
+      Restaurant.objects.bulk_update(restaurants, list(fields))
+
+    new_names = [name for name in fingerprints if name not in restaurant_ids]
+    if new_names:
+      Restaurant.objects.bulk_create([
+        Restaurant(name=name, hours_fingerprint=fingerprints[name], **details.get(name, {})) for name in new_names
+      ])
+      restaurant_ids.update(Restaurant.objects.filter(name__in=new_names).values_list('name', 'id'))
+    return restaurant_ids
+
+
+def sync(rows: Iterable[Dict[str, str]], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+  """
+  Bring the database in line with a full CSV export while only touching restaurants that changed.
+  Each row's fingerprint is compared with the one stored on the restaurant: new restaurants are
+  inserted, restaurants with a different fingerprint have their hours replaced, and restaurants
+  missing from the rows are deleted. Restaurants whose row is unchanged are not written at all.
+  Runs in a single transaction, so readers never see a half-applied sync.
+
+  :param rows: CSV rows with 'Restaurant Name' and 'Hours', and optionally 'Latitude' and
+  'Longitude' and 'Timezone', one row per restaurant. A changed row without a location or time zone
+  clears the stored one.
+  :type rows: Iterable[Dict[str, str]]
+  :return: counts of 'inserted', 'updated', 'deleted' and 'unchanged' restaurants.
+  """
+  counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+  loader = BulkLoader(batch_size=batch_size)
+  seen = set()
+  batch = []
+
+  def apply(batch):
+    fingerprints = {name: fingerprint(name, hours, location, timezone) for name, hours, location, timezone in batch}
+    stored = dict(Restaurant.objects.filter(name__in=list(fingerprints)).values_list('name', 'hours_fingerprint'))
+    changed = [name for name in stored if stored[name] != fingerprints[name]]
+    counts['inserted'] += len(fingerprints) - len(stored)
+    counts['updated'] += len(changed)
+    counts['unchanged'] += len(stored) - len(changed)
+
+    OperatingDay.objects.filter(restaurant__name__in=changed).delete()
+    OpeningWindow.objects.filter(restaurant__name__in=changed).delete()
+    details = {}
+    for name, hours, location, timezone in batch:
+      details[name] = (location or (None, None), timezone)
+      if stored.get(name) != fingerprints[name]:
+        loader.add(name, parse_hours(hours), fingerprints[name], location, timezone)
+    loader.flush()
+
+    restaurants = list(Restaurant.objects.filter(name__in=changed).only('id', 'name'))
+    for restaurant in restaurants:
+      restaurant.hours_fingerprint = fingerprints[restaurant.name]
+      (restaurant.latitude, restaurant.longitude), restaurant.timezone = details[restaurant.name]
+    Restaurant.objects.bulk_update(restaurants, ['hours_fingerprint', 'latitude', 'longitude', 'timezone'])
+
+  with transaction.atomic():
+    for row in rows:
+      name = row['Restaurant Name']
+      if name in seen:
+        raise ValueError(f'{name!r} appears more than once, sync needs one row per restaurant.')
+      seen.add(name)
+      batch.append((name, row['Hours'], parse_location(row), parse_timezone(row)))
+      if len(batch) >= batch_size:
+        apply(batch)
+        batch = []
+    apply(batch)
+
+    removed = Restaurant.objects.exclude(name__in=in_values(list(seen)))
+    counts['deleted'] = removed.count()
+    if counts['deleted']:
+      removed.delete()
+  return counts
+
+def load_special_hours(rows: Iterable[Dict[str, str]], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+  """
+  Load special hours, replacing whatever special hours the restaurants had on the dates in the rows.
+  A restaurant open several times on one date has a row per window or windows separated by '/'.
+  Runs in a single transaction.
+
+  :param rows: CSV rows with 'Restaurant Name', 'Date' and 'Hours', see `parse_special_hours`.
+  :type rows: Iterable[Dict[str, str]]
+  :return: counts of 'dates' replaced and special hours 'windows' written.
+  :raises ValueError: if a row is malformed or names an unknown restaurant.
+  """
+  parsed = [parse_special_hours(row) for row in rows]
+  names = {name for name, _, _ in parsed}
+  restaurant_ids = dict(Restaurant.objects.filter(name__in=list(names)).values_list('name', 'id'))
+  unknown = sorted(names - set(restaurant_ids))
+  if unknown:
+    raise ValueError(f'Special hours for unknown restaurants: {", ".join(map(repr, unknown))}.')
+
+  special_hours = [
+    SpecialHours(restaurant_id=restaurant_ids[name], date=date, opening_time=opening_time, closing_time=closing_time)
+    for name, date, windows in parsed
+    for opening_time, closing_time in windows
+  ]
+  dates = collections.defaultdict(set)
+  for name, date, _ in parsed:
+    dates[date].add(restaurant_ids[name])
+  with transaction.atomic():
+    for date, ids in dates.items():
+      ids = list(ids)
+      for start in range(0, len(ids), batch_size):
+        SpecialHours.objects.filter(date=date, restaurant_id__in=ids[start:start + batch_size]).delete()
+    SpecialHours.objects.bulk_create(special_hours, batch_size=batch_size)
+  return {'dates': sum(map(len, dates.values())), 'windows': len(special_hours)}
+
+
+
+class Source(NamedTuple):
+  file: TextIO
+  format: str
+  compressed: bool
+
+class SourceRow(NamedTuple):
+  line: int
+  # None for a line that could not be read as a row, with the `error` and the line's `text`
+  values: Optional[Dict[str, str]]
+  error: str = ''
+  text: str = ''
+
+@contextlib.contextmanager
+def open_source(path: str, format: Optional[str] = None) -> Iterator[Source]:
+  """
+  Open a file of restaurant rows for streaming: `path` is a file or '-' for stdin, gzip-compressed or
+  not, as told by its first bytes, so nothing is decompressed to disk. Without a `format` the rows
+  are JSON Lines if the data starts with '{' and CSV otherwise.
+
+  :param path: the file to read, or '-' for stdin.
+  :param format: one of `ROW_FORMATS`, or None to detect it.
+  :return: a context manager of the `Source`, its file decoded as UTF-8 with or without a BOM.
+  """
+  raw = sys.stdin.buffer if path == '-' else open(path, 'rb')
+  try:
+    binary = raw
+    compressed = binary.peek(2)[:2] == GZIP_MAGIC
+    if compressed:
+      binary = gzip.GzipFile(fileobj=raw)
+    if format is None:
+      start = binary.peek(64).lstrip(b'\xef\xbb\xbf \t\r\n')
+      format = 'jsonl' if start.startswith(b'{') else 'csv'
+    text = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+    try:
+      yield Source(text, format, compressed)
+    finally:
+      # leave stdin open for the rest of the process
+      text.detach()
+  finally:
+    if raw is not sys.stdin.buffer:
+      raw.close()
+
+def read_rows(source: Source) -> Iterator[SourceRow]:
+  """
+  Stream the rows of a `Source` one at a time, with the line each starts on. JSON Lines values that
+  are not strings are converted to strings, null to ''.
+  """
+  if source.format == 'csv':
+    reader = csv.DictReader(source.file)
+    # read the header, so rows are numbered from the line after it
+    reader.fieldnames
+    line = reader.line_num + 1
+    for row in reader:
+      yield SourceRow(line, row)
+      line = reader.line_num + 1
+    return
+  for line, text in enumerate(source.file, 1):
+    if not text.strip():
+      continue
+    try:
+      row = json.loads(text)
+    except ValueError as e:
+      yield SourceRow(line, None, f'Malformed JSON: {e}', text.rstrip('\r\n'))
+      continue
+    if not isinstance(row, dict):
+      yield SourceRow(line, None, 'Not a JSON object.', text.rstrip('\r\n'))
+      continue
+    yield SourceRow(line, {key: '' if value is None else str(value) for key, value in row.items()})
+
+def check_row(row: Dict[str, str]) -> None:
+  """
+  Check that a row can be loaded: it has a restaurant name that fits `Restaurant.name`, and its hours,
+  location and time zone parse.
+
+  :raises ValueError: saying what is wrong with the row.
+  """
+  name, hours = row.get('Restaurant Name'), row.get('Hours')
+  if not (name or '').strip():
+    raise ValueError('No restaurant name.')
+  max_length = Restaurant._meta.get_field('name').max_length
+  if len(name) > max_length:
+    raise ValueError(f'{name!r} is longer than {max_length} characters.')
+  if not (hours or '').strip():
+    raise ValueError(f'{name!r} has no hours.')
+  try:
+    parse_hours(hours)
+  except hours_parser.HoursFormatError as e:
+    raise ValueError(str(e))
+  parse_location(row)
+  parse_timezone(row)
+
+class Rejects:
+  """
+  Passes on the rows that `check_row` accepts. The others are written to a JSON Lines reject file,
+  one `{"line": ..., "error": ..., "row": ...}` object per rejected row, or abort the load with a
+  ValueError naming the line when there is no reject file.
+  """
+
+  def __init__(self, file: Optional[TextIO] = None):
+    self.file = file
+    self.count = 0
+
+  def check(self, rows: Iterable[SourceRow]) -> Iterator[Dict[str, str]]:
+    for line, row, error, text in rows:
+      if not error:
+        try:
+          check_row(row)
+        except ValueError as e:
+          error = str(e)
+      if not error:
+        yield row
+        continue
+      if self.file is None:
+        raise ValueError(f'Line {line}: {error}')
+      self.count += 1
+      self.file.write(json.dumps({'line': line, 'error': error, 'row': text if row is None else row}) + '\n')
+
+
+def split_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple[List[str], List[Tuple[int, int]]]:
+  """
+  Read the CSV header and cut the rest of the file into byte ranges of about `chunk_size` bytes.
+  Ranges are not aligned to rows; `parse_chunk` owns every row that starts inside its range. Rows must
+  not contain quoted newlines.
+
+  :return: the header field names and the `(start, end)` byte ranges, in file order.
+  """
+  with open(path, 'rb') as file:
+    header = file.readline()
+    data_start = file.tell()
+    size = os.fstat(file.fileno()).st_size
+  fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+  chunks = [(start, min(start + chunk_size, size)) for start in range(data_start, size, chunk_size)]
+  return fieldnames, chunks
+
+def parse_chunk(path: str, fieldnames: List[str], start: int, end: int) -> List[Parsed]:
+  """
+  Parse the rows starting inside the byte range `[start, end)` of a CSV file into
+  `(name, windows, fingerprint, location, timezone)` tuples. Runs in worker processes.
+  """
+  lines = []
+  with open(path, 'rb') as file:
+    # back up one byte so a row starting exactly at `start` is kept
+    file.seek(start - 1)
+    file.readline()
+    while file.tell() < end:
+      line = file.readline()
+      if not line:
+        break
+      lines.append(line.decode('utf-8'))
+  parsed = []
+  for row in csv.DictReader(io.StringIO(''.join(lines)), fieldnames=fieldnames):
+    name, hours, location, timezone = row['Restaurant Name'], row['Hours'], parse_location(row), parse_timezone(row)
+    parsed.append((name, parse_hours(hours), fingerprint(name, hours, location, timezone), location, timezone))
+  return parsed
+
+def load_parallel(
+  path: str,
+  workers: int,
+  batch_size: int = DEFAULT_BATCH_SIZE,
+  chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> int:
+  """
+  Parse a CSV file in a pool of `workers` processes and write the rows from this process through a
+  single `BulkLoader`. Chunks are written in file order, so the database ends up exactly as after a
+  serial load. At most two chunks per worker are parsed ahead of the writer, which bounds memory.
+
+  :return: the number of rows loaded.
+  """
+  fieldnames, chunks = split_file(path, chunk_size)
+  loader = BulkLoader(batch_size=batch_size)
+  with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+    for rows in _parse_in_order(executor, path, fieldnames, chunks, workers * 2):
+      for name, windows, hours_fingerprint, location, timezone in rows:
+        loader.add(name, windows, hours_fingerprint, location, timezone)
+  loader.flush()
+  return loader.rows
+
+def _parse_in_order(executor, path, fieldnames, chunks, in_flight) -> Iterator[List[Parsed]]:
+  pending = collections.deque()
+  for start, end in chunks:
+    pending.append(executor.submit(parse_chunk, path, fieldnames, start, end))
+    if len(pending) >= in_flight:
+      yield pending.popleft().result()
+  while pending:
+    yield pending.popleft().result()
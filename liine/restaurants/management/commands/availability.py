@@ -0,0 +1,80 @@
+import csv
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurants import availability
+from restaurants.index import MINUTES_PER_WEEK
+
+class Command(BaseCommand):
+  help = (
+    "Write the restaurants by time slot availability matrix, or the number of open restaurants per "
+    "slot, to a CSV or .npy file. Needs NumPy."
+  )
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="File to write, NumPy's binary format if it ends in .npy and CSV otherwise",
+    )
+    parser.add_argument(
+        "--step",
+        type=int,
+        default=60,
+        help="Slot length in minutes, each slot sampled at its first minute (default 60)",
+    )
+    parser.add_argument(
+        "--counts",
+        action="store_true",
+        help="Write the number of open restaurants per slot instead of the full matrix",
+    )
+
+  def handle(self, *args, **options):
+    if not 1 <= options['step'] <= MINUTES_PER_WEEK:
+      raise CommandError(f'--step must be between 1 and {MINUTES_PER_WEEK}.')
+
+    started = time.perf_counter()
+    try:
+      engine = availability.AvailabilityEngine.from_db()
+    except ImproperlyConfigured as e:
+      raise CommandError(str(e))
+    minutes = availability.slot_minutes(options['step'])
+    output = options['output']
+    if options['counts']:
+      self.write_counts(output, minutes, engine.counts(minutes))
+    else:
+      self.write_matrix(output, minutes, engine)
+
+    self.stdout.write(
+      f'{"Counts" if options["counts"] else "Matrix"} for {len(engine.ids)} restaurants and {len(minutes)} slots '
+      f'written to {output} in {time.perf_counter() - started:.2f}s.'
+    )
+
+  def write_counts(self, output, minutes, counts):
+    if output.endswith('.npy'):
+      availability.np.save(output, counts)
+      return
+    with open(output, 'w', newline='') as file:
+      writer = csv.writer(file)
+      writer.writerow(['slot', 'open_restaurants'])
+      writer.writerows(zip([availability.slot_label(minute) for minute in minutes], counts.tolist()))
+
+  def write_matrix(self, output, minutes, engine):
+    # a block of restaurants at a time, the whole matrix is restaurants x slots
+    if output.endswith('.npy'):
+      matrix = availability.np.lib.format.open_memmap(
+        output, mode='w+', dtype=bool, shape=(len(engine.ids), len(minutes))
+      )
+      for first_row, block in engine.blocks(minutes):
+        matrix[first_row:first_row + len(block)] = block
+      matrix.flush()
+      return
+    with open(output, 'w', newline='') as file:
+      writer = csv.writer(file)
+      writer.writerow(['restaurant_id', 'name'] + [availability.slot_label(minute) for minute in minutes])
+      for first_row, block in engine.blocks(minutes):
+        last_row = first_row + len(block)
+        rows = zip(engine.ids[first_row:last_row].tolist(), engine.names[first_row:last_row], block.astype('u1').tolist())
+        writer.writerows([restaurant_id, name] + row for restaurant_id, name, row in rows)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurants import generations
+from restaurants.index import save_snapshot
+from restaurants.version import publish_data_version
+
+class Command(BaseCommand):
+  help = "List the generations of the restaurant hours data, roll back to the previous one or delete old ones"
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="Make the previous generation active again",
+    )
+    parser.add_argument(
+        "--collect",
+        action="store_true",
+        help="Delete failed generations and the retired ones beyond --keep",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        help="Generations --collect keeps, the active one included (default RESTAURANTS_GENERATIONS_KEPT)",
+    )
+
+  def handle(self, *args, **options):
+    if options['rollback']:
+      try:
+        dataset = generations.rollback()
+      except ValueError as e:
+        raise CommandError(str(e))
+      version = publish_data_version()
+      path = save_snapshot(version)
+      self.stdout.write(f'Rolled back to generation {dataset.pk}, data version {version}.')
+      if path:
+        self.stdout.write(f'Snapshot for data version {version} written to {path}.')
+    if options['collect']:
+      collected = generations.collect(keep=options['keep'])
+      self.stdout.write(f'Deleted generations {", ".join(map(str, collected))}.' if collected else 'Nothing to delete.')
+    if options['rollback'] or options['collect']:
+      return
+
+    for dataset in generations.generations():
+      self.stdout.write(
+        f'{dataset.pk}\t{dataset.state}\t{dataset.restaurant_count} restaurants\t'
+        f'created {dataset.created_at:%Y-%m-%d %H:%M:%S}\t{dataset.source}'
+      )
@@ -1,10 +1,22 @@
+import contextlib
 import csv
+import time
+from pathlib import Path
 
 from django.db import transaction
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from restaurants import generations
+from restaurants.index import save_snapshot
+from restaurants.ingest import (
+  DEFAULT_BATCH_SIZE, ROW_FORMATS, BulkLoader, Rejects, load_parallel, load_special_hours, open_source, read_rows, sync
+)
+from restaurants.models import writing_generation
 from restaurants.utils import parse_row
+from restaurants.version import publish_data_version
+
+BUNDLED_FILE = Path(__file__).resolve().parents[2] / 'data' / 'restaurants.csv'
 
 class Command(BaseCommand):
   help = "Load restaurant hours data from restaurants.csv"
@@ -13,20 +25,153 @@ class Command(BaseCommand):
     parser.add_argument(
         "--local",
         action="store_true",
-        help="Run to seed database locally outside of the docker container",
+        help="Kept for compatibility, the bundled restaurants.csv is found wherever the app runs",
+    )
+    parser.add_argument(
+        "--file",
+        help="CSV or JSON Lines file to load instead of the bundled restaurants.csv, gzipped or not, - for stdin",
+    )
+    parser.add_argument(
+        "--format",
+        choices=ROW_FORMATS,
+        help="Format of the rows, by default JSON Lines if the data starts with { and CSV otherwise",
+    )
+    parser.add_argument(
+        "--rejects",
+        metavar="FILE",
+        help="Write rows that cannot be loaded to this JSON Lines file with the reason, instead of stopping",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Stream the file and write rows with batched inserts, one transaction per batch",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only insert, update or delete the restaurants whose row changed since the last load",
+    )
+    parser.add_argument(
+        "--special-hours",
+        metavar="FILE",
+        help="Load holiday and other special hours from this CSV instead of the weekly hours",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Rows per batch with --bulk or --workers (default {DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Parse the file in this many processes, writing with batched inserts from a single writer",
     )
 
   def handle(self, *args, **options):
+    file_location = options['file'] or str(BUNDLED_FILE)
+
+    if options['workers'] < 1:
+      raise CommandError('--workers must be at least 1.')
+    if options['rejects'] and (options['sync'] or options['workers'] > 1):
+      # a sync would delete the restaurant of a rejected row
+      raise CommandError('--rejects cannot be used with --sync or --workers.')
+
+    started = time.perf_counter()
+    if options['special_hours']:
+      with open(options['special_hours'], 'r', newline='') as file:
+        try:
+          counts = load_special_hours(csv.DictReader(file), batch_size=options['batch_size'])
+        except ValueError as e:
+          raise CommandError(str(e))
+      self.publish()
+      self.stdout.write(
+        'Special hours loaded in {elapsed:.2f}s. {windows} windows on {dates} restaurant dates.'.format(
+          elapsed=time.perf_counter() - started, **counts
+        )
+      )
+      return
 
-    file_location = '/app/liine/restaurants/data/restaurants.csv'
+    if options['workers'] > 1:
+      with open_source(file_location, options['format']) as source:
+        if file_location == '-' or source.compressed or source.format != 'csv':
+          raise CommandError('--workers needs an uncompressed CSV file.')
 
-    if options['local']:
-      file_location = 'restaurants/data/restaurants.csv'
+    if options['sync']:
+      # a sync rewrites the active generation in place, in a single transaction
+      with open_source(file_location, options['format']) as source:
+        try:
+          counts = sync(Rejects(None).check(read_rows(source)), batch_size=options['batch_size'])
+        except ValueError as e:
+          raise CommandError(str(e))
+      self.publish()
+      self.stdout.write(
+        '{label} synced with database in {elapsed:.2f}s. {inserted} inserted, {updated} updated, '
+        '{deleted} deleted, {unchanged} unchanged.'.format(
+          label='CSV' if source.format == 'csv' else 'JSON Lines', elapsed=time.perf_counter() - started, **counts
+        )
+      )
+      return
 
-    with open(file_location, 'r') as file:
-      reader = csv.DictReader(file)
-      for row in reader:
-        with transaction.atomic():
-          parse_row(row)
+    # anything else is loaded into a new generation, which searches only see once it is complete
+    dataset = generations.start(source=file_location)
+    try:
+      with writing_generation(dataset.pk):
+        label, rows, rejected = self.load_rows(file_location, options)
+      previous = generations.activate(dataset, batch_size=options['batch_size'])
+    except ValueError as e:
+      generations.discard(dataset, batch_size=options['batch_size'])
+      raise CommandError(str(e))
+    except BaseException:
+      generations.discard(dataset, batch_size=options['batch_size'])
+      raise
+
+    self.loaded(label, rows, started)
+    if rejected:
+      self.stdout.write(f'{rejected} rows rejected, written to {options["rejects"]}.')
+    self.stdout.write(
+      f'Generation {dataset.pk} activated'
+      + (f', generation {previous.pk} kept for rollback.' if previous is not None else '.')
+    )
+    collected = generations.collect(batch_size=options['batch_size'])
+    if collected:
+      self.stdout.write(f'Deleted generations {", ".join(map(str, collected))}.')
+
+  def load_rows(self, file_location, options):
+    if options['workers'] > 1:
+      return 'CSV', load_parallel(file_location, options['workers'], batch_size=options['batch_size']), 0
+
+    rows = 0
+    with open_source(file_location, options['format']) as source, self.rejects_file(options['rejects']) as rejects_file:
+      rejects = Rejects(rejects_file)
+      if options['bulk']:
+        loader = BulkLoader(batch_size=options['batch_size'])
+        for row in rejects.check(read_rows(source)):
+          loader.add_row(row)
+        loader.flush()
+        rows = loader.rows
+      else:
+        for row in rejects.check(read_rows(source)):
+          with transaction.atomic():
+            parse_row(row)
+          rows += 1
+    return 'CSV' if source.format == 'csv' else 'JSON Lines', rows, rejects.count
+
+  def rejects_file(self, path):
+    return open(path, 'w', encoding='utf-8') if path else contextlib.nullcontext()
+
+  def loaded(self, format, rows, started):
+    elapsed = time.perf_counter() - started
+    self.publish()
+    self.stdout.write(
+      f'{format} loaded into database. {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/sec).'
+    )
 
-    print('CSV loaded into database.')
\ No newline at end of file
+  def publish(self):
+    # tell every server process, batched inserts do not even send model signals. Processes that rebuild
+    # before the snapshot is replaced read the database instead.
+    version = publish_data_version()
+    path = save_snapshot(version)
+    if path:
+      self.stdout.write(f'Snapshot for data version {version} written to {path}.')
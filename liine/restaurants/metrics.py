@@ -0,0 +1,209 @@
+"""
+Request instrumentation: per-request timings and SQL usage aggregated into histograms, rendered in
+the Prometheus text exposition format by `views.metrics_text`.
+
+Everything is off unless the `RESTAURANTS_METRICS` setting is true. While off, `MetricsMiddleware`
+removes itself from the stack and `timed` only checks a flag.
+"""
+import contextvars
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# seconds, from 10 microseconds (a cached timestamp parse) to 10 seconds
+TIME_BUCKETS = (
+  0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+  0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+METRICS = {
+  'restaurants_request_duration_seconds': ('Wall time of a request, by view.', TIME_BUCKETS),
+  'restaurants_timestamp_parse_seconds': ('Time spent parsing search timestamps.', TIME_BUCKETS),
+  'restaurants_search_seconds': ('Time spent in execute_search, by engine.', TIME_BUCKETS),
+  'restaurants_template_render_seconds': ('Time spent rendering templates, by template.', TIME_BUCKETS),
+  'restaurants_sql_queries': ('SQL queries run by a request, by view.', COUNT_BUCKETS),
+  'restaurants_sql_duration_seconds': ('Time a request spent in SQL queries, by view.', TIME_BUCKETS),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+  """
+  Cumulative histogram with fixed upper bounds, a running sum and a count.
+  """
+
+  def __init__(self, buckets: Tuple[float, ...]):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float) -> None:
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+_enabled = bool(getattr(settings, 'RESTAURANTS_METRICS', False))
+_histograms: Dict[Tuple[str, Labels], Histogram] = {}
+_lock = threading.Lock()
+# [queries, seconds] of the SQL run for the request served in this context
+_request_sql: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar('request_sql', default=None)
+
+@receiver(setting_changed)
+def _update_enabled(setting, value, **kwargs):
+  global _enabled
+  if setting == 'RESTAURANTS_METRICS':
+    _enabled = bool(value)
+
+def is_enabled() -> bool:
+  return _enabled
+
+def observe(name: str, value: float, **labels: str) -> None:
+  key = (name, tuple(sorted(labels.items())))
+  with _lock:
+    histogram = _histograms.get(key)
+    if histogram is None:
+      histogram = _histograms[key] = Histogram(METRICS[name][1])
+    histogram.observe(value)
+
+@contextmanager
+def timed(name: str, **labels: str) -> Iterator[None]:
+  """
+  Observe the wall time of the block into histogram `name`, when metrics are enabled.
+  """
+  if not _enabled:
+    yield
+    return
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe(name, time.perf_counter() - started, **labels)
+
+def reset() -> None:
+  with _lock:
+    _histograms.clear()
+
+def authorized(request) -> bool:
+  """
+  Whether a request may read the operational endpoints, the metrics and the search cache statistics:
+  it has to carry `Authorization: Bearer <token>` with the `RESTAURANTS_METRICS_TOKEN` setting as
+  token. No request may while the setting is empty.
+  """
+  token = getattr(settings, 'RESTAURANTS_METRICS_TOKEN', '')
+  header = request.META.get('HTTP_AUTHORIZATION', '')
+  return bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+  pairs = labels + ((extra,) if extra else ())
+  if not pairs:
+    return ''
+  return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs) + '}'
+
+def render_text() -> str:
+  """
+  Render every histogram in the Prometheus text exposition format (version 0.0.4).
+  """
+  with _lock:
+    snapshot = sorted(
+      (name, labels, list(histogram.counts), histogram.sum, histogram.count)
+      for (name, labels), histogram in _histograms.items()
+    )
+  lines = []
+  for name, (help_text, buckets) in METRICS.items():
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for _, labels, counts, total, count in (entry for entry in snapshot if entry[0] == name):
+      cumulative = 0
+      for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append(f'{name}_bucket{_format_labels(labels, ("le", repr(float(bound))))} {cumulative}')
+      lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {count}')
+      lines.append(f'{name}_sum{_format_labels(labels)} {total!r}')
+      lines.append(f'{name}_count{_format_labels(labels)} {count}')
+  return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+  """
+  Records the wall time, SQL query count and SQL time of every request, labelled with the name of
+  the view that served it. Not installed at all when `RESTAURANTS_METRICS` is off. Async-capable, so
+  under ASGI it does not push the async views onto a thread.
+  """
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    if not _enabled:
+      raise MiddlewareNotUsed()
+    self.get_response = get_response
+    if iscoroutinefunction(get_response):
+      markcoroutinefunction(self)
+
+  def __call__(self, request):
+    if iscoroutinefunction(self):
+      return self.__acall__(request)
+    sql = [0, 0.0]
+    token = _request_sql.set(sql)
+    started = time.perf_counter()
+    try:
+      response = self.get_response(request)
+    finally:
+      _request_sql.reset(token)
+    self._observe(request, time.perf_counter() - started, sql)
+    return response
+
+  async def __acall__(self, request):
+    sql = [0, 0.0]
+    token = _request_sql.set(sql)
+    started = time.perf_counter()
+    try:
+      response = await self.get_response(request)
+    finally:
+      _request_sql.reset(token)
+    self._observe(request, time.perf_counter() - started, sql)
+    return response
+
+  def _observe(self, request, elapsed: float, sql: list) -> None:
+    match = getattr(request, 'resolver_match', None)
+    view = match.url_name if match and match.url_name else 'unmatched'
+    observe('restaurants_request_duration_seconds', elapsed, view=view)
+    observe('restaurants_sql_queries', sql[0], view=view)
+    observe('restaurants_sql_duration_seconds', sql[1], view=view)
+
+
+def record_sql(execute, sql_string, params, many, context):
+  """
+  Count a query and add up its time into the request being served in this context, if any. Installed
+  on every connection by `install_sql_recorder`.
+  """
+  sql = _request_sql.get()
+  if sql is None:
+    return execute(sql_string, params, many, context)
+  started = time.perf_counter()
+  try:
+    return execute(sql_string, params, many, context)
+  finally:
+    sql[0] += 1
+    sql[1] += time.perf_counter() - started
+
+def install_sql_recorder(sender, connection, **kwargs) -> None:
+  """
+  Install `record_sql` on a new connection. Connected to `connection_created`, so the queries of a
+  request are counted whichever thread's connection runs them: under ASGI the ORM runs on
+  `sync_to_async` threads, which see the request's context but have connections of their own.
+  """
+  if record_sql not in connection.execute_wrappers:
+    connection.execute_wrappers.append(record_sql)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0002_alter_restaurant_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='hours_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
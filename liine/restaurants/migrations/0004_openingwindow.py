@@ -0,0 +1,64 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:52
+
+import warnings
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_opening_windows(apps, schema_editor):
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    OperatingHours = apps.get_model('restaurants', 'OperatingHours')
+    OpeningWindow = apps.get_model('restaurants', 'OpeningWindow')
+    rows = OperatingHours.objects.filter(operating_day__restaurant__isnull=False).values_list(
+        'operating_day__restaurant_id', 'operating_day__name', 'opening_time', 'closing_time'
+    )
+    if not rows.exists():
+        return
+    windows = []
+    for restaurant_id, day, opening_time, closing_time in rows.iterator():
+        day = int(day)
+        if not 0 <= day < 7:
+            continue
+        windows.append(OpeningWindow(
+            restaurant_id=restaurant_id,
+            start_minute_of_week=day * 1440 + opening_time.hour * 60 + opening_time.minute,
+            end_minute_of_week=day * 1440 + closing_time.hour * 60 + closing_time.minute,
+        ))
+        if len(windows) >= 1000:
+            OpeningWindow.objects.bulk_create(windows)
+            windows = []
+    OpeningWindow.objects.bulk_create(windows)
+
+    # the hours were stored by an older parser, which closed single windows at 23:59:59.999999, dropped
+    # Sunday hours past midnight and repeated late windows on an extra day. The hours strings are not
+    # stored, so the windows copy those mistakes until the data is loaded again: clearing the
+    # fingerprints makes the next `loaddata --sync` rewrite every restaurant.
+    Restaurant.objects.exclude(hours_fingerprint='').update(hours_fingerprint='')
+    warnings.warn(
+        'Opening hours were copied from rows written by an older parser and may be wrong, reload them '
+        'with `python manage.py loaddata --sync`.'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0003_restaurant_hours_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_minute_of_week', models.PositiveSmallIntegerField()),
+                ('end_minute_of_week', models.PositiveSmallIntegerField()),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='openingwindow_set', to='restaurants.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start_minute_of_week', 'end_minute_of_week', 'restaurant'], name='openingwindow_week_minute_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_opening_windows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0005_restaurant_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='timezone',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.13 on 2026-10-18 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0006_restaurant_timezone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecialHours',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('opening_time', models.TimeField(blank=True, null=True)),
+                ('closing_time', models.TimeField(blank=True, null=True)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='specialhours_set', to='restaurants.restaurant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'restaurant'], name='specialhours_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.13 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_active_generation(apps, schema_editor):
+    # the restaurants already loaded become the first, active, generation
+    Dataset = apps.get_model('restaurants', 'Dataset')
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    dataset = Dataset.objects.create(state='active', activated_at=django.utils.timezone.now())
+    Restaurant.objects.update(generation=dataset)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0007_specialhours'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dataset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('loading', 'Loading'), ('active', 'Active'), ('retired', 'Retired'), ('failed', 'Failed')], default='loading', max_length=7)),
+                ('source', models.CharField(blank=True, default='', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dataset',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 'active')), fields=('state',), name='dataset_single_active'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='generation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='restaurants', to='restaurants.dataset'),
+        ),
+        migrations.RunPython(create_active_generation, migrations.RunPython.noop),
+    ]
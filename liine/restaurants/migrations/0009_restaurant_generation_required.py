@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import restaurants.models
+
+
+class Migration(migrations.Migration):
+    # separate from 0008, PostgreSQL does not alter a table in the transaction that updated its rows
+
+    dependencies = [
+        ('restaurants', '0008_dataset_generations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='restaurant',
+            name='generation',
+            field=models.ForeignKey(default=restaurants.models.current_generation_id, on_delete=django.db.models.deletion.CASCADE, related_name='restaurants', to='restaurants.dataset'),
+        ),
+        migrations.AlterField(
+            model_name='restaurant',
+            name='name',
+            field=models.CharField(max_length=30),
+        ),
+        migrations.AddConstraint(
+            model_name='restaurant',
+            constraint=models.UniqueConstraint(fields=('generation', 'name'), name='restaurant_generation_name_unique'),
+        ),
+    ]
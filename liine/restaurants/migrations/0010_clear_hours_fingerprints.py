@@ -0,0 +1,21 @@
+# Generated by Django 4.2.13 on 2026-10-18 18:30
+
+from django.db import migrations
+
+
+def clear_hours_fingerprints(apps, schema_editor):
+    # hours sets of a single day then a range, ex. "Mon, Wed-Sun", used to lose the range, and the
+    # fingerprint of an unchanged row would keep `loaddata --sync` from parsing it again
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    Restaurant.objects.exclude(hours_fingerprint='').update(hours_fingerprint='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0009_restaurant_generation_required'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_hours_fingerprints, migrations.RunPython.noop),
+    ]
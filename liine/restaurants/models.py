@@ -1,7 +1,148 @@
+import contextlib
+import contextvars
+import threading
+from typing import Iterator, Optional, Tuple
+
 from django.db import models
 
+from restaurants.version import data_version_file, published_data_version
+
+
+class Dataset(models.Model):
+  """
+  A generation of the restaurant hours data. A full load writes its restaurants into a new generation
+  while searches keep reading the active one, and the generation becomes active only once it is
+  complete, see restaurants.generations. At most one generation is active.
+  """
+  class State(models.TextChoices):
+    LOADING = "loading", "Loading"
+    ACTIVE = "active", "Active"
+    RETIRED = "retired", "Retired"
+    FAILED = "failed", "Failed"
+
+  state = models.CharField(choices=State.choices, max_length=7, default=State.LOADING)
+  # the file the generation was loaded from
+  source = models.CharField(max_length=255, blank=True, default='')
+  created_at = models.DateTimeField(auto_now_add=True)
+  activated_at = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=["state"], condition=models.Q(state="active"), name="dataset_single_active"),
+    ]
+
+
+# the generation `writing_generation` is loading in this context, None for the active one
+_writing_generation: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('writing_generation', default=None)
+_active_lock = threading.Lock()
+# ((version file, published version), id) of the active generation when last read
+_active_generation: Optional[Tuple[Tuple[str, int], int]] = None
+
+def active_generation_id() -> int:
+  """
+  Return the id of the active generation, read from the database once per published data version,
+  unless the snapshot of the version named it, see `remember_active_generation`: every change of the
+  active generation publishes a version. The active generation can change before
+  the version does, so what is built from the database is keyed by generation too, see
+  `restaurants.index`.
+  """
+  global _active_generation
+  key = (data_version_file(), published_data_version())
+  entry = _active_generation
+  if entry is None or entry[0] != key:
+    with _active_lock:
+      entry = _active_generation = (key, Dataset.objects.values_list('pk', flat=True).get(state=Dataset.State.ACTIVE))
+  return entry[1]
+
+def known_generation_id() -> Optional[int]:
+  """
+  Like `current_generation_id` without reading the database, None if the active generation was not
+  read for the current published data version yet.
+  """
+  generation = _writing_generation.get()
+  if generation is not None:
+    return generation
+  entry = _active_generation
+  return entry[1] if entry is not None and entry[0] == (data_version_file(), published_data_version()) else None
+
+def remember_active_generation(version: int, generation_id: int) -> int:
+  """
+  Take `generation_id` as the active generation for the published data `version`, unless one was
+  read from the database for it already, without reading the database: the snapshot written for a
+  version records the generation it was built from.
+
+  :return: the active generation now known for the version.
+  """
+  global _active_generation
+  key = (data_version_file(), version)
+  with _active_lock:
+    if _active_generation is None or _active_generation[0] != key:
+      _active_generation = (key, generation_id)
+    return _active_generation[1]
+
+def forget_active_generation() -> None:
+  """
+  Drop the remembered active generation, for the process that just changed it.
+  """
+  global _active_generation
+  _active_generation = None
+
+@contextlib.contextmanager
+def writing_generation(generation_id: int) -> Iterator[None]:
+  """
+  Read and create restaurants in the given generation instead of the active one, in this context.
+  """
+  token = _writing_generation.set(generation_id)
+  try:
+    yield
+  finally:
+    _writing_generation.reset(token)
+
+def current_generation_id() -> int:
+  """
+  Return the id of the generation rows are read from and created in: the one being loaded in this
+  context, else the active one.
+  """
+  return _writing_generation.get() or active_generation_id()
+
+
+class GenerationManager(models.Manager):
+  """
+  Only returns the rows of the current generation, see `current_generation_id`. Models keep a plain
+  `all_generations` manager for loading and deleting other generations.
+  """
+  generation_lookup = 'generation'
+
+  def get_queryset(self):
+    return super().get_queryset().filter(**{self.generation_lookup: current_generation_id()})
+
+
+class RestaurantPartManager(GenerationManager):
+  generation_lookup = 'restaurant__generation'
+
+
+class OperatingHoursManager(GenerationManager):
+  generation_lookup = 'operating_day__restaurant__generation'
+
+
 class Restaurant(models.Model):
-  name = models.CharField(max_length=30, null=False, blank=False, unique=True)
+  generation = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="restaurants", default=current_generation_id)
+  name = models.CharField(max_length=30, null=False, blank=False)
+  # sha1 of the CSV row the hours were loaded from, see restaurants.utils.fingerprint
+  hours_fingerprint = models.CharField(max_length=40, blank=True, default='')
+  # WGS84 degrees, both or neither set, searched through restaurants.index.GridIndex
+  latitude = models.FloatField(null=True, blank=True)
+  longitude = models.FloatField(null=True, blank=True)
+  # IANA name of the zone the hours are wall time in, blank for the TIME_ZONE setting
+  timezone = models.CharField(max_length=64, blank=True, default='')
+
+  objects = GenerationManager()
+  all_generations = models.Manager()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=["generation", "name"], name="restaurant_generation_name_unique"),
+    ]
 
 
 class OperatingDay(models.Model):
@@ -17,8 +158,55 @@ class OperatingDay(models.Model):
   name = models.CharField(choices=Name.choices, max_length=1)
   restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name="operatingday_set", blank=True, null=True)
 
+  objects = RestaurantPartManager()
+  all_generations = models.Manager()
+
 
 class OperatingHours(models.Model):
   opening_time = models.TimeField(auto_now=False, auto_now_add=False, null=False, blank=False)
   closing_time = models.TimeField(auto_now=False, auto_now_add=False, null=False, blank=False)
   operating_day = models.ForeignKey(OperatingDay, on_delete=models.CASCADE, related_name="operatinghours_set", null=False, blank=False)
+
+  objects = OperatingHoursManager()
+  all_generations = models.Manager()
+
+
+class OpeningWindow(models.Model):
+  """
+  An operating window flattened to minutes of the week (0 is Monday 00:00, 10079 is Sunday 23:59),
+  both ends inclusive. Mirrors the OperatingDay/OperatingHours rows so "open at" is a single indexed
+  range query. Windows past midnight are stored as a second window on the following day, sunday
+  night wrapping to monday.
+  """
+  restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name="openingwindow_set", null=False, blank=False)
+  start_minute_of_week = models.PositiveSmallIntegerField(null=False, blank=False)
+  end_minute_of_week = models.PositiveSmallIntegerField(null=False, blank=False)
+
+  objects = RestaurantPartManager()
+  all_generations = models.Manager()
+
+  class Meta:
+    indexes = [
+      models.Index(fields=["start_minute_of_week", "end_minute_of_week", "restaurant"], name="openingwindow_week_minute_idx"),
+    ]
+
+
+class SpecialHours(models.Model):
+  """
+  Hours replacing a restaurant's weekly hours on one calendar date of its time zone, for holiday
+  closures and one-off special hours. A row without times closes the restaurant for the day, several
+  rows give it several windows. A window closing at or before its opening time runs past midnight,
+  on top of the next day's hours.
+  """
+  restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name="specialhours_set", null=False, blank=False)
+  date = models.DateField(null=False, blank=False)
+  opening_time = models.TimeField(null=True, blank=True)
+  closing_time = models.TimeField(null=True, blank=True)
+
+  objects = RestaurantPartManager()
+  all_generations = models.Manager()
+
+  class Meta:
+    indexes = [
+      models.Index(fields=["date", "restaurant"], name="specialhours_date_idx"),
+    ]
@@ -0,0 +1,263 @@
+"""
+A read-only binary snapshot of the search indexes, written by `loaddata`, from which server processes
+start answering searches without touching the database.
+
+The file is memory-mapped and its sections are used in place, so every worker on a machine shares
+one copy through the page cache. Layout, all integers little-endian and every section padded to
+8 bytes:
+
+  header         magic, published data version, dataset generation, restaurants, schedule intervals,
+                 timeline segments, checkpoint interval, flips, name bytes, zone name bytes, special
+                 hours, folded name bytes
+  ids            int64 per restaurant, ascending
+  offsets        int64 per restaurant + 1, the slice of `starts`/`ends` holding its intervals
+  starts, ends   uint32 per interval, the merged two-week schedule of `index.ScheduleIndex`
+  boundaries     uint32 per segment, the first minute of the week of each `index.WeekIndex` segment
+  checkpoints    a bitset of (restaurants + 7) // 8 bytes per checkpoint interval'th segment, one bit
+                 per position in `ids`
+  flip_offsets   int64 per segment + 1, the slice of `flips` holding the positions flipped at its
+                 boundary
+  flips          uint32 per flip, positions in `ids`, ascending within a segment
+  name_offsets   uint32 per restaurant + 1, the slice of `names` holding its UTF-8 name
+  names          UTF-8 bytes
+  latitudes,     float64 per restaurant, its location for `index.GridIndex`, NaN without one
+  longitudes
+  zone_of        uint16 per restaurant, the number of its time zone in `zone_names`
+  zone_names     the `index.WeekIndex` time zone names, UTF-8, one per line
+  override_ids   int64 per special hours row of `index.OverrideIndex`, the restaurant
+  override_dates uint32 per special hours row, the date's proleptic Gregorian ordinal
+  override_openings, override_closings
+                 int16 per special hours row, minutes of the day, -1 when closed all day
+  name_key_ids   int64 per restaurant, the restaurants in `index.NameIndex` order
+  name_key_offsets
+                 uint32 per restaurant + 1, the slice of `name_keys` holding each folded name
+  name_keys      UTF-8 bytes, the folded names in sorted order
+
+A snapshot is only used while its version is the current published data version and its generation
+the active one, so a worker never answers from a snapshot older than the database, nor mixes one
+generation's index with another's rows.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from typing import Iterator, Optional
+
+from django.conf import settings
+
+MAGIC = b'LIINEWK8'
+HEADER = struct.Struct('<8sqqqqqqqqqqq')
+
+def snapshot_file() -> Optional[str]:
+  path = getattr(settings, 'RESTAURANTS_SNAPSHOT_FILE', None)
+  return str(path) if path else None
+
+
+class SnapshotNames(Mapping):
+  """
+  Restaurant names keyed by id, decoded from the snapshot on access rather than held in memory.
+  """
+
+  def __init__(self, ids: memoryview, offsets: memoryview, data: memoryview):
+    self._ids = ids
+    self._offsets = offsets
+    self._data = data
+
+  def __getitem__(self, restaurant_id: int) -> str:
+    position = bisect_left(self._ids, restaurant_id)
+    if position == len(self._ids) or self._ids[position] != restaurant_id:
+      raise KeyError(restaurant_id)
+    return str(self._data[self._offsets[position]:self._offsets[position + 1]], 'utf-8')
+
+  def __iter__(self) -> Iterator[int]:
+    return iter(self._ids)
+
+  def __len__(self) -> int:
+    return len(self._ids)
+
+
+class SnapshotStrings(Sequence):
+  """
+  UTF-8 strings stored back to back in the snapshot, decoded on access.
+  """
+
+  def __init__(self, offsets: memoryview, data: memoryview):
+    self._offsets = offsets
+    self._data = data
+
+  def __getitem__(self, position: int) -> str:
+    if not 0 <= position < len(self):
+      raise IndexError(position)
+    return str(self._data[self._offsets[position]:self._offsets[position + 1]], 'utf-8')
+
+  def __len__(self) -> int:
+    return len(self._offsets) - 1
+
+
+class SegmentBitsets(Sequence):
+  """
+  The timeline checkpoint bitsets of a snapshot, each a read-only view into the mapped file.
+  """
+
+  def __init__(self, data: memoryview, count: int, width: int):
+    self._data = data
+    self._count = count
+    self._width = width
+
+  def __getitem__(self, segment: int) -> memoryview:
+    if not 0 <= segment < self._count:
+      raise IndexError(segment)
+    return self._data[segment * self._width:(segment + 1) * self._width]
+
+  def __len__(self) -> int:
+    return self._count
+
+
+class Snapshot:
+  """
+  A memory-mapped snapshot file. Use `load_snapshot` to open one.
+  """
+
+  def __init__(self, path: str):
+    with open(path, 'rb') as file:
+      self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    (
+      magic, self.version, self.generation, restaurants, intervals, segments, self.checkpoint_interval, flips,
+      name_bytes, zone_name_bytes, overrides, name_key_bytes
+    ) = HEADER.unpack_from(self._map)
+    if magic != MAGIC or self.checkpoint_interval < 1:
+      raise ValueError(f'{path} is not a restaurants snapshot.')
+
+    view = memoryview(self._map)
+    position = HEADER.size
+
+    def section(count: int, item_size: int, format: str) -> memoryview:
+      nonlocal position
+      size = count * item_size
+      if position + size > len(view):
+        raise ValueError(f'{path} is truncated.')
+      data = view[position:position + size].cast(format)
+      position += size + -size % 8
+      return data
+
+    width = (restaurants + 7) // 8
+    self.ids = section(restaurants, 8, 'q')
+    self.offsets = section(restaurants + 1, 8, 'q')
+    self.starts = section(intervals, 4, 'I')
+    self.ends = section(intervals, 4, 'I')
+    self.boundaries = section(segments, 4, 'I')
+    checkpoints = -(-segments // self.checkpoint_interval)
+    self.checkpoints = SegmentBitsets(section(checkpoints * width, 1, 'B'), checkpoints, width)
+    self.flip_offsets = section(segments + 1, 8, 'q')
+    self.flips = section(flips, 4, 'I')
+    name_offsets = section(restaurants + 1, 4, 'I')
+    self.names = SnapshotNames(self.ids, name_offsets, section(name_bytes, 1, 'B'))
+    self.latitudes = section(restaurants, 8, 'd')
+    self.longitudes = section(restaurants, 8, 'd')
+    self.zone_of = section(restaurants, 2, 'H')
+    self.zone_names = str(section(zone_name_bytes, 1, 'B'), 'utf-8').split('\n')
+    self.override_ids = section(overrides, 8, 'q')
+    self.override_dates = section(overrides, 4, 'I')
+    self.override_openings = section(overrides, 2, 'h')
+    self.override_closings = section(overrides, 2, 'h')
+    self.name_key_ids = section(restaurants, 8, 'q')
+    name_key_offsets = section(restaurants + 1, 4, 'I')
+    self.name_keys = SnapshotStrings(name_key_offsets, section(name_key_bytes, 1, 'B'))
+
+
+def load_snapshot(version: int, generation: Optional[int] = None, path: Optional[str] = None) -> Optional[Snapshot]:
+  """
+  Open the snapshot file if it exists and was written for the given published data version.
+
+  :param version: the published data version the snapshot has to match.
+  :type version: int
+  :param generation: the dataset generation the snapshot has to match, if given.
+  :type generation: Optional[int]
+  :param path: the snapshot file, defaults to the `RESTAURANTS_SNAPSHOT_FILE` setting.
+  :type path: Optional[str]
+  :return: the snapshot, or None if there is no usable one.
+  """
+  path = path or snapshot_file()
+  # sections are mapped as native arrays
+  if not path or sys.byteorder != 'little':
+    return None
+  try:
+    snapshot = Snapshot(path)
+  except (OSError, ValueError, struct.error):
+    return None
+  if snapshot.version != version or generation is not None and snapshot.generation != generation:
+    return None
+  return snapshot
+
+def write_snapshot(
+  version: int, generation: int, week_index, schedule_index, grid_index, override_index, name_index,
+  path: Optional[str] = None
+) -> Optional[str]:
+  """
+  Write a `WeekIndex`, a `ScheduleIndex`, a `GridIndex`, an `OverrideIndex` and a `NameIndex` built
+  from the same data to a snapshot file for the given published data version. The file is replaced
+  atomically; processes that mapped the old one keep reading it.
+
+  :param version: the published data version, normally the one returned by `publish_data_version`.
+  :type version: int
+  :param generation: the dataset generation the indexes were built from.
+  :type generation: int
+  :param week_index: the `index.WeekIndex` to store.
+  :param schedule_index: the `index.ScheduleIndex` to store, over the same restaurants.
+  :param grid_index: the `index.GridIndex` whose locations to store, over the same restaurants.
+  :param override_index: the `index.OverrideIndex` whose special hours to store.
+  :param name_index: the `index.NameIndex` whose folded names to store, over the same restaurants.
+  :param path: the snapshot file, defaults to the `RESTAURANTS_SNAPSHOT_FILE` setting.
+  :type path: Optional[str]
+  :return: the path written, or None if snapshots are disabled.
+  """
+  path = path or snapshot_file()
+  if not path or sys.byteorder != 'little':
+    return None
+
+  ids, boundaries, interval, checkpoints, flip_offsets, flips = week_index.timeline
+  schedule_ids, offsets, starts, ends = schedule_index.schedule
+  grid_ids, latitudes, longitudes = grid_index.locations
+  zone_names, zone_of = week_index.zones
+  zone_names = '\n'.join(zone_names).encode('utf-8')
+  overrides = override_index.rows
+  keys, key_ids = name_index.entries
+  if not list(ids) == list(schedule_ids) == list(grid_ids) == sorted(key_ids):
+    raise ValueError('The indexes were built from different restaurants.')
+
+  name_offsets = array('I', [0])
+  names = bytearray()
+  for restaurant_id in ids:
+    names += week_index.names[restaurant_id].encode('utf-8')
+    name_offsets.append(len(names))
+  key_offsets = array('I', [0])
+  name_keys = bytearray()
+  for key in keys:
+    name_keys += key.encode('utf-8')
+    key_offsets.append(len(name_keys))
+
+  sections = [
+    array('q', ids), array('q', offsets), array('I', starts), array('I', ends), array('I', boundaries),
+    b''.join(checkpoints), array('q', flip_offsets), array('I', flips), name_offsets, names, array('d', latitudes),
+    array('d', longitudes), array('H', zone_of), zone_names,
+    array('q', [restaurant_id for restaurant_id, _, _, _ in overrides]),
+    array('I', [date.toordinal() for _, date, _, _ in overrides]),
+    array('h', [-1 if opening is None else opening for _, _, opening, _ in overrides]),
+    array('h', [-1 if closing is None else closing for _, _, _, closing in overrides]),
+    array('q', key_ids), key_offsets, name_keys
+  ]
+  temporary = f'{path}.{os.getpid()}.tmp'
+  with open(temporary, 'wb') as file:
+    file.write(HEADER.pack(
+      MAGIC, version, generation, len(ids), len(starts), len(boundaries), interval, len(flips), len(names),
+      len(zone_names), len(overrides), len(name_keys)
+    ))
+    for section in sections:
+      data = section.tobytes() if isinstance(section, array) else bytes(section)
+      file.write(data)
+      file.write(bytes(-len(data) % 8))
+  os.replace(temporary, path)
+  return path
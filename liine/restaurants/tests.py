@@ -1,10 +1,47 @@
+import csv
 import datetime
+import gzip
+import io
+import json
+import math
+import random
+import tempfile
+from pathlib import Path
+from io import StringIO
+from unittest import skipUnless
 from unittest.mock import patch
+from zoneinfo import ZoneInfo
 
-from django.test import TestCase
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import resolve
 
-from restaurants.models import Restaurant
-from restaurants.utils import parse_days, parse_time, parse_day_and_hours, parse_row, execute_search
+from restaurants import availability, generations, hours, metrics, timestamps
+from restaurants.cache import VersionedLRUCache, search_cache
+from restaurants.ingest import load_parallel, sync
+from restaurants.index import (
+  EARTH_RADIUS_KM, MINUTES_PER_WEEK, GridIndex, NameIndex, OverrideIndex, ScheduleIndex, WeekIndex, fold_name,
+  get_index, get_override_index, get_schedule_index
+)
+from restaurants.metrics import MetricsMiddleware
+from restaurants.models import (
+  Dataset, Restaurant, OperatingHours, SpecialHours, forget_active_generation, writing_generation
+)
+from restaurants.snapshot import load_snapshot
+from restaurants.utils import (
+  parse_days, parse_time, parse_day_and_hours, parse_hours, parse_location, parse_row, parse_special_hours,
+  parse_timezone, execute_search, execute_batch_search, execute_interval_search, execute_nearby_search,
+  execute_search_values, local_minutes, opening_status
+)
+from restaurants.version import publish_data_version, published_data_version
+from restaurants.views import home_async, search_async
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'restaurants.csv'
+DATA_VERSION_FILE = Path(tempfile.gettempdir()) / 'restaurants_test_data_version'
+SNAPSHOT_FILE = Path(tempfile.gettempdir()) / 'restaurants_test.snapshot'
 
 class BaseTestCase(TestCase):
   def setUp(self):
@@ -100,11 +137,538 @@ class UtilsTestCase(BaseTestCase):
       )
     assert not mock_add_to_db.called
 
+  def test_parse_hours_wraps_overnight_windows(self):
+    self.assertEqual(
+      [
+        ([5], datetime.time(15), datetime.time(23, 59, 59, 999999)),
+        ([6], datetime.time(0), datetime.time(1, 30)),
+        ([6], datetime.time(15), datetime.time(23, 59, 59, 999999)),
+        ([0], datetime.time(0), datetime.time(1, 30)),
+        ([0, 1, 2], datetime.time(11), datetime.time(22)),
+      ],
+      parse_hours("Sat 3 pm - 1:30 am / Sun 3 pm - 1:30 am / Mon-Wed 11 am - 10 pm")
+    )
+
+  def test_execute_search_across_sunday_midnight(self):
+    parse_row({"Restaurant Name": "Night Owl", "Hours": "Sun 3 pm - 1:30 am"})
+    night_owl = Restaurant.objects.get(name="Night Owl")
+    self.assertEqual(
+      [(night_owl.pk, 6 * 1440 + 900, 6 * 1440 + 1439), (night_owl.pk, 0, 90)],
+      list(night_owl.openingwindow_set.values_list('restaurant_id', 'start_minute_of_week', 'end_minute_of_week'))
+    )
+    for use_index in (True, False):
+      self.assertIn(night_owl, execute_search('2024-07-08 01:15:00.0', use_index=use_index))
+      self.assertNotIn(night_owl, execute_search('2024-07-08 01:45:00.0', use_index=use_index))
+
   def test_execute_search(self):
     actual = [rest for rest in execute_search('2024-07-08 11:00:00.0')]
     expected = [Restaurant.objects.get(name="Cook Out"), Restaurant.objects.get(name="Waffle House")]
     self.assertEqual(expected, actual)
 
+  def test_execute_interval_search(self):
+    names = [name for _, name in execute_interval_search('2024-07-08 11:00:00.0', '2024-07-09 04:00:59.0')]
+    self.assertEqual(["Cook Out", "Waffle House"], names)
+    names = [name for _, name in execute_interval_search('2024-07-08 11:00:00.0', '2024-07-09 04:01:00.0')]
+    self.assertEqual(["Waffle House"], names)
+    with self.assertRaises(ValueError):
+      execute_interval_search('2024-07-09 11:00:00.0', '2024-07-08 11:00:00.0')
+
+  def test_opening_status(self):
+    cook_out = Restaurant.objects.get(name="Cook Out")
+    self.assertEqual(
+      ("Cook Out", False, datetime.datetime(2024, 7, 8, 11), datetime.datetime(2024, 7, 9, 4, 1)),
+      opening_status(cook_out.pk, '2024-07-08 05:00:30.0')
+    )
+    # sunday night into monday morning
+    self.assertEqual(
+      ("Cook Out", True, datetime.datetime(2024, 7, 15, 11), datetime.datetime(2024, 7, 15, 4, 1)),
+      opening_status(cook_out.pk, '2024-07-14 23:00:00.0')
+    )
+    waffle_house = Restaurant.objects.get(name="Waffle House")
+    self.assertEqual(("Waffle House", True, None, None), opening_status(waffle_house.pk, '2024-07-14 23:00:00.0'))
+    with self.assertRaises(Restaurant.DoesNotExist):
+      opening_status(0, '2024-07-14 23:00:00.0')
+
+  def test_parse_location(self):
+    self.assertIsNone(parse_location(self.row))
+    self.assertEqual((35.78, -78.64), parse_location({**self.row, "Latitude": " 35.78", "Longitude": "-78.64 "}))
+    for latitude, longitude in (("35.78", ""), ("91", "0"), ("0", "-180.5"), ("north", "0")):
+      with self.assertRaises(ValueError):
+        parse_location({**self.row, "Latitude": latitude, "Longitude": longitude})
+
+  def test_execute_nearby_search(self):
+    # downtown Raleigh, North Hills about 7 km north, Durham about 35 km away
+    for name, location in (("Culvers", (35.7796, -78.6382)), ("Cook Out", (35.8383, -78.6420)), ("Waffle House", (35.9940, -78.8986))):
+      Restaurant.objects.filter(name=name).update(latitude=location[0], longitude=location[1])
+    parse_row({"Restaurant Name": "Night Owl", "Hours": "Mon 9 pm - 11 pm", "Latitude": "35.7800", "Longitude": "-78.6390"})
+
+    results = execute_nearby_search('2024-07-08 11:00:00.0', 35.7796, -78.6382, 10)
+    self.assertEqual(["Cook Out"], [name for _, name, _ in results])
+    self.assertAlmostEqual(6.53, results[0][2], places=1)
+    results = execute_nearby_search('2024-07-08 22:00:00.0', 35.7796, -78.6382, 50)
+    self.assertEqual(["Culvers", "Night Owl", "Cook Out", "Waffle House"], [name for _, name, _ in results])
+    with self.assertRaises(ValueError):
+      execute_nearby_search('2024-07-08 22:00:00.0', 95, 0, 10)
+
+  def test_parse_timezone(self):
+    self.assertEqual('', parse_timezone(self.row))
+    self.assertEqual('America/Chicago', parse_timezone({**self.row, "Timezone": " America/Chicago "}))
+    for timezone in ('America/Raleigh', '../etc/passwd'):
+      with self.assertRaises(ValueError):
+        parse_timezone({**self.row, "Timezone": timezone})
+
+  def test_searches_in_restaurant_time_zones(self):
+    Restaurant.objects.filter(name="Cook Out").update(timezone='America/Los_Angeles')
+    cook_out = Restaurant.objects.get(name="Cook Out")
+    for use_index in (True, False):
+      # 8 am in Los Angeles, Cook Out opens at 11
+      self.assertEqual(["Waffle House"], [r.name for r in execute_search('2024-07-08 11:00:00.0', use_index=use_index)])
+      self.assertEqual(
+        ["Cook Out", "Waffle House"], [r.name for r in execute_search('2024-07-08T18:00:00Z', use_index=use_index)]
+      )
+      # a weekday and time is wall time wherever the restaurant is
+      self.assertEqual(["Cook Out", "Waffle House"], [r.name for r in execute_search('Mon 11:00', use_index=use_index)])
+    self.assertEqual([["Waffle House"]], execute_batch_search([datetime.datetime(2024, 7, 8, 11)]))
+    self.assertEqual(
+      ["Waffle House"], [name for _, name in execute_interval_search('2024-07-08 13:00:00.0', '2024-07-08 15:00:00.0')]
+    )
+    # 2 am in Los Angeles, open until 4 am there
+    self.assertEqual(
+      ("Cook Out", True, datetime.datetime(2024, 7, 8, 14), datetime.datetime(2024, 7, 8, 7, 1)),
+      opening_status(cook_out.pk, '2024-07-08 05:00:00.0')
+    )
+
+  def test_parse_special_hours(self):
+    row = {"Restaurant Name": "Bonchon", "Date": "2024-12-24", "Hours": "11 am - 3 pm / 5 pm - 1 am"}
+    self.assertEqual(
+      ("Bonchon", datetime.date(2024, 12, 24), [
+        (datetime.time(11), datetime.time(15)), (datetime.time(17), datetime.time(1))
+      ]),
+      parse_special_hours(row)
+    )
+    self.assertEqual([(None, None)], parse_special_hours({**row, "Hours": "Closed"})[2])
+    for bad in ({"Date": "12/24/2024"}, {"Hours": "all day"}):
+      with self.assertRaises(ValueError):
+        parse_special_hours({**row, **bad})
+
+  def test_special_hours_replace_weekly_hours_on_their_date(self):
+    # Waffle House is open around the clock but closed on Christmas in Paris, Cook Out only opens
+    # from 5 pm to 2 am, on top of its 11 am - 4 am weekly hours of the next day
+    Restaurant.objects.filter(name="Waffle House").update(timezone='Europe/Paris')
+    waffle_house = Restaurant.objects.get(name="Waffle House")
+    cook_out = Restaurant.objects.get(name="Cook Out")
+    SpecialHours.objects.create(restaurant=waffle_house, date=datetime.date(2024, 12, 25))
+    SpecialHours.objects.create(
+      restaurant=cook_out, date=datetime.date(2024, 12, 25), opening_time=datetime.time(17), closing_time=datetime.time(2)
+    )
+    expected = {
+      # a Wednesday like any other
+      '2024-12-18 12:00:00.0': ["Cook Out", "Waffle House"],
+      # already Christmas in Paris
+      '2024-12-24 19:00:00.0': ["Culvers", "Cook Out"],
+      '2024-12-25 12:00:00.0': [],
+      '2024-12-25 17:30:00.0': ["Culvers", "Cook Out"],
+      '2024-12-26 01:30:00.0': ["Cook Out", "Waffle House"],
+      'Wed 12:00': ["Cook Out", "Waffle House"],
+    }
+    for use_index in (True, False):
+      for time_string, names in expected.items():
+        self.assertEqual(names, [r.name for r in execute_search(time_string, use_index=use_index)], time_string)
+      self.assertEqual(
+        [["Cook Out", "Waffle House"], []],
+        execute_batch_search([datetime.datetime(2024, 12, 18, 12), datetime.datetime(2024, 12, 25, 12)], use_index=use_index)
+      )
+    self.assertFalse(opening_status(waffle_house.pk, '2024-12-25 12:00:00.0').is_open)
+    self.assertTrue(opening_status(waffle_house.pk, '2024-12-18 12:00:00.0').is_open)
+
+    search_cache.clear()
+    self.assertIn(b'These 2 restaurants', self.client.get('/search/', {"timestamp": "2024-12-18 12:00:00.0"}).content)
+    self.assertNotIn(b'Waffle House', self.client.get('/search/', {"timestamp": "2024-12-25 12:00:00.0"}).content)
+
+class HoursParserTestCase(TestCase):
+
+  def test_parse_time_handles_noon_and_midnight(self):
+    self.assertEqual((datetime.time(0, 0), datetime.time(12, 0)), hours.parse_time("Mon 12 am - 12 pm"))
+    self.assertEqual((datetime.time(12, 30), datetime.time(0, 15)), hours.parse_time("Mon 12:30 pm - 12:15 am"))
+
+  def test_parse_time_rejects_invalid_clock(self):
+    with self.assertRaises(ValueError):
+      hours.parse_time("Mon 13 pm - 11 pm")
+    with self.assertRaises(hours.HoursFormatError):
+      hours.parse_time("Mon 11AM - 8PM")
+
+  def test_cached_results_are_not_mutated_by_callers(self):
+    days = parse_days("Sat 3 pm - 1:30 am")
+    days.append(6)
+    self.assertEqual([5], parse_days("Sat 3 pm - 1:30 am"))
+    windows = parse_hours("Mon-Wed 5 pm - 12:30 am / Sun 3 pm - 1:30 am")
+    windows[0][0].append(6)
+    self.assertEqual(windows[1:], parse_hours("Mon-Wed 5 pm - 12:30 am / Sun 3 pm - 1:30 am")[1:])
+    self.assertEqual([0, 1, 2], parse_hours("Mon-Wed 5 pm - 12:30 am / Sun 3 pm - 1:30 am")[0][0])
+
+  def test_single_day_then_range(self):
+    t = datetime.time
+    self.assertEqual([0, 2, 3, 4], parse_days("Mon, Wed-Fri 11 am - 10 pm"))
+    # in any hours set of a row, not only the first
+    self.assertEqual(
+      [([1], t(9), t(17)), ([0, 2, 3, 4, 5, 6], t(11), t(22))],
+      parse_hours("Tues 9 am - 5 pm  / Mon, Wed-Sun 11 am - 10 pm")
+    )
+
+  def test_format_hours(self):
+    t = datetime.time
+    bonchon = [(day, t(17), t(0, 30)) for day in (0, 1, 2)] + [(day, t(17), t(1, 30)) for day in (3, 4)]
+    bonchon += [(5, t(15), t(1, 30)), (6, t(15), t(23, 30))]
+    self.assertEqual(
+      "Mon-Wed 5 pm - 12:30 am / Thu-Fri 5 pm - 1:30 am / Sat 3 pm - 1:30 am / Sun 3 pm - 11:30 pm",
+      hours.format_hours(bonchon)
+    )
+    self.assertEqual("Mon-Wed, Fri 12 pm - 12 am", hours.format_hours((day, t(12), t(0)) for day in (4, 0, 1, 2)))
+    self.assertEqual("Mon, Wed-Fri 12 pm - 12 am", hours.format_hours((day, t(12), t(0)) for day in (4, 0, 2, 3)))
+    # lists of days `parse_days` cannot read are written as separate hours sets
+    self.assertEqual(
+      "Mon 11 am - 2 pm / Mon 5 pm - 10 pm / Wed 11 am - 2 pm / Sat-Sun 11 am - 2 pm",
+      hours.format_hours([(day, t(11), t(14)) for day in (0, 2, 5, 6)] + [(0, t(17), t(22))])
+    )
+
+class TimestampsTestCase(TestCase):
+
+  def test_accepted_formats(self):
+    monday_11 = datetime.datetime(2024, 7, 8, 11, 0)
+    for time_string in (
+      "'2024-07-08 11:00:00.0'", '2024-07-08 11:00:00', '2024-07-08T11:00', '2024-07-08T11:00:00.000000',
+      '2024-07-08T15:00:00Z', '2024-07-08T17:00:00+02:00', '1720450800'
+    ):
+      self.assertEqual(monday_11, timestamps.parse_timestamp(time_string), time_string)
+      self.assertEqual(11 * 60, timestamps.parse_week_minute(time_string), time_string)
+    self.assertEqual(
+      datetime.datetime(2024, 7, 8, 11, 0, 0, 123456), timestamps.parse_timestamp('2024-07-08 11:00:00.1234567')
+    )
+
+  def test_single_digit_fields(self):
+    # as `strptime('%Y-%m-%d %H:%M:%S.%f')` read them
+    for time_string in ('2024-7-8 9:05:00', '2024-7-8 9:5:0.0', '2024-07-8T09:05'):
+      self.assertEqual(datetime.datetime(2024, 7, 8, 9, 5), timestamps.parse_timestamp(time_string), time_string)
+    with self.assertRaises(timestamps.TimestampFormatError):
+      timestamps.parse_timestamp('2024-7-8 123:05:00')
+
+  def test_weekday_and_time(self):
+    self.assertEqual(11 * 60, timestamps.parse_week_minute('Mon 11:00'))
+    self.assertEqual(4 * 1440 + 18 * 60 + 30, timestamps.parse_week_minute('friday 6:30 pm'))
+    self.assertEqual(1 * 1440, timestamps.parse_week_minute('Tues 12:00 AM'))
+    for time_string in ('Mon 24:00', 'Moon 11:00', 'T 11:00', 'Mon 13:00 pm'):
+      with self.assertRaises(timestamps.TimestampFormatError, msg=time_string):
+        timestamps.parse_week_minute(time_string)
+    with self.assertRaises(ValueError):
+      timestamps.parse_timestamp('Mon 11:00')
+
+  def test_parse_instant(self):
+    new_york = ZoneInfo('America/New_York')
+    self.assertEqual(
+      datetime.datetime(2024, 7, 8, 11, tzinfo=new_york), timestamps.parse_instant('2024-07-08 11:00:00.0')
+    )
+    instant = timestamps.parse_instant('2024-11-03T06:30:00Z')
+    # the second 1:30 am of the night the clocks go back
+    self.assertEqual((datetime.datetime(2024, 11, 3, 1, 30), 1), (instant.replace(tzinfo=None), instant.fold))
+    self.assertEqual(new_york, instant.tzinfo)
+    self.assertIsNone(timestamps.parse_instant('Mon 11:00'))
+
+  def test_rejected_formats(self):
+    for time_string in ('2024-07-07 12 PM', '2024-13-01 11:00', '2024-07-08 11', '', 'yesterday'):
+      with self.assertRaisesRegex(ValueError, 'does not match format', msg=time_string):
+        timestamps.parse_week_minute(time_string)
+
+class IndexTestCase(BaseTestCase):
+
+  def test_index_matches_orm_search_over_the_week(self):
+    with open(DATA_FILE, 'r') as file:
+      for row in csv.DictReader(file):
+        parse_row(row)
+    monday = datetime.datetime(2024, 7, 8)
+    for minute in range(0, MINUTES_PER_WEEK, 15):
+      time_string = str(monday + datetime.timedelta(minutes=minute, seconds=30))
+      if '.' not in time_string:
+        time_string += '.0'
+      expected = list(Restaurant.objects.filter(
+        operatingday_set__name=(minute // 1440),
+        operatingday_set__operatinghours_set__opening_time__lte=datetime.time(minute % 1440 // 60, minute % 60),
+        operatingday_set__operatinghours_set__closing_time__gte=datetime.time(minute % 1440 // 60, minute % 60)
+      ).distinct().order_by('pk'))
+      self.assertEqual(expected, list(execute_search(time_string, use_index=False)), time_string)
+      self.assertEqual(expected, list(execute_search(time_string, use_index=True)), time_string)
+
+  def test_index_search_past_the_query_parameter_limit(self):
+    get_index(), get_override_index()
+    with patch.object(connection.features, 'max_query_params', 1):
+      with self.assertNumQueries(1) as queries:
+        restaurants = [r.name for r in execute_search('2024-07-08 12:00:00.0', use_index=True)]
+    self.assertEqual(["Cook Out", "Waffle House"], restaurants)
+    self.assertNotIn('openingwindow', queries.captured_queries[0]['sql'])
+
+  def test_index_is_rebuilt_when_data_changes(self):
+    index = get_index()
+    self.assertIs(index, get_index())
+    parse_row({"Restaurant Name": "Night Owl", "Hours": "Mon 9 pm - 11 pm"})
+    self.assertIsNot(index, get_index())
+    night_owl = Restaurant.objects.get(name="Night Owl")
+    self.assertIn(night_owl.pk, get_index().lookup(21 * 60 + 30))
+
+  def test_overlapping_windows_keep_restaurant_open(self):
+    index = WeekIndex([(1, 0, 100), (1, 50, 200), (2, 150, 160)], {1: "A", 2: "B"})
+    self.assertEqual((1,), index.lookup(100))
+    self.assertEqual((1, 2), index.lookup(155))
+    self.assertEqual((1,), index.lookup(200))
+    self.assertEqual((), index.lookup(201))
+
+  def test_week_index_rebuilds_segments_from_checkpoints(self):
+    generator = random.Random(7)
+    windows = []
+    for restaurant_id in range(1, 301):
+      for _ in range(generator.randint(0, 4)):
+        start = generator.randrange(MINUTES_PER_WEEK - 1)
+        windows.append((restaurant_id, start, min(start + generator.randrange(0, 600), MINUTES_PER_WEEK - 1)))
+    index = WeekIndex(windows, {restaurant_id: str(restaurant_id) for restaurant_id in range(1, 301)})
+    ids, boundaries, interval, checkpoints, flip_offsets, flips = index.timeline
+    self.assertEqual(-(-len(boundaries) // interval), len(checkpoints))
+    self.assertLess(3 * interval, len(boundaries))
+    # rebuilt from the timeline, as from a snapshot
+    copy = WeekIndex.from_timeline(ids, index.names, *index.timeline[1:])
+    for minute in range(0, MINUTES_PER_WEEK, 23):
+      expected = tuple(sorted({pk for pk, first, last in windows if first <= minute <= last}))
+      self.assertEqual(expected, index.lookup(minute), minute)
+      self.assertEqual(expected, tuple(pk for pk in ids if copy.is_open(pk, minute)), minute)
+
+  def test_schedule_index_transitions(self):
+    # 1 is open sunday 8 pm - monday 2 am, 2 never, 3 around the clock
+    schedule = ScheduleIndex(
+      [(1, 0, 120), (1, MINUTES_PER_WEEK - 240, MINUTES_PER_WEEK - 1), (3, 0, MINUTES_PER_WEEK - 1)],
+      {1: "A", 2: "B", 3: "C"}
+    )
+    self.assertTrue(schedule.is_open_throughout(1, MINUTES_PER_WEEK - 240, 360))
+    self.assertFalse(schedule.is_open_throughout(1, MINUTES_PER_WEEK - 240, 361))
+    self.assertEqual(MINUTES_PER_WEEK - 370, schedule.next_opening(1, 130))
+    self.assertEqual(221, schedule.next_closing(1, MINUTES_PER_WEEK - 100))
+    self.assertEqual(MINUTES_PER_WEEK - 120, schedule.next_opening(1, MINUTES_PER_WEEK - 120))
+    self.assertFalse(schedule.is_open_throughout(2, 0, 0))
+    self.assertEqual((None, None), (schedule.next_opening(2, 0), schedule.next_closing(2, 0)))
+    self.assertTrue(schedule.is_open_throughout(3, 5, 10 * MINUTES_PER_WEEK))
+    self.assertEqual((None, None), (schedule.next_opening(3, 0), schedule.next_closing(3, 0)))
+    with self.assertRaises(KeyError):
+      schedule.next_opening(99, 0)
+
+  def test_interval_search_matches_point_searches(self):
+    monday = datetime.datetime(2024, 7, 8)
+    index = get_index()
+    for start in range(0, MINUTES_PER_WEEK, 7 * 60 + 13):
+      for length in (0, 59, 600, 1500):
+        expected = set.intersection(*(set(index.lookup(start + i)) for i in range(length + 1)))
+        start_string = str(monday + datetime.timedelta(minutes=start)) + '.0'
+        end_string = str(monday + datetime.timedelta(minutes=start + length)) + '.0'
+        actual = {pk for pk, _ in execute_interval_search(start_string, end_string)}
+        self.assertEqual(expected, actual, (start_string, end_string))
+
+  def test_week_index_is_open_matches_lookup(self):
+    index = get_index()
+    for minute in range(0, MINUTES_PER_WEEK, 30):
+      self.assertEqual(set(index.lookup(minute)), {pk for pk in index.names if index.is_open(pk, minute)}, minute)
+    self.assertFalse(index.is_open(0, 0))
+
+  def test_zoned_index_matches_brute_force_across_dst(self):
+    generator = random.Random(19)
+    zone_names = ['America/New_York', 'America/Chicago', 'America/Los_Angeles', 'Europe/London', 'Asia/Kolkata']
+    windows, zones = [], {}
+    for restaurant_id in range(1, 201):
+      zones[restaurant_id] = generator.choice(zone_names + [''])
+      for _ in range(generator.randint(0, 3)):
+        start = generator.randrange(MINUTES_PER_WEEK - 1)
+        windows.append((restaurant_id, start, min(start + generator.randrange(1, 900), MINUTES_PER_WEEK - 1)))
+    index = WeekIndex(windows, {restaurant_id: str(restaurant_id) for restaurant_id in zones}, zones)
+    self.assertEqual(sorted(set(zone_names)), list(index.zones[0]))
+
+    new_york = ZoneInfo('America/New_York')
+    # every 37 minutes over the american and european clock changes of spring and fall 2024
+    for first_day in (datetime.datetime(2024, 3, 9), datetime.datetime(2024, 3, 30), datetime.datetime(2024, 11, 2)):
+      start = first_day.replace(tzinfo=datetime.timezone.utc)
+      for step in range(0, 3 * 24 * 60, 37):
+        instant = (start + datetime.timedelta(minutes=step)).astimezone(new_york)
+        expected = []
+        for restaurant_id, zone in sorted(zones.items()):
+          local = instant.astimezone(ZoneInfo(zone or 'America/New_York'))
+          minute = local.weekday() * 1440 + local.hour * 60 + local.minute
+          if any(first <= minute <= last for pk, first, last in windows if pk == restaurant_id):
+            expected.append(restaurant_id)
+        minutes = index.local_minutes(instant.weekday() * 1440 + instant.hour * 60 + instant.minute, instant)
+        self.assertEqual(tuple(expected), index.lookup_local(minutes), instant)
+        self.assertEqual(expected, [pk for pk in zones if index.is_open_local(pk, minutes)], instant)
+
+  @override_settings(RESTAURANTS_GRID_CELL_DEGREES=0.5)
+  def test_grid_index_matches_brute_force(self):
+    def distance(latitude, longitude, other_latitude, other_longitude):
+      a, b = math.radians(latitude), math.radians(other_latitude)
+      cos_angle = math.sin(a) * math.sin(b) + math.cos(a) * math.cos(b) * math.cos(math.radians(other_longitude - longitude))
+      return EARTH_RADIUS_KM * math.acos(max(-1.0, min(1.0, cos_angle)))
+
+    generator = random.Random(18)
+    # clusters around the antimeridian, a pole and a city, plus restaurants without a location
+    centers = [(0, 179.9), (89.8, 0), (35.78, -78.64)]
+    locations = [
+      (i, center[0] + generator.uniform(-0.8, 0.8), ((center[1] + generator.uniform(-0.8, 0.8) + 180) % 360) - 180)
+      for i, center in enumerate(centers * 200)
+    ]
+    locations = [(i, min(latitude, 90.0), longitude) for i, latitude, longitude in locations]
+    names = {i: str(i) for i in range(len(locations) + 10)}
+    grid = GridIndex(locations + [(len(locations), None, None)], names)
+
+    for latitude, longitude in [(0, -179.95), (0, 179.5), (90, 0), (89.5, 120), (35.8, -78.6), (10, 10)]:
+      for radius in (1, 25, 80):
+        expected = {i for i, *location in locations if distance(latitude, longitude, *location) <= radius}
+        actual = grid.nearby(latitude, longitude, radius)
+        self.assertEqual(expected, {i for _, i in actual}, (latitude, longitude, radius))
+        self.assertEqual(sorted(actual), actual)
+
+    rebuilt = GridIndex.from_locations(*grid.locations[:1], names, *grid.locations[1:])
+    self.assertEqual(grid.nearby(0, 179.9, 50), rebuilt.nearby(0, 179.9, 50))
+    for latitude, longitude, radius in ((91, 0, 1), (0, 181, 1), (0, 0, 0)):
+      with self.assertRaises(ValueError):
+        grid.nearby(latitude, longitude, radius)
+
+  def test_name_index_prefixes(self):
+    names = NameIndex({1: "Café Luna", 2: "CAFE  lunar", 3: "Bonchon", 4: "Cafeteria"})
+    self.assertEqual("cafe luna", fold_name(" Café\tLuna "))
+    self.assertEqual([1, 2, 4], list(names.prefix("ÇAFE")))
+    self.assertEqual([1, 2], list(names.prefix("cafe lu")))
+    self.assertEqual([], list(names.prefix("cafes")))
+
+  def test_name_index_updates_only_changed_names(self):
+    names = NameIndex.from_db()
+    parse_row({"Restaurant Name": "Crème de la Crème", "Hours": "Mon-Sun 11 am - 10 pm"})
+    Restaurant.objects.filter(name="Culvers").update(name="Culver's")
+    Restaurant.objects.filter(name="Waffle House").delete()
+    with patch('restaurants.index.fold_name', wraps=fold_name) as folded:
+      updated = names.updated()
+    self.assertEqual(2, folded.call_count)
+    rebuilt = NameIndex.from_db()
+    self.assertEqual(list(rebuilt.entries[0]), list(updated.entries[0]))
+    self.assertEqual(list(rebuilt.entries[1]), list(updated.entries[1]))
+    self.assertEqual(["Cook Out", "Crème de la Crème", "Culver's"], [updated.names[pk] for pk in updated.prefix("c")])
+
+  def test_override_index_decisions(self):
+    christmas = datetime.date(2024, 12, 25)
+    overrides = OverrideIndex([
+      (1, '', christmas, None, None),
+      (2, 'Europe/Paris', christmas, 17 * 60, 2 * 60),
+      (2, 'Europe/Paris', christmas, 11 * 60, 14 * 60),
+    ])
+    self.assertFalse(overrides.near(datetime.date(2024, 12, 18)))
+    for date in (datetime.date(2024, 12, 24), christmas, datetime.date(2024, 12, 27)):
+      self.assertTrue(overrides.near(date))
+    self.assertEqual({1: False}, overrides.decisions('America/New_York', christmas, 12 * 60))
+    self.assertEqual({2: True}, overrides.decisions('Europe/Paris', christmas, 12 * 60))
+    self.assertEqual({2: False}, overrides.decisions('Europe/Paris', christmas, 15 * 60))
+    # the evening window runs past midnight, leaving the next day's weekly hours otherwise alone
+    self.assertEqual({2: True}, overrides.decisions('Europe/Paris', datetime.date(2024, 12, 26), 2 * 60))
+    self.assertEqual({}, overrides.decisions('Europe/Paris', datetime.date(2024, 12, 26), 2 * 60 + 1))
+
+@skipUnless(availability.numpy_available(), 'NumPy is not installed')
+class AvailabilityTestCase(BaseTestCase):
+
+  def test_matrix_matches_index(self):
+    engine = availability.AvailabilityEngine.from_db()
+    index = get_index()
+    minutes = availability.slot_minutes(15)
+    matrix = engine.matrix(minutes)
+    self.assertEqual((3, len(minutes)), matrix.shape)
+    for column, minute in enumerate(minutes):
+      self.assertEqual(list(index.lookup(minute)), engine.ids[matrix[:, column]].tolist(), minute)
+    self.assertEqual(matrix.sum(axis=0).tolist(), engine.counts(minutes).tolist())
+
+  def test_overlapping_windows_are_counted_once(self):
+    engine = availability.AvailabilityEngine([1, 2], ["A", "B"], [0, 0, 1], [50, 0, 150], [200, 100, 160])
+    self.assertEqual([1, 2, 1, 0], engine.counts([100, 155, 200, 201]).tolist())
+    self.assertEqual([[1], [1, 2], [1], []], [ids.tolist() for ids in engine.lookup([100, 155, 200, 201])])
+
+  def test_batch_lookup_in_any_order(self):
+    engine = availability.AvailabilityEngine.from_db()
+    minutes = [10079, 5 * 60, 0, 5 * 60, 11 * 60]
+    with patch.object(availability, 'BLOCK_CELLS', 4):
+      found = engine.lookup(minutes)
+    self.assertEqual([list(get_index().lookup(minute)) for minute in minutes], [ids.tolist() for ids in found])
+
+  def test_command_writes_csv_and_npy(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'matrix.csv'
+      call_command('availability', output=str(path), step=720, stdout=StringIO())
+      with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+      self.assertEqual(['restaurant_id', 'name', 'Mon 00:00', 'Mon 12:00'], rows[0][:4])
+      self.assertEqual(['Cook Out', '1', '1'], rows[2][1:4])
+
+      path = Path(directory) / 'counts.npy'
+      call_command('availability', output=str(path), step=60, counts=True, stdout=StringIO())
+      counts = availability.np.load(path)
+      self.assertEqual(len(get_index().lookup(11 * 60)), counts[11])
+
+  def test_command_writes_matrix_block_by_block(self):
+    expected = availability.AvailabilityEngine.from_db().matrix(availability.slot_minutes(60))
+    with tempfile.TemporaryDirectory() as directory, patch.object(availability, 'BLOCK_CELLS', 200):
+      path = Path(directory) / 'matrix.npy'
+      call_command('availability', output=str(path), step=60, stdout=StringIO())
+      self.assertEqual(expected.tolist(), availability.np.load(path).tolist())
+
+      path = Path(directory) / 'matrix.csv'
+      call_command('availability', output=str(path), step=60, stdout=StringIO())
+      with open(path, newline='') as file:
+        rows = list(csv.reader(file))[1:]
+      self.assertEqual(['Culvers', 'Cook Out', 'Waffle House'], [row[1] for row in rows])
+      self.assertEqual(expected.astype('u1').tolist(), [list(map(int, row[2:])) for row in rows])
+
+class DatabaseTestCase(TestCase):
+
+  def test_sqlite_pragmas_are_applied(self):
+    with connection.cursor() as cursor:
+      cursor.execute('PRAGMA synchronous')
+      self.assertEqual(1, cursor.fetchone()[0])  # normal
+      cursor.execute('PRAGMA temp_store')
+      self.assertEqual(2, cursor.fetchone()[0])  # memory
+
+class AvailabilityCommandTestCase(TestCase):
+
+  def test_command_needs_numpy(self):
+    with patch.object(availability, 'np', None), self.assertRaises(CommandError):
+      call_command('availability', output='unused.csv', stdout=StringIO())
+
+class SearchCacheTestCase(BaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    search_cache.clear()
+
+  def test_search_is_cached_per_week_minute(self):
+    self.client.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"})
+    with self.assertNumQueries(0):
+      # a week later, a few seconds into the same minute
+      response = self.client.get('/search/', {"timestamp": "2024-07-15 11:00:42.5"})
+    self.assertIn(b'Cook Out', response.content)
+    self.assertEqual(403, self.client.get('/search/cache/').status_code)
+    with self.settings(RESTAURANTS_METRICS_TOKEN='s3cret'):
+      response = self.client.get('/search/cache/', HTTP_AUTHORIZATION='Bearer s3cret')
+    self.assertEqual({"hits": 1, "misses": 1, "size": 1, "maxsize": 2048}, response.json())
+
+  @override_settings(RESTAURANTS_DATA_VERSION_FILE=DATA_VERSION_FILE, RESTAURANTS_SNAPSHOT_FILE=SNAPSHOT_FILE)
+  def test_search_cache_is_invalidated_by_loaddata(self):
+    self.assertNotIn(b'Seoul 116', self.client.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"}).content)
+    call_command('loaddata', file=str(DATA_FILE), bulk=True, stdout=StringIO())
+    self.assertIn(b'Seoul 116', self.client.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"}).content)
+
+  def test_lru_eviction(self):
+    cache = VersionedLRUCache(maxsize=2)
+    cache.get_or_compute(1, lambda: 'one')
+    cache.get_or_compute(2, lambda: 'two')
+    cache.get_or_compute(1, lambda: 'one')
+    cache.get_or_compute(3, lambda: 'three')
+    self.assertEqual('one', cache.get_or_compute(1, lambda: 'recomputed'))
+    self.assertEqual('recomputed', cache.get_or_compute(2, lambda: 'recomputed'))
+
 class ViewsTestCase(BaseTestCase):
 
   def test_home_view(self):
@@ -118,7 +682,637 @@ class ViewsTestCase(BaseTestCase):
     self.assertIn(b'Waffle House', response.content)
     self.assertIn(b'Cook Out', response.content)
 
+  def test_search_view_other_formats(self):
+    for time_string in ('2024-07-08T05:00', 'Mon 05:00', '1720429200'):
+      response = self.client.get('/search/', {"timestamp": time_string})
+      self.assertIn(b'These 1 restaurants', response.content, time_string)
+      self.assertIn(b'Waffle House', response.content, time_string)
+
   def test_search_view_invalid_timestring(self):
     response = self.client.get('/search/', {"timestamp": "2024-07-07 12 PM"})
     self.assertEqual(400, response.status_code)
     self.assertIn(b'does not match format', response.content)
+
+  def test_search_batch_view_with_timestamps(self):
+    response = self.client.get('/search/batch/', {"timestamp": ["2024-07-08 11:00:00.0", "2024-07-08 05:00:00.0"]})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(
+      [
+        {"timestamp": "2024-07-08 11:00:00.0", "restaurants": ["Cook Out", "Waffle House"]},
+        {"timestamp": "2024-07-08 05:00:00.0", "restaurants": ["Waffle House"]}
+      ],
+      response.json()["results"]
+    )
+
+  def test_search_batch_view_with_range(self):
+    response = self.client.get('/search/batch/', {
+      "start": "2024-07-08 10:00:00.0",
+      "end": "2024-07-08 11:00:00.0",
+      "step": "30"
+    })
+    self.assertEqual(200, response.status_code)
+    results = response.json()["results"]
+    self.assertEqual(
+      ["2024-07-08 10:00:00.000000", "2024-07-08 10:30:00.000000", "2024-07-08 11:00:00.000000"],
+      [result["timestamp"] for result in results]
+    )
+    self.assertEqual(["Cook Out", "Waffle House"], results[-1]["restaurants"])
+
+  def test_search_batch_view_matches_search_without_index(self):
+    datetimes = [datetime.datetime(2024, 7, 7) + datetime.timedelta(hours=hour) for hour in range(48)]
+    self.assertEqual(execute_batch_search(datetimes, use_index=True), execute_batch_search(datetimes, use_index=False))
+
+  def test_search_batch_view_invalid_input(self):
+    self.assertEqual(400, self.client.get('/search/batch/').status_code)
+    response = self.client.get('/search/batch/', {"timestamp": ["2024-07-08 11:00:00.0", "2024-07-07 12 PM"]})
+    self.assertEqual(400, response.status_code)
+    self.assertIn(b'does not match format', response.content)
+    for params in (
+      {"start": "2024-01-01 10:00", "end": "2024-01-02 10:00", "step": "99999999999999"},
+      {"start": "2024-01-01 10:00", "end": "2024-01-02 10:00", "step": "0"},
+    ):
+      self.assertEqual(400, self.client.get('/search/batch/', params).status_code)
+
+  def test_search_batch_view_range_ending_at_the_last_date(self):
+    response = self.client.get('/search/batch/', {"start": "9999-12-31 23:00", "end": "9999-12-31 23:59", "step": "30"})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(
+      ["9999-12-31 23:00:00.000000", "9999-12-31 23:30:00.000000"],
+      [result["timestamp"] for result in response.json()["results"]]
+    )
+
+  def test_search_view_renders_with_one_query(self):
+    with self.settings(RESTAURANTS_USE_INDEX=False):
+      # the time zones in use are read once per data version
+      self.client.get('/search/', {"timestamp": "2024-07-09 12:00:00.0"})
+      search_cache.clear()
+      with self.assertNumQueries(1):
+        response = self.client.get('/search/', {"timestamp": "2024-07-09 11:00:00.0"})
+    self.assertIn(b'These 2 restaurants', response.content)
+
+  def test_search_view_answers_matching_etag_without_queries(self):
+    params = {"timestamp": "2024-07-08 11:00:00.0"}
+    for use_index in (True, False):
+      search_cache.clear()
+      with self.settings(RESTAURANTS_USE_INDEX=use_index):
+        response = self.client.get('/search/', params)
+        etag = response.headers["ETag"]
+        self.assertEqual("public, max-age=60", response.headers["Cache-Control"])
+        self.assertIn("Last-Modified", response.headers)
+        with self.assertNumQueries(0):
+          response = self.client.get('/search/', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers["ETag"])
+        # another minute of the week with different results
+        self.assertNotEqual(etag, self.client.get('/search/', {"timestamp": "2024-07-08 20:00:00.0"}).headers["ETag"])
+
+    # the same minute, later in the same week, is the same page
+    self.assertEqual(304, self.client.get(
+      '/search/', {"timestamp": "2024-07-15 11:00:00.0"}, HTTP_IF_NONE_MATCH=etag
+    ).status_code)
+    parse_row({"Restaurant Name": "Bojangles", "Hours": "Mon-Sun 10 am - 10 pm"})
+    response = self.client.get('/search/', params, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(200, response.status_code)
+    self.assertNotEqual(etag, response.headers["ETag"])
+    self.assertIn(b'Bojangles', response.content)
+
+  def test_home_view_is_cacheable(self):
+    response = self.client.get('/')
+    self.assertNotIn(b'csrfmiddlewaretoken', response.content)
+    self.assertEqual(304, self.client.get('/', HTTP_IF_NONE_MATCH=response.headers["ETag"]).status_code)
+
+  def test_api_schedules_pages_by_id_in_constant_queries(self):
+    with open(DATA_FILE, 'r') as file:
+      for row in csv.DictReader(file):
+        parse_row(row)
+    restaurants, after = [], 0
+    while after is not None:
+      with self.assertNumQueries(2):
+        response = self.client.get('/api/restaurants/', {"after": after, "limit": 7})
+      page = response.json()
+      self.assertLessEqual(page["count"], 7)
+      restaurants += page["restaurants"]
+      after = page["next"]
+    self.assertEqual(list(Restaurant.objects.order_by('pk').values_list('id', flat=True)), [r["id"] for r in restaurants])
+
+    # the hours strings read back as the stored hours
+    for restaurant in restaurants:
+      stored = set(OperatingHours.objects.filter(operating_day__restaurant_id=restaurant["id"]).values_list(
+        'operating_day__name', 'opening_time', 'closing_time'
+      ))
+      reparsed = {(str(day), opening, closing) for days, opening, closing in parse_hours(restaurant["hours"]) for day in days}
+      self.assertEqual(stored, reparsed, restaurant["hours"])
+    waffle_house = next(r for r in restaurants if r["name"] == "Waffle House")
+    self.assertEqual("Mon-Sun 12 am - 12 am", waffle_house["hours"])
+    self.assertEqual({"day": 0, "opening_time": "00:00", "closing_time": "00:00"}, waffle_house["schedule"][0])
+
+    self.assertEqual({"restaurants": [], "count": 0, "next": None}, self.client.get('/api/restaurants/', {"after": 10 ** 9}).json())
+    for params in ({"limit": 0}, {"after": "last"}):
+      self.assertEqual(400, self.client.get('/api/restaurants/', params).status_code)
+
+  def test_api_autocomplete_view(self):
+    response = self.client.get('/api/restaurants/autocomplete/', {"q": "c"})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual(["Cook Out", "Culvers"], [r["name"] for r in response.json()["restaurants"]])
+    # Mon 11 am, Culvers opens at 5 pm
+    response = self.client.get('/api/restaurants/autocomplete/', {"q": "C", "timestamp": "2024-07-08 11:00:00.0"})
+    cook_out = Restaurant.objects.get(name="Cook Out")
+    self.assertEqual(
+      {"query": "C", "timestamp": "2024-07-08 11:00:00.0", "restaurants": [{"id": cook_out.pk, "name": "Cook Out"}], "count": 1},
+      response.json()
+    )
+    self.assertEqual(1, self.client.get('/api/restaurants/autocomplete/', {"q": "c", "limit": 1}).json()["count"])
+    for params in ({"q": " "}, {"q": "c", "limit": 0}, {"q": "c", "limit": "ten"}, {"q": "c", "timestamp": "noon"}):
+      self.assertEqual(400, self.client.get('/api/restaurants/autocomplete/', params).status_code)
+
+  def test_api_open_view(self):
+    for use_index in (True, False):
+      with self.settings(RESTAURANTS_USE_INDEX=use_index):
+        response = self.client.get('/api/open/', {"timestamp": "2024-07-08 11:00:00.0"})
+      self.assertEqual(200, response.status_code)
+      self.assertTrue(response.streaming)
+      body = json.loads(b''.join(response.streaming_content))
+      self.assertEqual(2, body["count"])
+      self.assertEqual(["Cook Out", "Waffle House"], [restaurant["name"] for restaurant in body["restaurants"]])
+      self.assertEqual(Restaurant.objects.get(name="Cook Out").pk, body["restaurants"][0]["id"])
+
+  def test_api_open_view_invalid_timestring(self):
+    self.assertEqual(400, self.client.get('/api/open/').status_code)
+    response = self.client.get('/api/open/', {"timestamp": "2024-07-07 12 PM"})
+    self.assertEqual(400, response.status_code)
+    self.assertIn(b'does not match format', response.content)
+
+@override_settings(RESTAURANTS_METRICS=True, RESTAURANTS_METRICS_TOKEN='s3cret')
+class MetricsTestCase(BaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    search_cache.clear()
+    get_index()
+    get_override_index()
+    metrics.reset()
+
+  def test_search_is_timed_and_queries_counted(self):
+    self.client.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"})
+    text = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').content.decode()
+    self.assertIn('restaurants_request_duration_seconds_count{view="search"} 1', text)
+    self.assertIn('restaurants_timestamp_parse_seconds_count', text)
+    self.assertIn('restaurants_search_seconds_count{engine="index"} 1', text)
+    self.assertIn('restaurants_template_render_seconds_count{template="restaurants/results.html"} 1', text)
+    # answered from the index without a query
+    self.assertIn('restaurants_sql_queries_bucket{view="search",le="0.0"} 1', text)
+
+  async def test_middleware_records_async_requests(self):
+    async def get_response(request):
+      request.resolver_match = resolve('/search/')
+      # as an async view does, on a thread with a connection of its own
+      await sync_to_async(Restaurant.objects.count)()
+      return HttpResponse()
+
+    middleware = MetricsMiddleware(get_response)
+    self.assertTrue(iscoroutinefunction(middleware))
+    await middleware(AsyncRequestFactory().get('/search/'))
+    text = metrics.render_text()
+    self.assertIn('restaurants_request_duration_seconds_count{view="search"} 1', text)
+    self.assertIn('restaurants_sql_queries_bucket{view="search",le="0.0"} 0', text)
+    self.assertIn('restaurants_sql_queries_bucket{view="search",le="1.0"} 1', text)
+
+  def test_metrics_view_needs_the_token(self):
+    # a loopback address is no credential, requests through a local proxy come from one
+    self.assertEqual(403, self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1').status_code)
+    self.assertEqual(403, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer guess').status_code)
+    self.assertEqual(200, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').status_code)
+    with self.settings(RESTAURANTS_METRICS_TOKEN=''):
+      self.assertEqual(403, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code)
+
+  def test_metrics_view_is_not_found_when_disabled(self):
+    with self.settings(RESTAURANTS_METRICS=False):
+      self.assertEqual(404, self.client.get('/metrics/').status_code)
+
+class IntervalViewsTestCase(BaseTestCase):
+
+  def test_api_open_during_view(self):
+    response = self.client.get('/api/open/during/', {"start": "2024-07-12 18:00:00.0", "end": "2024-07-12 21:00:00.0"})
+    self.assertEqual(200, response.status_code)
+    body = response.json()
+    self.assertEqual(["Culvers", "Cook Out", "Waffle House"], [restaurant["name"] for restaurant in body["restaurants"]])
+    self.assertEqual(3, body["count"])
+    self.assertEqual(400, self.client.get('/api/open/during/', {"start": "2024-07-12 18:00:00.0"}).status_code)
+    response = self.client.get('/api/open/during/', {"start": "2024-07-12 18:00:00.0", "end": "2024-07-12 17:00:00.0"})
+    self.assertEqual(400, response.status_code)
+
+  def test_api_opening_status_view(self):
+    cook_out = Restaurant.objects.get(name="Cook Out")
+    response = self.client.get(f'/api/restaurants/{cook_out.pk}/status/', {"timestamp": "2024-07-08 05:00:00.0"})
+    self.assertEqual(200, response.status_code)
+    self.assertEqual({
+      "id": cook_out.pk,
+      "name": "Cook Out",
+      "timestamp": "2024-07-08 05:00:00.0",
+      "open": False,
+      "next_opening": "2024-07-08 11:00:00.000000",
+      "next_closing": "2024-07-09 04:01:00.000000"
+    }, response.json())
+    self.assertEqual(400, self.client.get(f'/api/restaurants/{cook_out.pk}/status/').status_code)
+    self.assertEqual(404, self.client.get('/api/restaurants/0/status/', {"timestamp": "2024-07-08 05:00:00.0"}).status_code)
+
+  def test_api_open_nearby_view(self):
+    Restaurant.objects.filter(name="Cook Out").update(latitude=35.8000, longitude=-78.6420)
+    Restaurant.objects.filter(name="Waffle House").update(latitude=35.9940, longitude=-78.8986)
+    parameters = {"timestamp": "2024-07-08 11:00:00.0", "lat": "35.7796", "lon": "-78.6382"}
+    response = self.client.get('/api/open/nearby/', parameters)
+    self.assertEqual(200, response.status_code)
+    body = response.json()
+    self.assertEqual(["Cook Out"], [restaurant["name"] for restaurant in body["restaurants"]])
+    self.assertEqual((5.0, 1), (body["radius_km"], body["count"]))
+    response = self.client.get('/api/open/nearby/', {**parameters, "radius": "40"})
+    self.assertEqual(["Cook Out", "Waffle House"], [restaurant["name"] for restaurant in response.json()["restaurants"]])
+    for bad in ({"radius": "101"}, {"radius": "-1"}, {"lat": "north"}, {"lon": ""}, {"timestamp": "noon"}):
+      self.assertEqual(400, self.client.get('/api/open/nearby/', {**parameters, **bad}).status_code, bad)
+
+class AsyncViewsTestCase(BaseTestCase):
+
+  def setUp(self):
+    super().setUp()
+    search_cache.clear()
+    self.factory = AsyncRequestFactory()
+
+  async def test_home_async_view(self):
+    response = await home_async(self.factory.get('/'))
+    self.assertEqual(200, response.status_code)
+    self.assertIn(b'What restaurants near Raleigh are open?', response.content)
+
+  async def test_search_async_view(self):
+    for use_index in (True, False):
+      search_cache.clear()
+      with self.settings(RESTAURANTS_USE_INDEX=use_index):
+        response = await search_async(self.factory.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"}))
+      self.assertEqual(200, response.status_code)
+      self.assertIn(b'These 2 restaurants', response.content)
+      self.assertIn(b'Cook Out', response.content)
+
+  async def test_search_async_view_answers_matching_etag(self):
+    for use_index in (True, False):
+      with self.settings(RESTAURANTS_USE_INDEX=use_index):
+        response = await search_async(self.factory.get('/search/', {"timestamp": "2024-07-08 11:00:00.0"}))
+        response = await search_async(self.factory.get(
+          '/search/', {"timestamp": "2024-07-08 11:00:00.0"}, headers={"If-None-Match": response.headers["ETag"]}
+        ))
+      self.assertEqual(304, response.status_code)
+
+  async def test_search_async_view_invalid_timestring(self):
+    response = await search_async(self.factory.get('/search/', {"timestamp": "2024-07-07 12 PM"}))
+    self.assertEqual(400, response.status_code)
+    self.assertIn(b'does not match format', response.content)
+
+@override_settings(RESTAURANTS_DATA_VERSION_FILE=DATA_VERSION_FILE, RESTAURANTS_SNAPSHOT_FILE=SNAPSHOT_FILE)
+class LoadDataTestCase(TestCase):
+
+  def setUp(self):
+    # the previous test's generations were rolled back with its transaction, behind the pointer's back
+    forget_active_generation()
+
+  def load(self, **options):
+    stdout = StringIO()
+    call_command('loaddata', file=str(DATA_FILE), stdout=stdout, **options)
+    return stdout.getvalue()
+
+  def stored_hours(self):
+    return sorted(OperatingHours.objects.values_list(
+      'operating_day__restaurant__name',
+      'operating_day__name',
+      'opening_time',
+      'closing_time'
+    ))
+
+  def test_bulk_load_matches_row_by_row_load(self):
+    self.load()
+    expected = self.stored_hours()
+    Restaurant.objects.all().delete()
+
+    output = self.load(bulk=True, batch_size=7)
+    self.assertEqual(40, Restaurant.objects.count())
+    self.assertEqual(expected, self.stored_hours())
+    self.assertIn('40 rows', output)
+    self.assertIn('rows/sec', output)
+
+  def test_load_writes_snapshot_matching_database(self):
+    output = self.load(bulk=True)
+    version = published_data_version()
+    self.assertIn(f'Snapshot for data version {version}', output)
+    self.assertIsNone(load_snapshot(version + 1))
+    snapshot = load_snapshot(version)
+    self.assertEqual(dict(Restaurant.objects.values_list('id', 'name')), dict(snapshot.names))
+    from_snapshot, from_db = WeekIndex.from_snapshot(snapshot), WeekIndex.from_db()
+    schedule_from_snapshot, schedule_from_db = ScheduleIndex.from_snapshot(snapshot), ScheduleIndex.from_db()
+    names_from_snapshot, names_from_db = NameIndex.from_snapshot(snapshot), NameIndex.from_db()
+    self.assertEqual(list(names_from_db.entries[0]), list(names_from_snapshot.entries[0]))
+    self.assertEqual(list(names_from_db.entries[1]), list(names_from_snapshot.entries[1]))
+    self.assertEqual(list(names_from_db.prefix("b")), list(names_from_snapshot.prefix("b")))
+    for minute in range(0, MINUTES_PER_WEEK, 15):
+      self.assertEqual(from_db.lookup(minute), from_snapshot.lookup(minute), minute)
+      for pk in from_db.names:
+        self.assertEqual(schedule_from_db.next_opening(pk, minute), schedule_from_snapshot.next_opening(pk, minute))
+
+  def test_fresh_process_builds_index_from_snapshot(self):
+    self.load(bulk=True)
+    seoul = Restaurant.objects.get(name="Seoul 116")
+    # a process that made no changes of its own, with no index or active generation read yet
+    forget_active_generation()
+    with patch.dict('restaurants.index._indexes', clear=True), patch('restaurants.version._local_version', 0):
+      with self.assertNumQueries(0):
+        index = get_index()
+        self.assertIn(seoul.pk, index.lookup(11 * 60))
+        self.assertEqual("Seoul 116", index.names[seoul.pk])
+        self.assertTrue(get_schedule_index().is_open_throughout(seoul.pk, 11 * 60, 60))
+        self.assertIn((seoul.pk, "Seoul 116"), list(execute_search_values('2024-07-08 11:00:00.0')))
+
+  def test_parallel_load_matches_row_by_row_load(self):
+    self.load()
+    expected = self.stored_hours()
+    expected_ids = list(Restaurant.objects.order_by('pk').values_list('name', flat=True))
+    Restaurant.objects.all().delete()
+
+    output = self.load(workers=2)
+    self.assertIn('40 rows', output)
+    self.assertEqual(expected, self.stored_hours())
+    Restaurant.objects.all().delete()
+
+    # chunk boundaries falling mid-row must neither drop nor repeat rows
+    self.assertEqual(40, load_parallel(str(DATA_FILE), workers=3, batch_size=9, chunk_size=97))
+    self.assertEqual(expected, self.stored_hours())
+    self.assertEqual(expected_ids, list(Restaurant.objects.order_by('pk').values_list('name', flat=True)))
+
+  def test_bulk_load_refreshes_search_index(self):
+    self.assertEqual([], list(execute_search('2024-07-08 11:00:00.0')))
+    self.load(bulk=True)
+    self.assertIn(Restaurant.objects.get(name="Seoul 116"), execute_search('2024-07-08 11:00:00.0'))
+
+  def test_sync_only_touches_changed_restaurants(self):
+    with open(DATA_FILE, 'r', newline='') as file:
+      rows = list(csv.DictReader(file))
+    self.assertEqual({'inserted': 40, 'updated': 0, 'deleted': 0, 'unchanged': 0}, sync(rows))
+    expected = self.stored_hours()
+    self.assertEqual({'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 40}, sync(rows))
+    self.assertEqual(expected, self.stored_hours())
+
+    seoul = Restaurant.objects.get(name="Seoul 116")
+    rows = [row for row in rows if row['Restaurant Name'] not in ("Garland", "Seoul 116")]
+    rows.append({"Restaurant Name": "Seoul 116", "Hours": "Mon-Sun 11 am - 10 pm"})
+    rows.append({"Restaurant Name": "Night Owl", "Hours": "Mon 9 pm - 11 pm"})
+    # a constant number of queries, however many restaurants are unchanged
+    with self.assertNumQueries(30):
+      counts = sync(rows)
+    self.assertEqual({'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 38}, counts)
+    self.assertFalse(Restaurant.objects.filter(name="Garland").exists())
+    self.assertEqual(seoul.pk, Restaurant.objects.get(name="Seoul 116").pk)
+    self.assertEqual(
+      [(str(day), datetime.time(11), datetime.time(22)) for day in range(7)],
+      [hours[1:] for hours in self.stored_hours() if hours[0] == "Seoul 116"]
+    )
+
+  def test_locations_are_loaded_and_snapshotted(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'located.csv'
+      with open(DATA_FILE, 'r', newline='') as source, open(path, 'w', newline='') as target:
+        writer = csv.DictWriter(target, fieldnames=["Restaurant Name", "Hours", "Latitude", "Longitude"])
+        writer.writeheader()
+        for i, row in enumerate(csv.DictReader(source)):
+          # every other restaurant located, spread north of downtown Raleigh
+          writer.writerow({**row, **({"Latitude": 35.78 + i / 1000, "Longitude": -78.64} if i % 2 == 0 else {})})
+      expected = None
+      for options in ({}, {"bulk": True, "batch_size": 7}, {"workers": 2}):
+        Restaurant.objects.all().delete()
+        call_command('loaddata', file=str(path), stdout=StringIO(), **options)
+        located = sorted(Restaurant.objects.exclude(latitude=None).values_list('name', 'latitude', 'longitude'))
+        self.assertEqual(20, len(located))
+        self.assertEqual(expected or located, located, options)
+        expected = located
+
+      snapshot = load_snapshot(published_data_version())
+      from_snapshot, from_db = GridIndex.from_snapshot(snapshot), GridIndex.from_db()
+      self.assertEqual(from_db.nearby(35.79, -78.64, 2), from_snapshot.nearby(35.79, -78.64, 2))
+      self.assertEqual(5, len(from_snapshot.nearby(35.79, -78.64, 0.6)))
+
+      with open(path, 'r', newline='') as file:
+        rows = list(csv.DictReader(file))
+      self.assertEqual({'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 40}, sync(rows))
+      rows[0]["Latitude"] = "36.0"
+      rows[2]["Latitude"] = rows[2]["Longitude"] = ""
+      self.assertEqual({'inserted': 0, 'updated': 2, 'deleted': 0, 'unchanged': 38}, sync(rows))
+      self.assertEqual(36.0, Restaurant.objects.get(name=rows[0]["Restaurant Name"]).latitude)
+      self.assertIsNone(Restaurant.objects.get(name=rows[2]["Restaurant Name"]).latitude)
+
+  def test_time_zones_are_loaded_and_snapshotted(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'zoned.csv'
+      with open(DATA_FILE, 'r', newline='') as source, open(path, 'w', newline='') as target:
+        writer = csv.DictWriter(target, fieldnames=["Restaurant Name", "Hours", "Timezone"])
+        writer.writeheader()
+        for i, row in enumerate(csv.DictReader(source)):
+          writer.writerow({**row, "Timezone": ('', 'America/Denver', 'Europe/Paris')[i % 3]})
+      call_command('loaddata', file=str(path), bulk=True, stdout=StringIO())
+      self.assertEqual(13, Restaurant.objects.filter(timezone='Europe/Paris').count())
+
+      snapshot = load_snapshot(published_data_version())
+      from_snapshot, from_db = WeekIndex.from_snapshot(snapshot), WeekIndex.from_db()
+      self.assertEqual(['America/Denver', 'America/New_York', 'Europe/Paris'], list(from_snapshot.zones[0]))
+      self.assertEqual(list(from_db.zones[1]), list(from_snapshot.zones[1]))
+      for time_string in ('2024-07-08 11:00:00.0', '2024-07-12T23:30:00Z', 'Sat 2:00 am'):
+        expected = list(execute_search(time_string, use_index=False))
+        minute, instant = timestamps.parse_week_minute(time_string), timestamps.parse_instant(time_string)
+        self.assertEqual([r.pk for r in expected], list(from_snapshot.lookup_local(from_snapshot.local_minutes(minute, instant))))
+        self.assertEqual(expected, list(execute_search(time_string, use_index=True)))
+
+      with open(path, 'r', newline='') as file:
+        rows = list(csv.DictReader(file))
+      rows[1]["Timezone"] = "America/Phoenix"
+      self.assertEqual({'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 39}, sync(rows))
+      self.assertEqual("America/Phoenix", Restaurant.objects.get(name=rows[1]["Restaurant Name"]).timezone)
+
+  def test_special_hours_are_loaded_and_snapshotted(self):
+    self.load(bulk=True)
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'special.csv'
+
+      def load_special_hours(*rows):
+        with open(path, 'w', newline='') as file:
+          writer = csv.DictWriter(file, fieldnames=["Restaurant Name", "Date", "Hours"])
+          writer.writeheader()
+          writer.writerows(dict(zip(writer.fieldnames, row)) for row in rows)
+        stdout = StringIO()
+        call_command('loaddata', special_hours=str(path), stdout=stdout)
+        return stdout.getvalue()
+
+      output = load_special_hours(
+        ("Seoul 116", "2024-12-25", "Closed"),
+        ("Caffe Luna", "2024-12-24", "11 am - 2 pm / 5 pm - 1 am"),
+      )
+      self.assertIn('3 windows on 2 restaurant dates', output)
+      snapshot = load_snapshot(published_data_version())
+      self.assertEqual(sorted(OverrideIndex.from_db().rows), sorted(OverrideIndex.from_snapshot(snapshot).rows))
+      self.assertNotIn("Seoul 116", [r.name for r in execute_search('2024-12-25 12:00:00.0')])
+
+      # special hours on a date replace the ones loaded before
+      load_special_hours(("Seoul 116", "2024-12-25", "10 am - 2 pm"))
+      self.assertEqual(
+        [(datetime.time(10), datetime.time(14))],
+        list(SpecialHours.objects.filter(restaurant__name="Seoul 116").values_list('opening_time', 'closing_time'))
+      )
+      self.assertEqual(2, SpecialHours.objects.filter(restaurant__name="Caffe Luna").count())
+      with self.assertRaisesMessage(CommandError, "'Nowhere'"):
+        load_special_hours(("Nowhere", "2024-12-25", "Closed"))
+
+  def test_gzipped_json_lines_load_with_rejects(self):
+    lines = [
+      {"Restaurant Name": "Bonchon", "Hours": "Mon-Sun 5 pm - 12:30 am", "Latitude": 35.78, "Longitude": -78.64},
+      {"Restaurant Name": "Culvers", "Hours": "Mon-Sun 5 pm to 11 pm"},
+      {"Restaurant Name": "Cook Out", "Hours": "Mon-Sun 11 am - 4 am", "Timezone": None},
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+      path, rejects = Path(directory) / 'restaurants.jsonl.gz', Path(directory) / 'rejects.jsonl'
+      with gzip.open(path, 'wt') as file:
+        file.write('\n'.join([json.dumps(lines[0]), json.dumps(lines[1]), '{"Restaurant Name": ', json.dumps(lines[2])]))
+
+      with self.assertRaisesMessage(CommandError, 'Line 2: No hours found'):
+        call_command('loaddata', file=str(path), bulk=True, stdout=StringIO())
+      self.assertEqual(0, Restaurant.objects.count())
+
+      stdout = StringIO()
+      call_command('loaddata', file=str(path), bulk=True, rejects=str(rejects), stdout=stdout)
+      self.assertIn('JSON Lines loaded into database. 2 rows', stdout.getvalue())
+      self.assertIn('2 rows rejected', stdout.getvalue())
+      self.assertEqual(["Bonchon", "Cook Out"], list(Restaurant.objects.order_by('name').values_list('name', flat=True)))
+      self.assertEqual(35.78, Restaurant.objects.get(name="Bonchon").latitude)
+      with open(rejects) as file:
+        rejected = [json.loads(line) for line in file]
+      self.assertEqual([2, 3], [reject["line"] for reject in rejected])
+      self.assertEqual("Culvers", rejected[0]["row"]["Restaurant Name"])
+      self.assertIn("No hours found", rejected[0]["error"])
+      self.assertEqual('{"Restaurant Name": ', rejected[1]["row"])
+      self.assertIn("Malformed JSON", rejected[1]["error"])
+
+      with self.assertRaisesMessage(CommandError, '--workers needs an uncompressed CSV file.'):
+        call_command('loaddata', file=str(path), workers=2, stdout=StringIO())
+
+  def test_load_from_gzipped_stdin(self):
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(gzip.compress(DATA_FILE.read_bytes()))))
+    stdout = StringIO()
+    with patch('sys.stdin', stdin):
+      call_command('loaddata', file='-', bulk=True, stdout=stdout)
+    output = stdout.getvalue()
+    self.assertIn('CSV loaded into database. 40 rows', output)
+    self.assertEqual(40, Restaurant.objects.count())
+
+  def test_sync_after_load_rewrites_nothing(self):
+    self.load(bulk=True)
+    output = self.load(sync=True)
+    self.assertIn('0 inserted, 0 updated, 0 deleted, 40 unchanged', output)
+
+  def test_sync_after_row_by_row_load_rewrites_nothing(self):
+    self.load()
+    output = self.load(sync=True)
+    self.assertIn('0 inserted, 0 updated, 0 deleted, 40 unchanged', output)
+
+  def test_sync_deletes_restaurants_past_the_query_parameter_limit(self):
+    self.load(bulk=True)
+    with open(DATA_FILE, 'r', newline='') as file:
+      rows = list(csv.DictReader(file))
+    with patch.object(connection.features, 'max_query_params', 1):
+      self.assertEqual({'inserted': 0, 'updated': 0, 'deleted': 2, 'unchanged': 38}, sync(rows[:-2]))
+    self.assertEqual(38, Restaurant.objects.count())
+
+  def test_load_is_invisible_until_its_generation_is_activated(self):
+    self.load(bulk=True)
+    active = Dataset.objects.get(state=Dataset.State.ACTIVE)
+    before = [r.pk for r in execute_search('2024-07-08 11:00:00.0')]
+    dataset = generations.start()
+    with writing_generation(dataset.pk):
+      # half a load, batch by batch as a running loaddata would leave it
+      parse_row({"Restaurant Name": "Night Owl", "Hours": "Mon-Sun 9 am - 11 pm"})
+      self.assertEqual(1, Restaurant.objects.count())
+    self.assertEqual(40, Restaurant.objects.count())
+    self.assertEqual(before, [r.pk for r in execute_search('2024-07-08 11:00:00.0')])
+    self.assertEqual(before, [r.pk for r in execute_search('2024-07-08 11:00:00.0', use_index=False)])
+
+    self.assertEqual(active, generations.activate(dataset))
+    publish_data_version()
+    self.assertEqual(["Night Owl"], [r.name for r in execute_search('2024-07-08 11:00:00.0')])
+    self.assertEqual(["Night Owl"], [r.name for r in execute_search('2024-07-08 11:00:00.0', use_index=False)])
+
+  def test_worker_between_activation_and_publication_reads_one_generation(self):
+    self.load(bulk=True)
+    before = [r.name for r in execute_search('2024-07-08 11:00:00.0')]
+    dataset = generations.start()
+    with writing_generation(dataset.pk):
+      parse_row({"Restaurant Name": "Night Owl", "Hours": "Mon-Sun 9 am - 11 pm"})
+    generations.activate(dataset)
+    with patch.dict('restaurants.index._indexes', clear=True), patch('restaurants.version._local_version', 0):
+      # a fresh process while the old version and snapshot are still current keeps to their generation,
+      # from the index and from the database alike
+      self.assertEqual(before, [r.name for r in execute_search('2024-07-08 11:00:00.0')])
+      self.assertEqual(before, [r.name for r in execute_search('2024-07-08 11:00:00.0', use_index=False)])
+      publish_data_version()
+      self.assertEqual(["Night Owl"], [r.name for r in execute_search('2024-07-08 11:00:00.0')])
+      self.assertEqual(["Night Owl"], [r.name for r in execute_search('2024-07-08 11:00:00.0', use_index=False)])
+
+  def test_zones_follow_a_rollback(self):
+    self.load(bulk=True)
+    dataset = generations.start()
+    with writing_generation(dataset.pk):
+      parse_row({"Restaurant Name": "Night Owl", "Hours": "Mon-Sun 9 am - 11 pm", "Timezone": "Europe/Paris"})
+    generations.activate(dataset)
+    instant = timestamps.parse_instant('2024-07-08 11:00:00.0')
+    self.assertEqual((17 * 60,), local_minutes(11 * 60, instant, use_index=False))
+    # no data version is published, the zones still follow the active generation
+    generations.rollback()
+    self.assertEqual((11 * 60,), local_minutes(11 * 60, instant, use_index=False))
+
+  def test_failed_load_leaves_active_generation_serving(self):
+    self.load(bulk=True)
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'broken.csv'
+      path.write_text(DATA_FILE.read_text() + '\nNowhere,\n')
+      with self.assertRaisesMessage(CommandError, "'Nowhere' has no hours."):
+        call_command('loaddata', file=str(path), bulk=True, stdout=StringIO())
+    # the new generation and its rows are gone
+    self.assertEqual(2, Dataset.objects.count())
+    self.assertEqual(40, Restaurant.all_generations.count())
+    self.assertIn("Seoul 116", [r.name for r in execute_search('2024-07-08 11:00:00.0')])
+
+    dataset = generations.start()
+    with self.assertRaisesMessage(ValueError, f'Generation {dataset.pk} has no restaurants.'):
+      generations.activate(dataset)
+
+  def test_rollback_and_collect_generations(self):
+    first = Dataset.objects.get(state=Dataset.State.ACTIVE)
+    self.load(bulk=True)
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'special.csv'
+      path.write_text('Restaurant Name,Date,Hours\nSeoul 116,2024-12-25,Closed\n')
+      call_command('loaddata', special_hours=str(path), stdout=StringIO())
+    output = self.load(bulk=True)
+    second, third = Dataset.objects.filter(state__in=(Dataset.State.RETIRED, Dataset.State.ACTIVE)).order_by('pk')
+    self.assertIn(f'Generation {third.pk} activated, generation {second.pk} kept for rollback.', output)
+    self.assertIn(f'Deleted generations {first.pk}.', output)
+    # special hours are carried over to the restaurants of the new generation
+    self.assertEqual(["Seoul 116"], list(SpecialHours.objects.values_list('restaurant__name', flat=True)))
+    self.assertNotIn("Seoul 116", [r.name for r in execute_search('2024-12-25 12:00:00.0')])
+    seoul = Restaurant.objects.get(name="Seoul 116")
+
+    stdout = StringIO()
+    call_command('datasets', rollback=True, stdout=stdout)
+    self.assertIn(f'Rolled back to generation {second.pk}', stdout.getvalue())
+    self.assertNotEqual(seoul.pk, Restaurant.objects.get(name="Seoul 116").pk)
+    snapshot = load_snapshot(published_data_version())
+    self.assertEqual(dict(Restaurant.objects.values_list('id', 'name')), dict(snapshot.names))
+    self.assertIn(Restaurant.objects.get(name="Seoul 116"), execute_search('2024-07-08 11:00:00.0'))
+
+    call_command('datasets', rollback=True, stdout=StringIO())
+    self.assertEqual(seoul, Restaurant.objects.get(name="Seoul 116"))
+    stdout = StringIO()
+    call_command('datasets', collect=True, keep=1, stdout=stdout)
+    self.assertIn(f'Deleted generations {second.pk}.', stdout.getvalue())
+    self.assertEqual(40, Restaurant.all_generations.count())
+    with self.assertRaisesMessage(CommandError, 'There is no previous generation to roll back to.'):
+      call_command('datasets', rollback=True, stdout=StringIO())
@@ -0,0 +1,138 @@
+"""
+Normalization of the timestamps searches are made with. Accepted, with surrounding quotes stripped:
+
+  '2024-07-08 11:00:00.0'      the original format, any number of fraction digits, single digit
+                               fields such as '2024-7-8 9:05:00' included
+  '2024-07-08T11:00'           ISO-8601 with a space or 'T', seconds and fraction optional, a date
+                               alone meaning midnight, and an optional 'Z' or +hh:mm offset
+  '1720450800'                 epoch seconds, fraction optional
+  'Mon 11:00', 'friday 6:30 pm'   a weekday and a time, which only name a minute of the week
+
+Instants given with an offset and epoch seconds are converted to the `TIME_ZONE` setting, other
+times are taken as they are, as `TIME_ZONE` wall time. `parse_instant` keeps the zone so a search can
+be converted to each restaurant's own time zone; the weekday form names no instant and is taken as
+wall time in every zone. Every form is matched with one precompiled pattern and converted by
+hand, with no `strptime` and none of the version differences of `fromisoformat`, and results are
+memoized per string since the same few timestamps are searched again and again.
+"""
+import datetime
+import re
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+
+from restaurants.index import MINUTES_PER_DAY, week_minute
+
+CACHE_SIZE = 4096
+
+DAY_NAMES = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# one or two digits for every field after the year, as `strptime` took them in the original format
+ISO_PATTERN = re.compile(
+  r'(\d{4})-(\d{1,2})-(\d{1,2})'
+  r'(?:[T ](\d{1,2}):(\d{1,2})(?::(\d{1,2})(?:[.,](\d+))?)?)?'
+  r'(Z|[+-]\d{2}:?\d{2})?'
+)
+EPOCH_PATTERN = re.compile(r'(\d+)(?:\.(\d+))?')
+WEEKDAY_PATTERN = re.compile(r'([A-Za-z]{3,})\.?,? +(\d{1,2}):(\d{2}) *([AaPp][Mm])?')
+
+FORMATS = "'%Y-%m-%d %H:%M:%S.%f', ISO-8601, epoch seconds or 'weekday HH:MM'"
+
+
+class TimestampFormatError(ValueError):
+  """
+  Raised for a timestamp in none of the accepted formats. A ValueError, like the `strptime` error
+  the search views reported before.
+  """
+
+  def __init__(self, time_string: str):
+    super().__init__(f'time data {time_string!r} does not match format {FORMATS}')
+
+
+def _clean(time_string: str) -> str:
+  return time_string.replace("'", '').replace('"', '').strip()
+
+def _offset(offset: str) -> datetime.timezone:
+  if offset == 'Z':
+    return datetime.timezone.utc
+  sign = -1 if offset[0] == '-' else 1
+  digits = offset[1:].replace(':', '')
+  return datetime.timezone(sign * datetime.timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(time_string: str) -> datetime.datetime:
+  """
+  Return the naive datetime a timestamp stands for. Weekday forms have no date and are rejected.
+
+  :raises TimestampFormatError: if the timestamp is in none of the accepted formats or out of range.
+  """
+  instant = parse_instant(time_string)
+  if instant is None:
+    raise TimestampFormatError(time_string)
+  return instant.replace(tzinfo=None)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_instant(time_string: str) -> Optional[datetime.datetime]:
+  """
+  Return the instant a timestamp stands for as an aware datetime in the `TIME_ZONE` setting, timestamps
+  without an offset being `TIME_ZONE` wall time. None for the weekday forms, which name no instant.
+
+  :raises TimestampFormatError: if the timestamp is in none of the accepted formats or out of range.
+  """
+  if WEEKDAY_PATTERN.fullmatch(_clean(time_string)):
+    return None
+  datetime_obj = _parse(time_string)
+  zone = ZoneInfo(settings.TIME_ZONE)
+  try:
+    return datetime_obj.astimezone(zone) if datetime_obj.tzinfo else datetime_obj.replace(tzinfo=zone)
+  except (ValueError, OverflowError):
+    raise TimestampFormatError(time_string)
+
+def _parse(time_string: str) -> datetime.datetime:
+  cleaned = _clean(time_string)
+  try:
+    match = ISO_PATTERN.fullmatch(cleaned)
+    if match:
+      year, month, day, hour, minute, second, fraction, offset = match.groups()
+      datetime_obj = datetime.datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int(fraction[:6].ljust(6, '0')) if fraction else 0
+      )
+      return datetime_obj.replace(tzinfo=_offset(offset)) if offset else datetime_obj
+
+    match = EPOCH_PATTERN.fullmatch(cleaned)
+    if match:
+      seconds, fraction = match.groups()
+      datetime_obj = datetime.datetime.fromtimestamp(int(seconds), datetime.timezone.utc)
+      if fraction:
+        datetime_obj += datetime.timedelta(microseconds=int(fraction[:6].ljust(6, '0')))
+      return datetime_obj
+  except (ValueError, OverflowError, OSError):
+    pass
+  raise TimestampFormatError(time_string)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_week_minute(time_string: str) -> int:
+  """
+  Return the minute of the week (0 = Monday 00:00) a timestamp falls in, the key searches are
+  answered by. Accepts every format, including a weekday and a time.
+
+  :raises TimestampFormatError: if the timestamp is in none of the accepted formats or out of range.
+  """
+  match = WEEKDAY_PATTERN.fullmatch(_clean(time_string))
+  if match is None:
+    datetime_obj = parse_timestamp(time_string)
+    return week_minute(datetime_obj.weekday(), datetime_obj.time())
+
+  name, hour, minute, meridiem = match.groups()
+  days = [day for day, day_name in enumerate(DAY_NAMES) if day_name.startswith(name.lower())]
+  hour, minute = int(hour), int(minute)
+  if meridiem:
+    if not 1 <= hour <= 12:
+      raise TimestampFormatError(time_string)
+    hour = hour % 12 + (12 if meridiem.lower() == 'pm' else 0)
+  if len(days) != 1 or hour > 23 or minute > 59:
+    raise TimestampFormatError(time_string)
+  return days[0] * MINUTES_PER_DAY + hour * 60 + minute
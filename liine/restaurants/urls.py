@@ -1,8 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
 from restaurants import views
 
+if settings.RESTAURANTS_ASYNC_VIEWS:
+  home, search = views.home_async, views.search_async
+else:
+  home, search = views.home, views.search
+
 urlpatterns = [
-  path('', views.home, name="home"),
-  path('search/', views.search, name="search")
+  path('', home, name="home"),
+  path('search/', search, name="search"),
+  path('search/batch/', views.search_batch, name="search_batch"),
+  path('search/cache/', views.search_cache_stats, name="search_cache_stats"),
+  path('api/open/', views.api_open, name="api_open"),
+  path('api/open/during/', views.api_open_during, name="api_open_during"),
+  path('api/open/nearby/', views.api_open_nearby, name="api_open_nearby"),
+  path('api/restaurants/', views.api_schedules, name="api_schedules"),
+  path('api/restaurants/autocomplete/', views.api_autocomplete, name="api_autocomplete"),
+  path('api/restaurants/<int:restaurant_id>/status/', views.api_opening_status, name="api_opening_status"),
+  path('metrics/', views.metrics_text, name="metrics")
 ]
\ No newline at end of file
@@ -1,97 +1,48 @@
-import re
 import datetime
-from typing import List, Tuple, Union
+import hashlib
+import itertools
+import json
+from functools import lru_cache
+from typing import Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from django.db.models import QuerySet
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
 
-from restaurants.models import Restaurant, OperatingDay, OperatingHours
-
-DAY_TO_NUMBER_MAPPING = {
-  "Mon": 0,
-  "Tues": 1,
-  "Wed": 2,
-  "Thu": 3,
-  "Fri": 4,
-  "Sat": 5,
-  "Sun": 6
-}
-
-DAYS_RANGE = list(range(7))
+from restaurants import hours as hours_parser, metrics, timestamps
+from restaurants.cache import VersionedLRUCache
+from restaurants.hours import DAY_TO_NUMBER_MAPPING, DAYS_RANGE
+from restaurants.index import (
+  OverrideIndex, WeekIndex, default_zone, get_grid_index, get_index, get_name_index, get_override_index,
+  get_schedule_index, week_minute, zone_week_minute
+)
+from restaurants.models import Restaurant, OperatingDay, OperatingHours, OpeningWindow, current_generation_id
 
 def parse_days(hours_set: str) -> List[int]:
   """
   This Python function parses a string representing days of the week with hours and returns a list of
   corresponding day numbers.
   
-  :param hours_set: a given string representing hours of operation for a restaurant. The function uses regular
-  expressions to extract the day patterns from the input string and then processes them to determine
-  the days the restaurant is open
+  :param hours_set: a given string representing hours of operation for a restaurant. Parsing is done by
+  the compiled, memoized parser in `restaurants.hours`.
   :type hours_set: str
   :return: a list of integers representing the days of the week.
   """
-  days = []
-  day_pattern = "[A-Za-z]+-[A-Za-z]+, [A-Za-z]+| [A-Za-z]+, [A-Za-z]+-[A-Za-z]+|[A-Za-z]+-[A-Za-z]+|[A-Za-z]{3,}"
-  day_pattern_match = re.search(day_pattern, hours_set)
-  day_pattern_found = hours_set[day_pattern_match.start():day_pattern_match.end()]
-
-  if ',' in day_pattern_found:
-    # we have non-consecutive days that share hours
-    clauses = day_pattern_found.split(',')
-    # separate them
-    for clause in clauses:
-      if '-' in clause:
-        # find the start and end of the day range that shares common hours
-        start_day, end_day = clause.split('-')
-        # add them to the list of days the restaurant is open
-        days.extend(DAYS_RANGE[DAY_TO_NUMBER_MAPPING[start_day]:DAY_TO_NUMBER_MAPPING[end_day] + 1])
-      else:
-        # it's just a single day, so add it
-        days.append(DAY_TO_NUMBER_MAPPING[clause.strip()])
-  else:
-    if '-' in day_pattern_found:
-      # this is a date range, do the date-range thing
-        start_day, end_day = day_pattern_found.split('-')
-        days.extend(DAYS_RANGE[DAY_TO_NUMBER_MAPPING[start_day]:DAY_TO_NUMBER_MAPPING[end_day] + 1])
-    else:
-      # should just be a single day, do the single day thing. 
-      # There are no restaurants in the data set that meet this criteria
-      # so this block should never be reached but cover our bases should the data set expand.
-      days.append(DAY_TO_NUMBER_MAPPING[day_pattern_found])
-
-  return days
+  return list(hours_parser.parse_days(hours_set))
 
 def parse_time(hours_set: str) -> List[datetime.time]:
   """
   The function `parse_time` takes a string input representing a set of hours in various formats and
   returns a list of standardized time objects.
   
-  :param hours_set: a given string representing hours of operation for a restaurant. The function uses regular
-  expressions to extract the hours patterns from the input string and then processes them to determine
-  the what hours the restaurant is open during the day.
+  :param hours_set: a given string representing hours of operation for a restaurant. Parsing is done by
+  the compiled, memoized parser in `restaurants.hours`.
   :type hours_set: str
-  :return: The function `parse_time` is returning a list of `datetime.time` objects after parsing and
-  standardizing the time format from the input `hours_set` string.
+  :return: The function `parse_time` is returning a list of the opening and closing `datetime.time`.
   """
-  hours_pattern = "[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+:[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}|[0-9]+ [a-z]{2,} - [0-9]+:[0-9]+ [a-z]{2,}|[0-9]+ [a-z]{2,} - [0-9]+ [a-z]{2,}"
-  hours_pattern_match = re.search(hours_pattern, hours_set)
-  hours_pattern_found = hours_set[hours_pattern_match.start():hours_pattern_match.end()]
-
-  raw_hours = hours_pattern_found.split('-')
-
-  raw_hours_stripped = [hour.strip() for hour in raw_hours]
-
-  # standardize time format
-  hours_massaged = []
-  for raw_hours in raw_hours_stripped:
-    if ':' in raw_hours:
-      hours_massaged.append(raw_hours)
-    else:
-      if len(raw_hours) == 4:
-        hours_massaged.append(raw_hours[:1] + ':00 ' + raw_hours[2:])
-      if len(raw_hours) == 5:
-        hours_massaged.append(raw_hours[:2] + ':00 ' + raw_hours[3:])
-
-  return [datetime.datetime.strptime(hours, '%I:%M %p').time() for hours in hours_massaged]
+  return list(hours_parser.parse_time(hours_set))
 
 def parse_day_and_hours(hours_set: str) -> Tuple[Union[int, datetime.time]]:
   opening_time, closing_time = parse_time(hours_set)
@@ -100,8 +51,30 @@ def parse_day_and_hours(hours_set: str) -> Tuple[Union[int, datetime.time]]:
 
   return days, opening_time, closing_time
 
-def add_to_db(name: str, days: List[int], opening_time: datetime.time, closing_time: datetime.time) -> None:
+Location = Tuple[float, float]
+
+def add_to_db(
+  name: str,
+  days: List[int],
+  opening_time: datetime.time,
+  closing_time: datetime.time,
+  location: Optional[Location] = None,
+  timezone: str = '',
+  hours_fingerprint: Optional[str] = None
+) -> None:
   restaurant, _ = Restaurant.objects.get_or_create(name=name)
+  fields = {}
+  if hours_fingerprint is not None:
+    fields['hours_fingerprint'] = hours_fingerprint
+  if location is not None:
+    fields['latitude'], fields['longitude'] = location
+  if timezone:
+    fields['timezone'] = timezone
+  changed = [field for field, value in fields.items() if getattr(restaurant, field) != value]
+  if changed:
+    for field in changed:
+      setattr(restaurant, field, fields[field])
+    restaurant.save(update_fields=changed)
 
   for day in days:
     operating_day = OperatingDay.objects.create(
@@ -113,54 +86,561 @@ def add_to_db(name: str, days: List[int], opening_time: datetime.time, closing_t
       closing_time=closing_time,
       operating_day=operating_day
     )
+    OpeningWindow.objects.create(
+      restaurant=restaurant,
+      start_minute_of_week=week_minute(day, opening_time),
+      end_minute_of_week=week_minute(day, closing_time)
+    )
+
+# closing time of the part of a window before midnight, see `parse_hours`
+END_OF_DAY = datetime.time(23, 59, 59, 999999)
+
+def parse_hours(hours: str) -> List[Tuple[List[int], datetime.time, datetime.time]]:
+  """
+  This function parses a restaurant's full hours string into the operating windows stored for it,
+  accounting for cases where closing time extends into the next day.
+
+  :param hours: the hours column of a row, hours sets separated by '/'.
+  :type hours: str
+  :return: a list of `(days, opening_time, closing_time)` tuples in the order they are added to the
+  database. A window closing at or before its opening time is split at midnight, the early hours
+  going to the following day (sunday wraps to monday).
+  """
+  return [(list(days), opening_time, closing_time) for days, opening_time, closing_time in _parse_hours(hours)]
+
+@lru_cache(maxsize=hours_parser.CACHE_SIZE)
+def _parse_hours(hours: str) -> Tuple[Tuple[Tuple[int, ...], datetime.time, datetime.time], ...]:
+  windows = []
+  for hours_set in hours.split('/'):
+    days, opening_time, closing_time = parse_day_and_hours(hours_set)
+    # account for when the closing time is technically the next day, ex. midnight or 4 am
+    if closing_time <= opening_time:
+      # close this day's operating window at 11:59 and open the next day, wrapping sunday to monday,
+      # from midnight until whatever in the am
+      windows.append((tuple(days), opening_time, END_OF_DAY))
+      windows.append((tuple((day + 1) % 7 for day in days), datetime.time(0, 0, 0), closing_time))
+    else:
+      windows.append((tuple(days), opening_time, closing_time))
+  return tuple(windows)
+
+def join_overnight(
+  windows: Iterable[Tuple[int, datetime.time, datetime.time]]
+) -> List[Tuple[int, datetime.time, datetime.time]]:
+  """
+  Undo the split at midnight of `parse_hours`: a window running to the end of its day is joined with
+  the window from midnight of the next day, closing when that one does.
+
+  :param windows: stored `(day, opening_time, closing_time)` windows.
+  :return: the windows by day and opening time, those past midnight closing at or before they open.
+  """
+  by_day: Dict[int, List[Tuple[datetime.time, datetime.time]]] = {}
+  for day, opening_time, closing_time in windows:
+    by_day.setdefault(day, []).append((opening_time, closing_time))
+  for day_windows in by_day.values():
+    day_windows.sort()
+
+  # closing time by (day, position) of the windows running to midnight, and the morning windows
+  # carried into them
+  closing_of: Dict[Tuple[int, int], datetime.time] = {}
+  carried = set()
+  for day, day_windows in sorted(by_day.items()):
+    next_day = (day + 1) % 7
+    for position, (_, closing_time) in enumerate(day_windows):
+      if closing_time != END_OF_DAY:
+        continue
+      mornings = [
+        (closing, morning) for morning, (opening, closing) in enumerate(by_day.get(next_day, ()))
+        if opening == datetime.time(0) and closing != END_OF_DAY and (next_day, morning) not in carried
+      ]
+      if mornings:
+        closing_of[day, position], morning = min(mornings)
+        carried.add((next_day, morning))
+  return [
+    (day, opening_time, closing_of.get((day, position), closing_time))
+    for day, day_windows in sorted(by_day.items())
+    for position, (opening_time, closing_time) in enumerate(day_windows)
+    if (day, position) not in carried
+  ]
+
+def parse_location(row: Dict[str, str]) -> Optional[Location]:
+  """
+  This function reads the optional 'Latitude' and 'Longitude' columns of a row.
+
+  :param row: a row of data, with or without the location columns.
+  :type row: Dict[str, str]
+  :return: `(latitude, longitude)` in degrees, or None if the row has no location.
+  :raises ValueError: if only one of the columns is filled in, or a value is not a coordinate.
+  """
+  latitude, longitude = (row.get('Latitude') or '').strip(), (row.get('Longitude') or '').strip()
+  if not latitude and not longitude:
+    return None
+  if not (latitude and longitude):
+    raise ValueError(f"{row['Restaurant Name']!r} needs both a latitude and a longitude.")
+  location = float(latitude), float(longitude)
+  if not (-90 <= location[0] <= 90 and -180 <= location[1] <= 180):
+    raise ValueError(f"{row['Restaurant Name']!r} has a location off the globe: {latitude}, {longitude}.")
+  return location
+
+def parse_timezone(row: Dict[str, str]) -> str:
+  """
+  This function reads the optional 'Timezone' column of a row, the zone the row's hours are wall
+  time in.
+
+  :param row: a row of data, with or without the time zone column.
+  :type row: Dict[str, str]
+  :return: the IANA time zone name, ex. 'America/Chicago', or '' if the row has none.
+  :raises ValueError: if the time zone is unknown.
+  """
+  timezone = (row.get('Timezone') or '').strip()
+  if timezone:
+    try:
+      ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+      raise ValueError(f"{row['Restaurant Name']!r} has an unknown time zone: {timezone!r}.")
+  return timezone
+
+SpecialWindow = Tuple[Optional[datetime.time], Optional[datetime.time]]
+
+def parse_special_hours(row: Dict[str, str]) -> Tuple[str, datetime.date, List[SpecialWindow]]:
+  """
+  This function reads a row of special hours, the hours a restaurant keeps on one date instead of
+  its weekly hours, ex. "11 am - 3 pm / 5 pm - 9 pm" on 2024-12-24.
+
+  :param row: a row with 'Restaurant Name', 'Date' as YYYY-MM-DD and 'Hours', either 'Closed' or
+  windows separated by '/'.
+  :type row: Dict[str, str]
+  :return: the restaurant name, the date and its `(opening_time, closing_time)` windows, a single
+  `(None, None)` when closed all day. Windows closing at or before they open run past midnight.
+  :raises ValueError: if the date or hours are malformed.
+  """
+  name, hours = row['Restaurant Name'], (row.get('Hours') or '').strip()
+  try:
+    date = datetime.date.fromisoformat((row.get('Date') or '').strip())
+  except ValueError:
+    raise ValueError(f"{name!r} has special hours on a malformed date: {row.get('Date')!r}.")
+  if hours.lower() == 'closed':
+    return name, date, [(None, None)]
+  try:
+    return name, date, [hours_parser.parse_time(window) for window in hours.split('/')]
+  except hours_parser.HoursFormatError:
+    raise ValueError(f'{name!r} has malformed special hours on {date}: {hours!r}.')
+
+def fingerprint(name: str, hours: str, location: Optional[Location] = None, timezone: str = '') -> str:
+  """
+  Fingerprint a CSV row by restaurant name, hours string, location and time zone, so reloads can
+  tell which restaurants changed without parsing or comparing their stored hours. Rows without a
+  location or time zone keep the fingerprint they had before those were loaded.
+  """
+  row = f'{name}\x00{hours.strip()}'
+  if location is not None:
+    row += '\x00{!r}\x00{!r}'.format(*location)
+  if timezone:
+    row += f'\x00tz={timezone}'
+  return hashlib.sha1(row.encode('utf-8')).hexdigest()
 
 def parse_row(row: str) -> None:
   """
-  This function parses restaurant operating hours from a given row of data, accounting for cases where
-  closing time extends into the next day.
+  This function parses restaurant operating hours, and the location and time zone if the row has
+  them, from a given row of data and adds them to the database.
   
   :param row: a row of data containing information about a restaurant's name and operating hours. 
   :type row: str
   """
   name = row['Restaurant Name']
-  split_row = row['Hours'].split('/')
-  if len(split_row) > 1:
-    for hours_set in split_row:
-      days, opening_time, closing_time = parse_day_and_hours(hours_set)
-      # account for when the closing time is technically the next day, ex. midnight or 4 am
-      # add a new OperatingDay to the set to account for this window of operation
-      if closing_time < opening_time:
-        if days[-1] + 1 != 6:
-          # add an extra day to the list of days, unless open sunday as the next day loops back to monday
-          days.append(days[-1] + 1)
-          technical_closing_time = closing_time
-          technical_opening_time = datetime.time(0, 0, 0)
-          # window of service on the next day is from midnight until whatever in the am
-          add_to_db(name, days, technical_opening_time, technical_closing_time)
-        # since the operating window extends into the next day, close this day's operating window at 11:59
-        closing_time = datetime.time(23, 59, 59, 999999)
-      add_to_db(name, days, opening_time, closing_time)
-  else:
-    days, opening_time, closing_time = parse_day_and_hours(split_row[0])
-    if closing_time < opening_time:
-      if days[-1] + 1 != 6:
-        # same as above
-        days.append(days[-1] + 1)
-        technical_closing_time = closing_time
-        technical_opening_time = datetime.time(0, 0, 0)
-        add_to_db(name, days, technical_opening_time, technical_closing_time)
-    closing_time = datetime.time(23, 59, 59, 999999)
-    add_to_db(name, days, opening_time, closing_time)
-
-
-def execute_search(time_string: str) -> QuerySet:
-  time_string = time_string.replace("'", '').replace('"', '')  # clean the string
-  datetime_obj = datetime.datetime.strptime(time_string, '%Y-%m-%d %H:%M:%S.%f')
-  time = datetime_obj.time()
-  day = datetime_obj.weekday()
-
-  return Restaurant.objects.filter(
-    operatingday_set__name=day,
-    operatingday_set__operatinghours_set__opening_time__lte=time,
-    operatingday_set__operatinghours_set__closing_time__gte=time
-    ).distinct()
\ No newline at end of file
+  location, timezone = parse_location(row), parse_timezone(row)
+  # as in `ingest.BulkLoader`, only a restaurant loaded from this one row can be compared with it by
+  # `loaddata --sync`, one spread over several rows gets no fingerprint and is rewritten by the next sync
+  hours_fingerprint = '' if Restaurant.objects.filter(name=name).exists() else fingerprint(
+    name, row['Hours'], location, timezone
+  )
+  for days, opening_time, closing_time in parse_hours(row['Hours']):
+    add_to_db(name, days, opening_time, closing_time, location, timezone, hours_fingerprint)
+
+
+def parse_timestamp(time_string: str) -> datetime.datetime:
+  """
+  Parse a timestamp in any dated format of `restaurants.timestamps` into a naive datetime.
+  """
+  with metrics.timed('restaurants_timestamp_parse_seconds'):
+    return timestamps.parse_timestamp(time_string)
+
+def parse_week_minute(time_string: str) -> int:
+  """
+  Parse a timestamp in any format of `restaurants.timestamps`, weekday and time included, straight
+  into the minute of the week searches are answered by.
+  """
+  with metrics.timed('restaurants_timestamp_parse_seconds'):
+    return timestamps.parse_week_minute(time_string)
+
+def parse_search_time(time_string: str) -> Tuple[int, Optional[datetime.datetime]]:
+  """
+  Parse a timestamp in any format of `restaurants.timestamps` into what a search needs: the minute of
+  the week it falls on in the `TIME_ZONE` setting, and the aware instant, None for the weekday forms
+  which are wall time in every zone.
+  """
+  with metrics.timed('restaurants_timestamp_parse_seconds'):
+    return timestamps.parse_week_minute(time_string), timestamps.parse_instant(time_string)
+
+# the time zones in use, read once per data version and generation: a rollback changes the active
+# generation without this process seeing a new version
+_zone_cache = VersionedLRUCache(1)
+
+def _zones() -> Dict[str, List[str]]:
+  """
+  The time zones restaurants are in, each with the `Restaurant.timezone` values standing for it.
+  """
+  def compute():
+    zones: Dict[str, List[str]] = {}
+    for timezone in Restaurant.objects.values_list('timezone', flat=True).distinct():
+      zones.setdefault(timezone or default_zone(), []).append(timezone)
+    return zones
+  return _zone_cache.get_or_compute(('zones', current_generation_id()), compute)
+
+def local_minutes(minute: int, instant: Optional[datetime.datetime], use_index: Optional[bool] = None) -> Tuple[int, ...]:
+  """
+  The minute of the week a search falls on in every time zone restaurants are in, by zone name.
+  Searches with the same local minutes find the same restaurants.
+
+  :param minute: the minute of the week of the search, see `parse_search_time`.
+  :param instant: the instant of the search, see `parse_search_time`.
+  :param use_index: read the zones from the index rather than the database, see `execute_search`.
+  """
+  if use_index is None:
+    use_index = getattr(settings, 'RESTAURANTS_USE_INDEX', True)
+  if use_index:
+    return get_index().local_minutes(minute, instant)
+  return tuple(zone_week_minute(minute, instant, zone) for zone in sorted(_zones()))
+
+def special_hours(
+  instant: Optional[datetime.datetime], zones: Iterable[str], overrides: Optional[OverrideIndex] = None
+) -> Dict[int, bool]:
+  """
+  The restaurants whose hours at a search are decided by special hours instead of their weekly hours,
+  and whether each is open. Empty after one set lookup unless special hours fall near the date
+  searched; searches by weekday and time name no date and always keep the weekly hours.
+
+  :param instant: the instant of the search, see `parse_search_time`.
+  :param zones: the time zones restaurants are in.
+  :param overrides: the special hours, defaults to `get_override_index()`.
+  """
+  if instant is None:
+    return {}
+  overrides = overrides or get_override_index()
+  if not overrides.near(instant.date()):
+    return {}
+  decided = {}
+  for zone in zones:
+    local = instant if str(instant.tzinfo) == zone else instant.astimezone(ZoneInfo(zone))
+    decided.update(overrides.decisions(zone, local.date(), local.hour * 60 + local.minute))
+  return decided
+
+def apply_special_hours(ids: Sequence[int], decided: Dict[int, bool]) -> Sequence[int]:
+  """
+  Correct the sorted ids of the restaurants open by their weekly hours with `special_hours`.
+  """
+  if not decided:
+    return ids
+  opened = {pk for pk, is_open in decided.items() if is_open}
+  return tuple(sorted({pk for pk in ids if decided.get(pk, True)} | opened))
+
+def search_key(
+  minutes: Sequence[int], minute: int, instant: Optional[datetime.datetime], overrides: Optional[OverrideIndex] = None
+) -> Hashable:
+  """
+  What the results of a search depend on: its `local_minutes`, and near special hours its date too.
+  """
+  if instant is not None and (overrides or get_override_index()).near(instant.date()):
+    return tuple(minutes), minute, instant.date()
+  return tuple(minutes)
+
+def _open_windows(minute: int, instant: Optional[datetime.datetime]) -> QuerySet:
+  zones = _zones()
+  if instant is None or len(zones) <= 1:
+    minute = zone_week_minute(minute, instant, next(iter(zones), default_zone()))
+    return OpeningWindow.objects.filter(start_minute_of_week__lte=minute, end_minute_of_week__gte=minute)
+
+  conditions = Q()
+  for zone, timezones in zones.items():
+    zone_minute = zone_week_minute(minute, instant, zone)
+    conditions |= Q(
+      restaurant__timezone__in=timezones, start_minute_of_week__lte=zone_minute, end_minute_of_week__gte=zone_minute
+    )
+  return OpeningWindow.objects.filter(conditions)
+
+def in_values(values: Sequence) -> Union[Sequence, RawSQL]:
+  """
+  The right-hand side of an `__in` lookup on `values`. On SQLite, more values than it takes query
+  parameters are passed as a single JSON array instead.
+  """
+  max_query_params = connection.features.max_query_params
+  if connection.vendor != 'sqlite' or max_query_params is None or len(values) <= max_query_params:
+    return values
+  return RawSQL('SELECT value FROM json_each(%s)', (json.dumps(list(values)),))
+
+def execute_search(time_string: str, use_index: Optional[bool] = None) -> QuerySet:
+  """
+  Find the restaurants open at the given time, at minute resolution. A dated timestamp is an instant,
+  converted once per time zone restaurants are in; a weekday and time is wall time in every zone.
+
+  :param time_string: a timestamp in any format of `restaurants.timestamps`, ex. '2024-07-08 11:00:00.0',
+  '2024-07-08T11:00' or 'Mon 11:00'.
+  :type time_string: str
+  :param use_index: answer from the in-memory week-minute index instead of a range query on
+  `OpeningWindow`. Defaults to the `RESTAURANTS_USE_INDEX` setting.
+  :type use_index: Optional[bool]
+  :return: a QuerySet of the open restaurants, ordered by id.
+  """
+  minute, instant = parse_search_time(time_string)
+  if use_index is None:
+    use_index = getattr(settings, 'RESTAURANTS_USE_INDEX', True)
+
+  if use_index:
+    with metrics.timed('restaurants_search_seconds', engine='index'):
+      index = get_index()
+      ids = index.lookup_local(index.local_minutes(minute, instant))
+      ids = apply_special_hours(ids, special_hours(instant, index.zones[0]))
+    max_query_params = connection.features.max_query_params
+    if max_query_params is None or len(ids) <= max_query_params or connection.vendor == 'sqlite':
+      return Restaurant.objects.filter(pk__in=in_values(ids)).order_by('pk')
+
+  # the query itself runs when the result is evaluated and is counted with the request's SQL time
+  with metrics.timed('restaurants_search_seconds', engine='orm'):
+    open_windows = Q(pk__in=_open_windows(minute, instant).values('restaurant_id'))
+    decided = special_hours(instant, _zones())
+    if decided:
+      closed = [pk for pk, is_open in decided.items() if not is_open]
+      open_windows = (open_windows & ~Q(pk__in=closed)) | Q(pk__in=[pk for pk in decided if pk not in closed])
+    return Restaurant.objects.filter(open_windows).order_by('pk')
+
+def execute_search_values(time_string: str, use_index: Optional[bool] = None) -> Iterator[Tuple[int, str]]:
+  """
+  Like `execute_search`, but yields `(id, name)` pairs instead of model instances. From the index no
+  query is made at all; otherwise the names are fetched with `values_list` in chunks. The timestamp is
+  parsed before returning, so a bad timestamp raises here rather than while iterating.
+
+  :param time_string: a timestamp in any format of `restaurants.timestamps`, ex. '2024-07-08 11:00:00.0',
+  '2024-07-08T11:00' or 'Mon 11:00'.
+  :type time_string: str
+  :param use_index: see `execute_search`.
+  :type use_index: Optional[bool]
+  :return: an iterator of `(id, name)` of the open restaurants, ordered by id.
+  """
+  minute, instant = parse_search_time(time_string)
+  if use_index is None:
+    use_index = getattr(settings, 'RESTAURANTS_USE_INDEX', True)
+
+  if use_index:
+    index = get_index()
+    ids = index.lookup_local(index.local_minutes(minute, instant))
+    ids = apply_special_hours(ids, special_hours(instant, index.zones[0]))
+    return ((pk, index.names[pk]) for pk in ids)
+  restaurants = execute_search(time_string, use_index=False)
+  return restaurants.values_list('id', 'name').iterator(chunk_size=2000)
+
+def execute_batch_search(datetimes: List[datetime.datetime], use_index: Optional[bool] = None) -> List[List[str]]:
+  """
+  Find the restaurants open at each of the given times in one pass over the hours data.
+
+  :param datetimes: the times to search, naive in the `TIME_ZONE` setting, answered at minute
+  resolution like `execute_search`.
+  :type datetimes: List[datetime.datetime]
+  :param use_index: answer from the shared in-memory index. When disabled, the hours data is read
+  once into a throwaway index rather than queried once per time. Defaults to the
+  `RESTAURANTS_USE_INDEX` setting.
+  :type use_index: Optional[bool]
+  :return: for each input time, the names of the open restaurants ordered by id.
+  """
+  if use_index is None:
+    use_index = getattr(settings, 'RESTAURANTS_USE_INDEX', True)
+  index = get_index() if use_index else WeekIndex.from_db()
+  overrides = get_override_index() if use_index else OverrideIndex.from_db()
+  zone = ZoneInfo(default_zone())
+
+  names_by_key = {}
+  results = []
+  for datetime_obj in datetimes:
+    minute = week_minute(datetime_obj.weekday(), datetime_obj.time())
+    instant = datetime_obj.replace(tzinfo=zone)
+    minutes = index.local_minutes(minute, instant)
+    key = search_key(minutes, minute, instant, overrides)
+    names = names_by_key.get(key)
+    if names is None:
+      ids = apply_special_hours(index.lookup_local(minutes), special_hours(instant, index.zones[0], overrides))
+      names = names_by_key[key] = [index.names[pk] for pk in ids]
+    results.append(names)
+  return results
+
+def execute_nearby_search(
+  time_string: str, latitude: float, longitude: float, radius_km: float
+) -> List[Tuple[int, str, float]]:
+  """
+  Find the restaurants open at the given time within `radius_km` of a point. Only the restaurants in
+  the grid cells around the point are measured, and each is checked against the week index's bitset
+  for that minute, so the cost depends on how many restaurants are nearby rather than how many are
+  open.
+
+  :param time_string: a timestamp in any format of `restaurants.timestamps`.
+  :type time_string: str
+  :param latitude: latitude of the point, in degrees.
+  :type latitude: float
+  :param longitude: longitude of the point, in degrees.
+  :type longitude: float
+  :param radius_km: search radius in kilometers.
+  :type radius_km: float
+  :return: `(id, name, distance_km)` of the open restaurants, nearest first.
+  :raises ValueError: for a malformed timestamp, a point off the globe or a radius that is not positive.
+  """
+  minute, instant = parse_search_time(time_string)
+  with metrics.timed('restaurants_search_seconds', engine='grid'):
+    grid, index = get_grid_index(), get_index()
+    minutes = index.local_minutes(minute, instant)
+    decided = special_hours(instant, index.zones[0])
+    return [
+      (pk, grid.names[pk], distance) for distance, pk in grid.nearby(latitude, longitude, radius_km)
+      if (decided[pk] if pk in decided else index.is_open_local(pk, minutes))
+    ]
+
+def execute_name_search(query: str, limit: int, time_string: Optional[str] = None) -> List[Tuple[int, str]]:
+  """
+  Find the restaurants whose name starts with the query, ignoring case, accents and repeated spaces,
+  optionally only those open at the given time. Names are found with a binary search over the sorted
+  folded names of the name index, and each is checked against the week index's bitset when a time is
+  given, so only the restaurants up to the `limit`-th open match are looked at.
+
+  :param query: the start of the name, at least one character that is not a space.
+  :type query: str
+  :param limit: the most restaurants to return.
+  :type limit: int
+  :param time_string: a timestamp in any format of `restaurants.timestamps`, or None for every
+  restaurant.
+  :type time_string: Optional[str]
+  :return: `(id, name)` of the matching restaurants in name order.
+  :raises ValueError: for a blank query or a malformed timestamp.
+  """
+  if not query.strip():
+    raise ValueError('The query needs at least one character.')
+  minute, instant = parse_search_time(time_string) if time_string is not None else (None, None)
+  with metrics.timed('restaurants_search_seconds', engine='names'):
+    names = get_name_index()
+    ids = names.prefix(query)
+    if minute is not None:
+      index = get_index()
+      minutes = index.local_minutes(minute, instant)
+      decided = special_hours(instant, index.zones[0])
+      ids = (pk for pk in ids if (decided[pk] if pk in decided else index.is_open_local(pk, minutes)))
+    return [(pk, names.names[pk]) for pk in itertools.islice(ids, limit)]
+
+class Schedule(NamedTuple):
+  id: int
+  name: str
+  timezone: str
+  windows: List[Tuple[int, datetime.time, datetime.time]]
+  hours: str
+
+def list_schedules(after: int, limit: int) -> Tuple[List[Schedule], bool]:
+  """
+  A page of restaurants with their weekly hours, the first `limit` in id order after the restaurant
+  with id `after`. Pages are found by keyset rather than by offset, so a deep page is read through the
+  primary key index like the first one instead of skipping every row before it. The hours of the
+  whole page come from one joined query over the same id range, two queries per page however many
+  restaurants and windows it holds.
+
+  :param after: the id of the last restaurant of the previous page, 0 for the first page.
+  :type after: int
+  :param limit: the most restaurants to return.
+  :type limit: int
+  :return: the schedules, with `windows` as in `join_overnight` and `hours` as in
+  `hours.format_hours`, and whether more restaurants follow.
+  """
+  restaurants = list(
+    Restaurant.objects.filter(pk__gt=after).order_by('pk').values_list('id', 'name', 'timezone')[:limit + 1]
+  )
+  has_more = len(restaurants) > limit
+  restaurants = restaurants[:limit]
+  if not restaurants:
+    return [], False
+
+  windows: Dict[int, List[Tuple[int, datetime.time, datetime.time]]] = {}
+  hours = OperatingHours.objects.filter(
+    operating_day__restaurant_id__gt=after, operating_day__restaurant_id__lte=restaurants[-1][0]
+  ).values_list('operating_day__restaurant_id', 'operating_day__name', 'opening_time', 'closing_time')
+  for restaurant_id, day, opening_time, closing_time in hours:
+    windows.setdefault(restaurant_id, []).append((int(day), opening_time, closing_time))
+
+  schedules = []
+  for restaurant_id, name, timezone in restaurants:
+    joined = join_overnight(windows.get(restaurant_id, ()))
+    schedules.append(Schedule(restaurant_id, name, timezone, joined, hours_parser.format_hours(joined)))
+  return schedules, has_more
+
+def _minute_start(time_string: str) -> datetime.datetime:
+  _, instant = parse_search_time(time_string)
+  if instant is None:
+    raise timestamps.TimestampFormatError(time_string)
+  return instant.replace(second=0, microsecond=0)
+
+def execute_interval_search(start_string: str, end_string: str) -> List[Tuple[int, str]]:
+  """
+  Find the restaurants open for the whole interval between two times, both ends included, at minute
+  resolution. Only the restaurants open at the start are considered, taken from the week index, and
+  each is checked with one binary search over its hours in the schedule index, from the start's wall
+  time in the restaurant's time zone. Only weekly hours are considered, not special hours.
+
+  :param start_string: a dated timestamp in any format of `restaurants.timestamps`.
+  :type start_string: str
+  :param end_string: same format as `start_string`, not before it.
+  :type end_string: str
+  :return: `(id, name)` of the restaurants open throughout, ordered by id.
+  """
+  start = _minute_start(start_string)
+  end = _minute_start(end_string)
+  if end < start:
+    raise ValueError('The interval needs an end after its start.')
+  minutes = (end - start) // datetime.timedelta(minutes=1)
+  index = get_index()
+  starts = index.local_minutes(week_minute(start.weekday(), start.time()), start)
+
+  schedule = get_schedule_index()
+  return [
+    (pk, schedule.names[pk]) for pk in index.lookup_local(starts)
+    if pk in schedule.names and schedule.is_open_throughout(pk, index.local_minute(pk, starts), minutes)
+  ]
+
+class OpeningStatus(NamedTuple):
+  name: str
+  is_open: bool
+  next_opening: Optional[datetime.datetime]
+  next_closing: Optional[datetime.datetime]
+
+def opening_status(restaurant_id: int, time_string: str) -> OpeningStatus:
+  """
+  Whether a restaurant is open at the given time, and when it next opens and closes after it.
+
+  :param restaurant_id: the id of the restaurant.
+  :type restaurant_id: int
+  :param time_string: a dated timestamp in any format of `restaurants.timestamps`.
+  :type time_string: str
+  :return: an `OpeningStatus`, with times at the start of the minute in the `TIME_ZONE` setting, the
+  hours being read in the restaurant's time zone. Whether it is open follows special hours, the next
+  opening and closing its weekly hours. `next_opening` is None for restaurants that never open or
+  never close, `next_closing` for those never open or never closing.
+  :raises Restaurant.DoesNotExist: if there is no such restaurant.
+  """
+  start = _minute_start(time_string)
+  schedule = get_schedule_index()
+  try:
+    zone = get_index().zone(restaurant_id)
+    minute = zone_week_minute(week_minute(start.weekday(), start.time()), start, zone)
+    is_open = schedule.is_open_throughout(restaurant_id, minute, 0)
+  except KeyError:
+    raise Restaurant.DoesNotExist(f'No restaurant with id {restaurant_id}.')
+  is_open = special_hours(start, [zone]).get(restaurant_id, is_open)
+  start = start.replace(tzinfo=None)
+  opening = schedule.next_opening(restaurant_id, minute)
+  closing = schedule.next_closing(restaurant_id, minute)
+  return OpeningStatus(
+    schedule.names[restaurant_id],
+    is_open,
+    start + datetime.timedelta(minutes=opening) if opening is not None else None,
+    start + datetime.timedelta(minutes=closing) if closing is not None else None
+  )
@@ -0,0 +1,96 @@
+"""
+Tracks the version of the restaurant hours data, so in-memory indexes and caches know when to rebuild.
+
+The version has two parts. The local part counts changes made by this process, bumped by model
+signals. The published part is an integer kept in the `RESTAURANTS_DATA_VERSION_FILE` file, bumped by
+`loaddata` once a load is complete, which is how a load in another process reaches every server
+process. Reading it costs one `stat` call while the file is unchanged.
+"""
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_local_version = 0
+_local_changed_at: Optional[float] = None
+# (path, mtime_ns, size) of the version file when last read, and the version read from it
+_file_stamp = None
+_published_version = 0
+
+def data_version_file() -> str:
+  """
+  The path of the file the published data version is kept in.
+  """
+  return str(getattr(settings, 'RESTAURANTS_DATA_VERSION_FILE', settings.BASE_DIR / 'data_version'))
+
+def _read_file(path: str) -> int:
+  try:
+    with open(path, 'r') as file:
+      return int(file.read().strip() or 0)
+  except (FileNotFoundError, ValueError):
+    return 0
+
+def published_data_version() -> int:
+  """
+  Return the data version last published by `publish_data_version`, in any process.
+  """
+  global _file_stamp, _published_version
+  path = data_version_file()
+  try:
+    stat = os.stat(path)
+    stamp = (path, stat.st_mtime_ns, stat.st_size)
+  except FileNotFoundError:
+    stamp = (path, None, None)
+  if stamp != _file_stamp:
+    with _lock:
+      _published_version = _read_file(path)
+      _file_stamp = stamp
+  return _published_version
+
+def data_version() -> Tuple[int, int]:
+  """
+  Return a value that changes whenever the hours data changes, in this process or through
+  `publish_data_version` in any process.
+  """
+  return published_data_version(), _local_version
+
+def data_changed_at() -> Optional[float]:
+  """
+  Return when the data version last changed, in seconds since the epoch: the time the version file
+  was published or of this process's last change, whichever is later. None if neither happened.
+  """
+  published_data_version()
+  stamp = _file_stamp
+  published_at = stamp[1] / 1e9 if stamp is not None and stamp[1] is not None else None
+  return max((at for at in (published_at, _local_changed_at) if at is not None), default=None)
+
+def mark_data_changed(*args, **kwargs) -> None:
+  """
+  Record a change made by this process. Accepts and ignores signal arguments so it can be connected
+  directly to model signals.
+  """
+  global _local_version, _local_changed_at
+  with _lock:
+    _local_version += 1
+    _local_changed_at = time.time()
+
+def publish_data_version() -> int:
+  """
+  Increment the published data version, making every process drop its indexes and caches.
+
+  :return: the new published version.
+  """
+  global _file_stamp
+  path = data_version_file()
+  with _lock:
+    version = _read_file(path) + 1
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+      file.write(str(version))
+    os.replace(temporary, path)
+    _file_stamp = None
+  mark_data_changed()
+  return version
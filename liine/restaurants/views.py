@@ -1,14 +1,75 @@
+import datetime
+import hashlib
+import json
+import os
 import typing as t
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
-from django.http import HttpResponseBadRequest, HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.http import (
+  Http404, HttpResponseBadRequest, HttpResponseForbidden, HttpRequest, HttpResponse, JsonResponse,
+  StreamingHttpResponse
+)
 
+from restaurants import metrics
+from restaurants.cache import search_cache
 from restaurants.forms import DatetimeStringForm
-from restaurants.utils import execute_search
+from restaurants.index import (
+  MINUTES_PER_WEEK, OverrideIndex, WeekIndex, aget_index, aget_override_index, get_index, get_override_index
+)
+from restaurants.models import Restaurant
+from restaurants.utils import (
+  apply_special_hours, execute_batch_search, execute_interval_search, execute_name_search, execute_nearby_search,
+  execute_search, execute_search_values, list_schedules, local_minutes, opening_status, parse_search_time,
+  parse_timestamp, search_key, special_hours
+)
+from restaurants.version import data_changed_at, data_version
+
+# one week at one-minute steps
+MAX_BATCH_SIZE = 7 * 24 * 60
+DEFAULT_RADIUS_KM = 5.0
+MAX_RADIUS_KM = 100.0
+DEFAULT_AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+DEFAULT_SCHEDULE_PAGE_SIZE = 50
+MAX_SCHEDULE_PAGE_SIZE = 500
+
+def _render(request: HttpRequest, template_name: str, context: t.Dict[str, t.Any]) -> HttpResponse:
+  with metrics.timed('restaurants_template_render_seconds', template=template_name):
+    return render(request, template_name, context)
+
+def _validators(key: t.Hashable) -> t.Tuple[str, t.Optional[int]]:
+  # the same data and key give the same ETag in every process, unless a process changed the data
+  # itself without publishing it
+  published, local = data_version()
+  version = str(published) if not local else f'{published}.{os.getpid()}.{local}'
+  digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest()
+  changed_at = data_changed_at()
+  return f'"{version}-{digest}"', int(changed_at) if changed_at is not None else None
+
+def _conditional(request: HttpRequest, key: t.Hashable, respond: t.Callable[[], HttpResponse]) -> HttpResponse:
+  """
+  Answer a request whose response only depends on the hours data and `key`, with an `ETag` and
+  `Last-Modified` derived from the data version and a `Cache-Control` of `RESTAURANTS_HTTP_MAX_AGE`
+  seconds. A client already holding the response gets a 304 without `respond` being called.
+  """
+  etag, last_modified = _validators(key)
+  response = get_conditional_response(request, etag=etag, last_modified=last_modified) or respond()
+  return _with_validators(response, etag, last_modified)
+
+def _with_validators(response: HttpResponse, etag: str, last_modified: t.Optional[int]) -> HttpResponse:
+  response.headers["ETag"] = etag
+  if last_modified is not None:
+    response.headers["Last-Modified"] = http_date(last_modified)
+  patch_cache_control(response, public=True, max_age=getattr(settings, 'RESTAURANTS_HTTP_MAX_AGE', 60))
+  return response
 
 def home(request: HttpRequest) -> HttpResponse:
     context = {"form": DatetimeStringForm()}
-    return render(request, "restaurants/home.html", context)
+    return _conditional(request, "home", lambda: _render(request, "restaurants/home.html", context))
 
 def search(request: HttpRequest) -> t.Union[HttpResponse, HttpResponseBadRequest]:
   """
@@ -26,8 +87,341 @@ def search(request: HttpRequest) -> t.Union[HttpResponse, HttpResponseBadRequest
   if not time_string:
     return HttpResponseBadRequest('No input provided.')
   try:
-    restaurants = execute_search(time_string)
+    minute, instant = parse_search_time(time_string)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+
+  # results only depend on the minute of the week in each time zone, and on the date near special
+  # hours, so the rendered page is cached and tagged per `search_key`
+  if getattr(settings, 'RESTAURANTS_USE_INDEX', True):
+    # names come from the index too, so a search needs no query at all
+    index, overrides = get_index(), get_override_index()
+    minutes = index.local_minutes(minute, instant)
+    restaurants = lambda: _index_results(index, overrides, minutes, instant)
+  else:
+    minutes = local_minutes(minute, instant, use_index=False)
+    restaurants = lambda: execute_search(time_string)
+  key = search_key(minutes, minute, instant)
+  return _conditional(request, key, lambda: HttpResponse(search_cache.get_or_compute(
+    key, lambda: _render(request, "restaurants/results.html", {"restaurants": restaurants()}).content
+  )))
+
+def _index_results(
+  index: WeekIndex, overrides: OverrideIndex, minutes: t.Sequence[int], instant: t.Optional[datetime.datetime]
+) -> t.List[t.Dict[str, str]]:
+  with metrics.timed('restaurants_search_seconds', engine='index'):
+    ids = apply_special_hours(index.lookup_local(minutes), special_hours(instant, index.zones[0], overrides))
+    return [{"name": index.names[pk]} for pk in ids]
+
+def api_open(request: HttpRequest) -> t.Union[StreamingHttpResponse, HttpResponseBadRequest]:
+  """
+  JSON version of `search`. The search runs once and the restaurants are streamed as they are read,
+  so memory stays flat however many restaurants are open.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `StreamingHttpResponse` of the form
+  `{"timestamp": ..., "restaurants": [{"id": ..., "name": ...}], "count": ...}`, or an
+  `HttpResponseBadRequest` if the timestamp is missing or malformed.
+  """
+  time_string = request.GET.get("timestamp", None)
+  if not time_string:
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    restaurants = execute_search_values(time_string)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  return StreamingHttpResponse(_stream_open(time_string, restaurants), content_type="application/json")
+
+def _stream_open(time_string: str, restaurants: t.Iterator[t.Tuple[int, str]]) -> t.Iterator[str]:
+  yield '{"timestamp": %s, "restaurants": [' % json.dumps(time_string)
+  count = 0
+  chunk = []
+  for restaurant_id, name in restaurants:
+    chunk.append('%s{"id": %d, "name": %s}' % (', ' if count else '', restaurant_id, json.dumps(name)))
+    count += 1
+    if len(chunk) == 500:
+      yield ''.join(chunk)
+      chunk = []
+  chunk.append('], "count": %d}' % count)
+  yield ''.join(chunk)
+
+def api_open_during(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  The restaurants open for the whole interval from the `start` to the `end` timestamp.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `JsonResponse` of the form
+  `{"start": ..., "end": ..., "restaurants": [{"id": ..., "name": ...}], "count": ...}`, or an
+  `HttpResponseBadRequest` if a timestamp is missing or malformed, or the end is before the start.
+  """
+  start_string = request.GET.get("start", None)
+  end_string = request.GET.get("end", None)
+  if not (start_string and end_string):
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    restaurants = execute_interval_search(start_string, end_string)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  return JsonResponse({
+    "start": start_string,
+    "end": end_string,
+    "restaurants": [{"id": restaurant_id, "name": name} for restaurant_id, name in restaurants],
+    "count": len(restaurants)
+  })
+
+def api_open_nearby(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  The restaurants open at the `timestamp` within `radius` kilometers (default `DEFAULT_RADIUS_KM`, at
+  most `MAX_RADIUS_KM`) of the `lat`, `lon` point.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `JsonResponse` of the form `{"timestamp": ..., "latitude": ..., "longitude": ...,
+  "radius_km": ..., "restaurants": [{"id": ..., "name": ..., "distance_km": ...}], "count": ...}`
+  nearest first, or an `HttpResponseBadRequest` if an input is missing or malformed.
+  """
+  time_string = request.GET.get("timestamp", None)
+  if not (time_string and request.GET.get("lat") and request.GET.get("lon")):
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    latitude, longitude = float(request.GET["lat"]), float(request.GET["lon"])
+    radius = float(request.GET.get("radius", DEFAULT_RADIUS_KM))
+    if radius > MAX_RADIUS_KM:
+      return HttpResponseBadRequest(f'The radius can be at most {MAX_RADIUS_KM:g} km.')
+    restaurants = execute_nearby_search(time_string, latitude, longitude, radius)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  return JsonResponse({
+    "timestamp": time_string,
+    "latitude": latitude,
+    "longitude": longitude,
+    "radius_km": radius,
+    "restaurants": [
+      {"id": restaurant_id, "name": name, "distance_km": round(distance, 3)}
+      for restaurant_id, name, distance in restaurants
+    ],
+    "count": len(restaurants)
+  })
+
+def api_autocomplete(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  The restaurants whose name starts with `q`, ignoring case and accents, at most `limit` of them
+  (default `DEFAULT_AUTOCOMPLETE_LIMIT`, at most `MAX_AUTOCOMPLETE_LIMIT`). With a `timestamp`, only
+  those open then.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `JsonResponse` of the form `{"query": ..., "timestamp": ..., "restaurants": [{"id": ...,
+  "name": ...}], "count": ...}` in name order, the timestamp null if none was given, or an
+  `HttpResponseBadRequest` if an input is missing or malformed.
+  """
+  query = request.GET.get("q", "")
+  time_string = request.GET.get("timestamp") or None
+  try:
+    limit = int(request.GET.get("limit", DEFAULT_AUTOCOMPLETE_LIMIT))
+    if not 0 < limit <= MAX_AUTOCOMPLETE_LIMIT:
+      return HttpResponseBadRequest(f'The limit must be between 1 and {MAX_AUTOCOMPLETE_LIMIT}.')
+    restaurants = execute_name_search(query, limit, time_string)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  return JsonResponse({
+    "query": query,
+    "timestamp": time_string,
+    "restaurants": [{"id": restaurant_id, "name": name} for restaurant_id, name in restaurants],
+    "count": len(restaurants)
+  })
+
+def api_schedules(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  A page of restaurants with their weekly hours, in id order. Pass the `next` of a page's response as
+  `after` for the following page, and `limit` for its size (default `DEFAULT_SCHEDULE_PAGE_SIZE`, at
+  most `MAX_SCHEDULE_PAGE_SIZE`).
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `JsonResponse` of the form `{"restaurants": [{"id": ..., "name": ..., "timezone": ...,
+  "hours": "Mon-Fri 11 am - 10 pm", "schedule": [{"day": 0, "opening_time": "11:00", "closing_time":
+  "22:00"}]}], "count": ..., "next": ...}`, `next` null on the last page, or an
+  `HttpResponseBadRequest` if `after` or `limit` is malformed.
+  """
+  try:
+    after = int(request.GET.get("after", 0))
+    limit = int(request.GET.get("limit", DEFAULT_SCHEDULE_PAGE_SIZE))
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  if not 0 < limit <= MAX_SCHEDULE_PAGE_SIZE:
+    return HttpResponseBadRequest(f'The limit must be between 1 and {MAX_SCHEDULE_PAGE_SIZE}.')
+  schedules, has_more = list_schedules(after, limit)
+  return JsonResponse({
+    "restaurants": [
+      {
+        "id": schedule.id,
+        "name": schedule.name,
+        "timezone": schedule.timezone or None,
+        "hours": schedule.hours,
+        "schedule": [
+          {"day": day, "opening_time": opening_time.strftime('%H:%M'), "closing_time": closing_time.strftime('%H:%M')}
+          for day, opening_time, closing_time in schedule.windows
+        ]
+      }
+      for schedule in schedules
+    ],
+    "count": len(schedules),
+    "next": schedules[-1].id if has_more else None
+  })
+
+def api_opening_status(request: HttpRequest, restaurant_id: int) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  Whether a restaurant is open at the `timestamp`, and when it next opens and closes.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :param restaurant_id: the id of the restaurant.
+  :type restaurant_id: int
+  :return: a `JsonResponse` of the form
+  `{"id": ..., "name": ..., "timestamp": ..., "open": ..., "next_opening": ..., "next_closing": ...}`
+  with null for a transition that never happens, an `HttpResponseBadRequest` if the timestamp is
+  missing or malformed, or a 404 for an unknown restaurant.
+  """
+  time_string = request.GET.get("timestamp", None)
+  if not time_string:
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    status = opening_status(restaurant_id, time_string)
+  except ValueError as e:
+    return HttpResponseBadRequest(str(e))
+  except Restaurant.DoesNotExist as e:
+    raise Http404(str(e))
+
+  def format_time(datetime_obj: t.Optional[datetime.datetime]) -> t.Optional[str]:
+    return datetime_obj.strftime('%Y-%m-%d %H:%M:%S.%f') if datetime_obj else None
+
+  return JsonResponse({
+    "id": restaurant_id,
+    "name": status.name,
+    "timestamp": time_string,
+    "open": status.is_open,
+    "next_opening": format_time(status.next_opening),
+    "next_closing": format_time(status.next_closing)
+  })
+
+async def home_async(request: HttpRequest) -> HttpResponse:
+  return home(request)
+
+async def _aconditional(
+  request: HttpRequest, key: t.Hashable, respond: t.Callable[[], t.Awaitable[HttpResponse]]
+) -> HttpResponse:
+  etag, last_modified = _validators(key)
+  response = get_conditional_response(request, etag=etag, last_modified=last_modified) or await respond()
+  return _with_validators(response, etag, last_modified)
+
+async def search_async(request: HttpRequest) -> t.Union[HttpResponse, HttpResponseBadRequest]:
+  """
+  Async version of `search`, used under ASGI. Searches are answered from the in-memory index, so a
+  request only leaves the event loop while the index is being rebuilt. With the index disabled the
+  ORM query runs in a worker thread.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: the same responses as `search`.
+  """
+  time_string = request.GET.get("timestamp", None)
+  if not time_string:
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    minute, instant = parse_search_time(time_string)
   except ValueError as e:
     return HttpResponseBadRequest(str(e))
-  return render(request, "restaurants/results.html", {"restaurants": restaurants})
 
+  if not getattr(settings, 'RESTAURANTS_USE_INDEX', True):
+    minutes = await sync_to_async(local_minutes)(minute, instant, use_index=False)
+    key = search_key(minutes, minute, instant, await aget_override_index())
+
+    async def respond():
+      return HttpResponse(await sync_to_async(search_cache.get_or_compute)(
+        key, lambda: _render(request, "restaurants/results.html", {"restaurants": execute_search(time_string)}).content
+      ))
+    return await _aconditional(request, key, respond)
+
+  index, overrides = await aget_index(), await aget_override_index()
+  minutes = index.local_minutes(minute, instant)
+  key = search_key(minutes, minute, instant, overrides)
+
+  async def respond():
+    return HttpResponse(search_cache.get_or_compute(
+      key,
+      lambda: _render(
+        request, "restaurants/results.html", {"restaurants": _index_results(index, overrides, minutes, instant)}
+      ).content
+    ))
+  return await _aconditional(request, key, respond)
+
+def metrics_text(request: HttpRequest) -> HttpResponse:
+  """
+  Serve the request metrics in the Prometheus text format, to requests bearing the
+  `RESTAURANTS_METRICS_TOKEN`, see `metrics.authorized`. Not found unless `RESTAURANTS_METRICS` is on.
+  """
+  if not metrics.is_enabled():
+    raise Http404()
+  if not metrics.authorized(request):
+    return HttpResponseForbidden()
+  return HttpResponse(metrics.render_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def search_cache_stats(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseForbidden]:
+  """
+  Serve the search cache's hits, misses and size as JSON, to requests bearing the
+  `RESTAURANTS_METRICS_TOKEN` like `metrics_text`.
+  """
+  if not metrics.authorized(request):
+    return HttpResponseForbidden()
+  return JsonResponse(search_cache.info())
+
+def search_batch(request: HttpRequest) -> t.Union[JsonResponse, HttpResponseBadRequest]:
+  """
+  Answer many searches in one request. Takes either repeated `timestamp` parameters, or a `start` and
+  `end` timestamp with an optional `step` in minutes (default 15), and returns JSON with the open
+  restaurant names for every timestamp.
+
+  :param request: The `request` parameter is of type `HttpRequest`
+  :type request: HttpRequest
+  :return: a `JsonResponse` of the form `{"results": [{"timestamp": ..., "restaurants": [...]}]}`, or an
+  `HttpResponseBadRequest` if no input is provided, a timestamp is malformed or the batch is larger than
+  `MAX_BATCH_SIZE`.
+  """
+  time_strings = request.GET.getlist("timestamp")
+  start_string = request.GET.get("start", None)
+  end_string = request.GET.get("end", None)
+  if not time_strings and not (start_string and end_string):
+    return HttpResponseBadRequest('No input provided.')
+  try:
+    if time_strings:
+      if len(time_strings) > MAX_BATCH_SIZE:
+        return HttpResponseBadRequest(f'At most {MAX_BATCH_SIZE} timestamps can be searched at once.')
+      datetimes = [parse_timestamp(time_string) for time_string in time_strings]
+    else:
+      start, end = parse_timestamp(start_string), parse_timestamp(end_string)
+      step = int(request.GET.get("step", 15))
+      if not 0 < step <= MINUTES_PER_WEEK or end < start:
+        return HttpResponseBadRequest(
+          f'The range needs a step of 1 to {MINUTES_PER_WEEK} minutes and an end after its start.'
+        )
+      step_delta = datetime.timedelta(minutes=step)
+      if (end - start) // step_delta + 1 > MAX_BATCH_SIZE:
+        return HttpResponseBadRequest(f'At most {MAX_BATCH_SIZE} timestamps can be searched at once.')
+      datetimes = [start]
+      # stop before stepping past the end, which may be the last representable datetime
+      while end - datetimes[-1] >= step_delta:
+        datetimes.append(datetimes[-1] + step_delta)
+      time_strings = [datetime_obj.strftime('%Y-%m-%d %H:%M:%S.%f') for datetime_obj in datetimes]
+  except (ValueError, OverflowError) as e:
+    return HttpResponseBadRequest(str(e))
+
+  results = execute_batch_search(datetimes)
+  return JsonResponse({
+    "results": [
+      {"timestamp": time_string, "restaurants": names}
+      for time_string, names in zip(time_strings, results)
+    ]
+  })